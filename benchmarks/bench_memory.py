@@ -0,0 +1,133 @@
+"""
+Memory footprint of fleet-scale snapshots.
+
+For each fleet size, builds synthetic ElementoMachines (with volumes, PCI devices and network configs) and a
+matching list of ElementoStorages, then reports:
+    - bytes per machine and per storage (tracemalloc, and resident set growth on Linux),
+    - peak memory while serializing the full listing with to_json_running and json.dumps, as /running does,
+    - memory still retained once the listing is dropped.
+Every size runs in a fresh interpreter, so the numbers do not depend on the previous sizes.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_memory [--sizes 1000 10000 100000] [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def rss_bytes() -> int:
+    """Current resident set size, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def rss_diff(after: int, before: int) -> int:
+    return after - before if after is not None and before is not None else None
+
+
+def measure(size: int) -> dict:
+    # Imported here so that their own footprint is not part of the fleet
+    from benchmarks.fleet import PRICE, make_fleet, make_storages
+
+    gc.collect()
+    tracemalloc.start()
+    rss_start = rss_bytes()
+    start = tracemalloc.get_traced_memory()[0]
+
+    fleet = make_fleet(size)
+    gc.collect()
+    after_fleet, rss_fleet = tracemalloc.get_traced_memory()[0], rss_bytes()
+
+    storages = make_storages(size)
+    gc.collect()
+    after_storages, rss_storages = tracemalloc.get_traced_memory()[0], rss_bytes()
+
+    tracemalloc.reset_peak()
+    listing = {"vms": [machine.to_json_running(price=PRICE) for machine in fleet]}
+    body = json.dumps(listing)
+    peak = tracemalloc.get_traced_memory()[1]
+    response_bytes = len(body)
+    del listing, body
+    gc.collect()
+    after_listing = tracemalloc.get_traced_memory()[0]
+    # The storages are kept alive up to here, so the listing is measured on top of the whole snapshot
+    del fleet, storages
+    tracemalloc.stop()
+
+    return {
+        "size": size,
+        "machine_bytes": (after_fleet - start) / size,
+        "machine_rss_bytes": rss_diff(rss_fleet, rss_start) / size if rss_start is not None else None,
+        "storage_bytes": (after_storages - after_fleet) / size,
+        "storage_rss_bytes": rss_diff(rss_storages, rss_fleet) / size if rss_fleet is not None else None,
+        "fleet_bytes": after_storages - start,
+        "listing_peak_bytes": peak - after_storages,
+        "listing_retained_bytes": after_listing - after_storages,
+        "response_bytes": response_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--output", default=None, help="JSON results file (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument("--single", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(measure(args.single)))
+        return
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = {result["size"]: result for result in json.load(file)["results"]}
+
+    results = []
+    for size in args.sizes:
+        run = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_memory", "--single", str(size)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(run.stdout)
+        results.append(result)
+        previous = baseline.get(size)
+        ratio = f" vs baseline {result['machine_bytes'] / previous['machine_bytes']:5.2f}x" if previous else ""
+        print(
+            f"size={size:<7} machine={result['machine_bytes']:9.0f}B storage={result['storage_bytes']:7.0f}B "
+            f"listing_peak={result['listing_peak_bytes'] / 2**20:8.1f}MiB "
+            f"retained={result['listing_retained_bytes'] / 2**20:6.2f}MiB{ratio}",
+            file=sys.stderr,
+        )
+
+    output = {
+        "benchmark": "bench_memory",
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Microbenchmarks of the hot pure-Python paths at fleet sizes from 10 to 100k.
+
+Cases: ElementoMachine.to_json/to_json_running/to_json_status (to_json_running also with the volumes referenced
+by volume_uuid and serialized once), ElementoStorage.to_json_response,
+check_vm_tolerance, check_storage_tolerance, register payload parsing (legacy get_from_dict and compiled
+parser) and uuid_to_int/int_to_uuid. Every case processes the whole fleet, the best of --repeat runs is kept.
+
+The results are written as JSON (--output), a previous output can be given as --baseline to print the ratios.
+
+This is a standalone script rather than a pytest-benchmark suite: pytest is pinned in requirements.txt but the
+repository has no tests for it to collect, and pytest-benchmark is not a dependency. The script needs only the
+runtime requirements, and its JSON output plays the role of pytest-benchmark's saved runs (--baseline).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_models [--sizes 10 100 1000 10000 100000] [--repeat 5]
+        [--cases to_json check_vm_tolerance ...] [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import copy
+import json
+import platform
+import sys
+import time
+import timeit
+from benchmarks.bench_request_parsing import sample_payload, legacy_parse, compiled_parse
+from benchmarks.fleet import SERVICE_COUNTRY, PRICE, make_fleet, make_storages
+from commons.utils import check_vm_tolerance, check_storage_tolerance, uuid_to_int, int_to_uuid
+from models.ComputeModel import ElementoMachine, ElementoCpu, ElementoMemory
+from models.StorageModel import ElementoStorage
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+MIN_BATCH_SECONDS = 0.2  # small fleets are run several times per measurement
+
+
+def requested_of(machine: ElementoMachine) -> ElementoMachine:
+    """A request close to the machine (same shape, 5% more memory), as compared by is_config_available."""
+    return ElementoMachine(
+        cpu=ElementoCpu(
+            slots=machine.cpu.slots,
+            fullPhysical=machine.cpu.fullPhysical,
+            maxOverprovision=machine.cpu.maxOverprovision,
+            min_frequency=machine.cpu.min_frequency,
+            arch=list(machine.cpu.arch),
+            flags=list(machine.cpu.flags),
+        ),
+        mem=ElementoMemory(capacity=int(machine.mem.capacity * 1.05), requireECC=machine.mem.requireECC),
+        pci=machine.pci,
+        misc=machine.misc,
+    )
+
+
+def by_reference(machine: ElementoMachine) -> ElementoMachine:
+    """The same machine with its volumes referenced by volume_uuid, as returned by the managers."""
+    referenced = copy.copy(machine)
+    referenced.volume_uuids = [volume.volume_uuid for volume in machine.volumes]
+    referenced.volumes = None
+    return referenced
+
+
+def requested_storage_of(storage: ElementoStorage) -> ElementoStorage:
+    return ElementoStorage(
+        size=storage.size + 1,
+        private=storage.private,
+        readonly=storage.readonly,
+        shareable=storage.shareable,
+        bootable=storage.bootable,
+    )
+
+
+def build_cases(size: int) -> dict:
+    """Returns {case: callable processing size items} with their data already built."""
+    fleet = make_fleet(size)
+    storages = make_storages(size)
+    requests = [requested_of(machine) for machine in fleet]
+    referenced = [by_reference(machine) for machine in fleet]
+    volumes = {volume.volume_uuid: volume.to_json() for machine in fleet for volume in machine.volumes}
+    storage_requests = [requested_storage_of(storage) for storage in storages]
+    # A few distinct payloads, reused round robin: parsing cost does not depend on the content
+    payloads = [sample_payload(volumes=i % 4, nested_req=i % 2 == 0) for i in range(16)]
+    bodies = [payloads[i % len(payloads)] for i in range(size)]
+    uuids = [machine.vm_uuid for machine in fleet]
+    ints = [uuid_to_int(vm_uuid) for vm_uuid in uuids]
+
+    return {
+        "machine.to_json": lambda: [machine.to_json() for machine in fleet],
+        "machine.to_json_running": lambda: [machine.to_json_running(price=PRICE) for machine in fleet],
+        "machine.to_json_running.by_reference": lambda: [
+            machine.to_json_running(price=PRICE, volumes=volumes) for machine in referenced
+        ],
+        "machine.to_json_status": lambda: [machine.to_json_status() for machine in fleet],
+        "storage.to_json_response": lambda: [storage.to_json_response() for storage in storages],
+        "check_vm_tolerance": lambda: [
+            check_vm_tolerance(requested, proposed) for requested, proposed in zip(requests, fleet)
+        ],
+        "check_storage_tolerance": lambda: [
+            check_storage_tolerance(requested, proposed) for requested, proposed in zip(storage_requests, storages)
+        ],
+        "parse.legacy": lambda: [legacy_parse(body, SERVICE_COUNTRY) for body in bodies],
+        "parse.compiled": lambda: [compiled_parse(body, SERVICE_COUNTRY) for body in bodies],
+        "uuid_to_int": lambda: [uuid_to_int(vm_uuid) for vm_uuid in uuids],
+        "int_to_uuid": lambda: [int_to_uuid(value) for value in ints],
+    }
+
+
+def measure(fun, size: int, repeat: int) -> dict:
+    # Calibrate the number of runs per measurement so that each one lasts at least MIN_BATCH_SECONDS
+    start = time.perf_counter()
+    fun()
+    once = max(time.perf_counter() - start, 1e-9)
+    number = max(1, int(MIN_BATCH_SECONDS / once))
+    best = min(timeit.repeat(fun, repeat=repeat, number=number)) / number
+    return {"size": size, "total_s": best, "per_item_us": best / size * 1e6, "number": number, "repeat": repeat}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cases", nargs="+", default=None, help="run only these cases (default: all)")
+    parser.add_argument("--output", default=None, help="JSON results file (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = {(result["case"], result["size"]): result for result in json.load(file)["results"]}
+
+    results = []
+    for size in args.sizes:
+        cases = build_cases(size)
+        for case, fun in cases.items():
+            if args.cases is not None and case not in args.cases:
+                continue
+            result = {"case": case, **measure(fun, size, args.repeat)}
+            results.append(result)
+            previous = baseline.get((case, size))
+            ratio = f" vs baseline {previous['total_s'] / result['total_s']:5.2f}x" if previous else ""
+            print(
+                f"{case:<38} size={size:<7} total={result['total_s'] * 1000:10.3f}ms "
+                f"per_item={result['per_item_us']:8.3f}us{ratio}",
+                file=sys.stderr,
+            )
+
+    output = {
+        "benchmark": "bench_models",
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
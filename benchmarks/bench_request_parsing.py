@@ -0,0 +1,161 @@
+"""
+Microbenchmark of the register payload parsing.
+
+Compares the compiled pydantic parser (models.RequestModel.parse_machine_request) with the previous
+get_from_dict based construction of the ElementoMachine, starting from the raw request body. The compiled
+parser validates every field, the legacy one does not: the speedup column shows what that validation costs,
+or saves, for each payload shape (req as an object or as a JSON encoded string, with 0 to 16 volumes).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_request_parsing [--repeat 5] [--number 2000]
+"""
+import argparse
+import json
+import timeit
+from commons.utils import get_from_dict
+from models.ComputeModel import (
+    ElementoMachine,
+    ElementoCpu,
+    ElementoMisc,
+    ElementoAuth,
+    ElementoMemory,
+    ElementoPciDev,
+)
+from models.RequestModel import parse_machine_request
+from models.StorageModel import ElementoStorage
+
+SERVICE_COUNTRY = "bench-region"
+
+
+def sample_payload(volumes: int = 2, nested_req: bool = True) -> bytes:
+    req = {
+        "cpu": {"slots": 4, "maxOverprovision": 2, "min_frequency": 2.4, "arch": ["x86"], "flags": ["avx2"]},
+        "mem": {"capacity": 8192, "reqECC": False},
+        "misc": {"os_family": "linux", "os_flavour": "ubuntu"},
+        "pci": {"devices": {"10de:2204": 1}},
+    }
+    payload = {
+        "client_uuid": "079b72f8-edf1-4fa9-8b22-2b1e364acdc7",
+        "vm_name": "bench-vm",
+        "req": json.dumps(req) if nested_req else req,
+        "volumes": [
+            {"volume_uuid": None, "name": f"volume-{i}", "size": 40, "bootable": i == 0}
+            for i in range(volumes)
+        ],
+        "authentication": {"username": "elemento", "password": None, "ssh-key": "ssh-ed25519 AAAA"},
+    }
+    return json.dumps(payload).encode()
+
+
+def legacy_parse(body: bytes, service_country: str) -> ElementoMachine:
+    """The get_from_dict based construction previously inlined in server_creation."""
+    servers_to_create = json.loads(body)
+    req_data = (
+        get_from_dict(servers_to_create, "req")
+        if type(servers_to_create["req"]) is dict
+        else json.loads(get_from_dict(servers_to_create, "req"))
+    )
+    client_uuid = get_from_dict(servers_to_create, "client_uuid")
+    vm_name = get_from_dict(servers_to_create, "vm_name")
+
+    if req_data.get("pci") is not None:
+        pci_devices = get_from_dict(req_data, "pci", "devices")
+        elemento_pci_devices = []
+        for key in pci_devices:
+            pci_vendor, pci_model = key.split(":")
+            pci_quantity = get_from_dict(pci_devices, key)
+            elemento_pci_devices.append(
+                ElementoPciDev(vendor=pci_vendor, model=pci_model, quantity=pci_quantity)
+            )
+    else:
+        elemento_pci_devices = None
+
+    if servers_to_create.get("volumes") != [] and servers_to_create.get("volumes") is not None:
+        volumes_to_attach = get_from_dict(servers_to_create, "volumes")
+        elemento_volumes = []
+        for volume in volumes_to_attach:
+            elemento_volumes.append(
+                ElementoStorage(
+                    creator_id=client_uuid,
+                    csp_region=service_country,
+                    volume_uuid=volume.get("volume_uuid"),
+                    name=get_from_dict(volume, "name"),
+                    private=volume.get("private"),
+                    readonly=volume.get("readonly"),
+                    shareable=volume.get("shareable"),
+                    bootable=volume.get("bootable"),
+                    size=get_from_dict(volume, "size"),
+                )
+            )
+    else:
+        elemento_volumes = None
+
+    return ElementoMachine(
+        csp_region=service_country,
+        client_uuid=client_uuid,
+        vm_name=vm_name,
+        volumes=elemento_volumes,
+        cpu=ElementoCpu(
+            slots=get_from_dict(req_data, "cpu", "slots"),
+            fullPhysical=(
+                get_from_dict(req_data, "cpu").get("fullPhysical")
+                if get_from_dict(req_data, "cpu").get("fullPhysical") is not None
+                else False
+            ),
+            maxOverprovision=(
+                get_from_dict(req_data, "cpu").get("maxOverprovision")
+                if get_from_dict(req_data, "cpu").get("maxOverprovision") is not None
+                else 1
+            ),
+            min_frequency=get_from_dict(req_data, "cpu", "min_frequency"),
+            arch=get_from_dict(req_data, "cpu", "arch"),
+            flags=get_from_dict(req_data, "cpu", "flags"),
+        ),
+        mem=ElementoMemory(
+            capacity=get_from_dict(req_data, "mem", "capacity"),
+            requireECC=get_from_dict(req_data, "mem").get("reqECC"),
+        ),
+        pci=elemento_pci_devices,
+        misc=ElementoMisc(
+            os_family=get_from_dict(req_data, "misc", "os_family"),
+            os_flavour=get_from_dict(req_data, "misc", "os_flavour"),
+        ),
+        network_config=None,
+        auth=ElementoAuth(
+            username=get_from_dict(servers_to_create, "authentication").get("username"),
+            password=get_from_dict(servers_to_create, "authentication").get("password"),
+            ssh_key=get_from_dict(servers_to_create, "authentication").get("ssh-key"),
+        ),
+    )
+
+
+def compiled_parse(body: bytes, service_country: str) -> ElementoMachine:
+    return parse_machine_request(body, service_country, register=True)
+
+
+def measure(fun, body: bytes, repeat: int, number: int) -> float:
+    """Returns the best time per call in microseconds."""
+    timings = timeit.repeat(lambda: fun(body, SERVICE_COUNTRY), repeat=repeat, number=number)
+    return min(timings) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    for volumes in [0, 2, 16]:
+        for nested_req in [False, True]:
+            body = sample_payload(volumes=volumes, nested_req=nested_req)
+            assert compiled_parse(body, SERVICE_COUNTRY).to_json() == legacy_parse(body, SERVICE_COUNTRY).to_json()
+            legacy = measure(legacy_parse, body, args.repeat, args.number)
+            compiled = measure(compiled_parse, body, args.repeat, args.number)
+            print(
+                f"volumes={volumes:<3} nested_req={str(nested_req):<5} "
+                f"legacy={legacy:8.2f}us compiled={compiled:8.2f}us speedup={legacy / compiled:5.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Synthetic fleets shared by the benchmarks: deterministic ElementoMachines (with volumes, PCI devices and network
+configs) and ElementoStorages, built without any provider call.
+"""
+import random
+import uuid
+from models.ComputeModel import (
+    ElementoMachine,
+    ElementoCpu,
+    ElementoMisc,
+    ElementoAuth,
+    ElementoMemory,
+    ElementoPciDev,
+    ElementoNetworkConfig,
+)
+from models.StorageModel import ElementoStorage
+
+SERVICE_COUNTRY = "bench-region"
+PRICE = {"hour": 0.05, "month": 36.0, "year": 432.0, "currency": "EUR"}
+
+SLOTS = [1, 2, 4, 8, 16]
+CAPACITIES = [1024, 2048, 4096, 8192, 16384, 32768]
+SIZES = [10, 20, 40, 80, 160, 500, 1000]
+GPUS = [("10de", "2204"), ("10de", "20b0"), ("1002", "73bf")]
+
+
+def make_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+def make_storage(rng: random.Random, client_uuid: str, index: int) -> ElementoStorage:
+    return ElementoStorage(
+        csp_region=SERVICE_COUNTRY,
+        volume_uuid=make_uuid(rng),
+        creator_id=client_uuid,
+        billing_uuid=make_uuid(rng),
+        name=f"volume-{index}",
+        private=rng.random() < 0.5,
+        readonly=rng.random() < 0.1,
+        shareable=rng.random() < 0.2,
+        bootable=index == 0,
+        size=rng.choice(SIZES),
+        creation_date="2025-06-26 12:00:00",
+    )
+
+
+def make_machine(rng: random.Random, client_uuid: str, volumes: int = 2, pci: int = 1) -> ElementoMachine:
+    return ElementoMachine(
+        csp_region=SERVICE_COUNTRY,
+        client_uuid=client_uuid,
+        vm_name=f"vm-{rng.getrandbits(32):08x}",
+        volumes=[make_storage(rng, client_uuid, i) for i in range(volumes)],
+        billing_uuid=make_uuid(rng),
+        vm_uuid=make_uuid(rng),
+        cpu=ElementoCpu(
+            slots=rng.choice(SLOTS),
+            fullPhysical=False,
+            maxOverprovision=rng.choice([1, 2, 4]),
+            min_frequency=2.4,
+            arch=["x86"],
+            flags=["avx2", "sse4_2"],
+        ),
+        mem=ElementoMemory(capacity=rng.choice(CAPACITIES), requireECC=rng.random() < 0.3),
+        pci=[
+            ElementoPciDev(vendor=vendor, model=model, quantity=1)
+            for vendor, model in rng.sample(GPUS, min(pci, len(GPUS)))
+        ],
+        misc=ElementoMisc(os_family="linux", os_flavour=rng.choice(["ubuntu", "debian", "rocky"])),
+        network_config=ElementoNetworkConfig(
+            ipv4=f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+            ipv6=f"2001:db8::{rng.getrandbits(16):x}",
+            mac=":".join(f"{rng.randrange(256):02x}" for _ in range(6)),
+        ),
+        private_network_config=ElementoNetworkConfig(
+            ipv4=f"192.168.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+            mac=":".join(f"{rng.randrange(256):02x}" for _ in range(6)),
+        ),
+        auth=ElementoAuth(username="elemento", ssh_key="ssh-ed25519 AAAA"),
+        creation_date="2025-06-26 12:00:00",
+        notes={"flavor": "bench"},
+    )
+
+
+def make_fleet(size: int, clients: int = 100, seed: int = 42) -> list[ElementoMachine]:
+    """Returns size machines spread over clients clients, always the same for the same arguments."""
+    rng = random.Random(seed)
+    client_uuids = [make_uuid(rng) for _ in range(max(1, min(clients, size)))]
+    return [make_machine(rng, client_uuids[i % len(client_uuids)]) for i in range(size)]
+
+
+def make_storages(size: int, clients: int = 100, seed: int = 42) -> list[ElementoStorage]:
+    rng = random.Random(seed)
+    client_uuids = [make_uuid(rng) for _ in range(max(1, min(clients, size)))]
+    return [make_storage(rng, client_uuids[i % len(client_uuids)], i) for i in range(size)]
@@ -0,0 +1,279 @@
+import asyncio
+import cProfile
+import hmac
+import os
+import traceback
+
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from commons.allocations import ALLOCATIONS_FRAMES, allocations, AllocationMiddleware
+from commons.instrumentation import registry, InstrumentationMiddleware
+from commons.loopwatch import watchdog, LoopWatchMiddleware
+from commons.profiling import (
+    PROFILER_ENABLED,
+    PROFILER_INTERVAL,
+    PROFILER_MAX_SECONDS,
+    StackSampler,
+    profiler_lock,
+    pstats_report,
+)
+from commons.slowlog import slow_requests, SlowRequestMiddleware
+from commons.tracing import exporter, TracingMiddleware
+from errors.client_errors import ElementoBadRequest, ElementoNotFound, BadRequestFieldError
+from errors.server_errors import ElementoServiceUnavailable
+
+# Internal endpoints shared by the compute, storage and service mesons, they are not part of the public API.
+# All of them (metrics, traces and the diagnostics) require the admin_token header to match MESON_ADMIN_TOKEN.
+
+ADMIN_TOKEN = os.getenv("MESON_ADMIN_TOKEN")
+
+router = APIRouter(prefix="/api/v1.0/internal", include_in_schema=False)
+
+
+def is_admin(req: Request) -> bool:
+    token = req.headers.get("admin_token")
+    return ADMIN_TOKEN is not None and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def admin_not_found(meson_source: str):
+    # Disabled and unauthorized diagnostics look the same, so their existence is not disclosed
+    return ElementoNotFound(
+        origin="MESON",
+        error="Not found",
+        trace=traceback.format_exc(),
+        meson_source=meson_source,
+    )
+
+
+def admin_bad_request(field: str, expected_value: str, meson_source: str):
+    return ElementoBadRequest(
+        origin="MESON",
+        error="Bad Request",
+        field_errors=[
+            BadRequestFieldError(
+                field=field,
+                where="QUERY",
+                error="WRONG_VALUE",
+                type="str",
+                expected_value=expected_value,
+            )
+        ],
+        docs_url="",
+        trace=traceback.format_exc(),
+        meson_source=meson_source,
+    )
+
+
+@router.get("/metrics")
+def internal_metrics(req: Request):
+    if not is_admin(req):
+        return admin_not_found("internal_metrics()")
+    return PlainTextResponse(
+        status_code=200,
+        content=registry.render(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@router.get("/traces")
+def internal_traces(req: Request):
+    if not is_admin(req):
+        return admin_not_found("internal_traces()")
+    trace_id = req.query_params.get("trace_id")
+    try:
+        limit = int(req.query_params.get("limit", 100))
+    except ValueError:
+        limit = 100
+    return JSONResponse(status_code=200, content={"traces": exporter.traces(trace_id, limit)})
+
+
+@router.get("/profile")
+async def internal_profile(req: Request):
+    """Profiles the worker for the given number of seconds, without blocking the requests being served.
+
+    Query parameters: seconds (default 10, up to MESON_PROFILER_MAX_SECONDS), mode (sampler for collapsed
+    stacks of every thread, cprofile for the pstats report of the event loop thread), interval (sampler
+    only) and sort (cprofile only, a pstats sort key).
+    """
+    if not PROFILER_ENABLED or not is_admin(req):
+        return admin_not_found("internal_profile()")
+
+    mode = req.query_params.get("mode", "sampler")
+    if mode not in ("sampler", "cprofile"):
+        return admin_bad_request("mode", "sampler or cprofile", "internal_profile()")
+    try:
+        seconds = float(req.query_params.get("seconds", 10))
+        if not 0 < seconds <= PROFILER_MAX_SECONDS:
+            raise ValueError(seconds)
+    except ValueError:
+        return admin_bad_request("seconds", f"between 0 and {PROFILER_MAX_SECONDS}", "internal_profile()")
+    try:
+        interval = float(req.query_params.get("interval", PROFILER_INTERVAL))
+        if not 0.001 <= interval <= 1:
+            raise ValueError(interval)
+    except ValueError:
+        return admin_bad_request("interval", "between 0.001 and 1", "internal_profile()")
+    sort = req.query_params.get("sort", "cumulative")
+
+    if not profiler_lock.acquire(blocking=False):
+        return ElementoServiceUnavailable(
+            origin="MESON",
+            error="A profile is already running on this worker",
+            trace=traceback.format_exc(),
+            meson_source="internal_profile()",
+            service_failed=["profiler"],
+        )
+    try:
+        if mode == "sampler":
+            sampler = StackSampler(interval)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+            return PlainTextResponse(
+                status_code=200,
+                content=sampler.collapsed(),
+                headers={"samples": str(sampler.samples)},
+            )
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already attached to the interpreter
+            return ElementoServiceUnavailable(
+                origin="MESON",
+                error="Another profiler is active on this worker",
+                trace=traceback.format_exc(),
+                meson_source="internal_profile()",
+                service_failed=["profiler"],
+            )
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        try:
+            report = pstats_report(profiler, sort)
+        except KeyError:
+            return admin_bad_request("sort", "a pstats sort key, e.g. cumulative or tottime", "internal_profile()")
+        return PlainTextResponse(status_code=200, content=report)
+    finally:
+        profiler_lock.release()
+
+
+@router.get("/slow")
+def internal_slow_requests(req: Request):
+    """Returns the most recent requests slower than MESON_SLOWLOG_THRESHOLD_MS with their phase breakdown.
+
+    Query parameters: route (a route template, e.g. /api/v1.0/running), min_ms and limit (default 100).
+    """
+    if not is_admin(req):
+        return admin_not_found("internal_slow_requests()")
+    try:
+        min_ms = float(req.query_params.get("min_ms", 0))
+    except ValueError:
+        return admin_bad_request("min_ms", "a number of milliseconds", "internal_slow_requests()")
+    try:
+        limit = int(req.query_params.get("limit", 100))
+    except ValueError:
+        return admin_bad_request("limit", "an integer", "internal_slow_requests()")
+    return JSONResponse(
+        status_code=200,
+        content={"requests": slow_requests.query(req.query_params.get("route"), min_ms, limit)},
+    )
+
+
+def allocation_query(req: Request, meson_source: str):
+    """Returns (limit, group_by) of the allocation endpoints, or the error response."""
+    group_by = req.query_params.get("group_by", "lineno")
+    if group_by not in ("lineno", "filename", "traceback"):
+        return None, admin_bad_request("group_by", "lineno, filename or traceback", meson_source)
+    try:
+        return (int(req.query_params.get("limit", 20)), group_by), None
+    except ValueError:
+        return None, admin_bad_request("limit", "an integer", meson_source)
+
+
+@router.get("/allocations")
+def internal_allocations(req: Request):
+    """Returns the tracemalloc status, the allocations by route and the top allocation sites."""
+    if not is_admin(req):
+        return admin_not_found("internal_allocations()")
+    query, error = allocation_query(req, "internal_allocations()")
+    if error is not None:
+        return error
+    status = allocations.status()
+    status["top"] = allocations.top(*query) if allocations.enabled else []
+    return JSONResponse(status_code=200, content=status)
+
+
+@router.post("/allocations/start")
+def internal_allocations_start(req: Request):
+    if not is_admin(req):
+        return admin_not_found("internal_allocations_start()")
+    try:
+        frames = int(req.query_params.get("frames", ALLOCATIONS_FRAMES))
+        if not 1 <= frames <= 64:
+            raise ValueError(frames)
+    except ValueError:
+        return admin_bad_request("frames", "between 1 and 64", "internal_allocations_start()")
+    allocations.start(frames)
+    return JSONResponse(status_code=200, content=allocations.status())
+
+
+@router.post("/allocations/stop")
+def internal_allocations_stop(req: Request):
+    if not is_admin(req):
+        return admin_not_found("internal_allocations_stop()")
+    allocations.stop()
+    return JSONResponse(status_code=200, content=allocations.status())
+
+
+@router.post("/allocations/snapshots/{name}")
+def internal_allocations_snapshot(req: Request, name: str):
+    if not is_admin(req) or not allocations.enabled:
+        return admin_not_found("internal_allocations_snapshot()")
+    allocations.take_snapshot(name)
+    return JSONResponse(status_code=201, content={"snapshots": sorted(allocations.snapshots)})
+
+
+@router.get("/allocations/diff")
+def internal_allocations_diff(req: Request):
+    """Returns the sites that grew the most between the snapshots from and to (now if to is missing)."""
+    if not is_admin(req) or not allocations.enabled:
+        return admin_not_found("internal_allocations_diff()")
+    query, error = allocation_query(req, "internal_allocations_diff()")
+    if error is not None:
+        return error
+    first = req.query_params.get("from")
+    second = req.query_params.get("to")
+    for field, name in [("from", first), ("to", second)]:
+        if (name is not None or field == "from") and name not in allocations.snapshots:
+            return admin_bad_request(field, f"one of {sorted(allocations.snapshots)}", "internal_allocations_diff()")
+    return JSONResponse(status_code=200, content={"diff": allocations.diff(first, second, *query)})
+
+
+@router.get("/loop")
+def internal_loop(req: Request):
+    """Returns the recent event loop lag percentiles and the last stalls with the blocking stack and route."""
+    if not is_admin(req):
+        return admin_not_found("internal_loop()")
+    return JSONResponse(status_code=200, content=watchdog.status())
+
+
+def install_admin(app: FastAPI, app_name: str):
+    """Adds the request instrumentation, tracing, slow request log, allocation tracking and event loop
+    watchdog and the internal endpoints to a meson app.
+
+    Args:
+        app (FastAPI): The meson app.
+        app_name (str): The value of the app label of the exported metrics (compute, storage or service).
+    """
+    registry.app_name = app_name
+    app.add_middleware(InstrumentationMiddleware, registry=registry)
+    app.add_middleware(TracingMiddleware)
+    app.add_middleware(SlowRequestMiddleware)
+    app.add_middleware(AllocationMiddleware)
+    app.add_middleware(LoopWatchMiddleware)
+    app.include_router(router)
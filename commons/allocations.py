@@ -0,0 +1,162 @@
+import linecache
+import os
+import threading
+import time
+import tracemalloc
+
+
+ALLOCATIONS_ENABLED = os.getenv("MESON_TRACEMALLOC", "false").lower() in ("1", "true")  # tracing from startup
+ALLOCATIONS_FRAMES = int(os.getenv("MESON_TRACEMALLOC_FRAMES", 1))
+ALLOCATIONS_MAX_SNAPSHOTS = int(os.getenv("MESON_TRACEMALLOC_MAX_SNAPSHOTS", 8))
+
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class _RouteAllocations:
+    __slots__ = ("requests", "retained", "peak")
+
+    def __init__(self):
+        self.requests = 0
+        self.retained = 0
+        self.peak = 0
+
+    def to_json(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retained_bytes": self.retained,
+            "retained_bytes_per_request": self.retained / self.requests if self.requests > 0 else 0,
+            "max_peak_bytes": self.peak,
+        }
+
+
+class AllocationProfiler:
+    """
+    Switchable tracemalloc mode attributing allocations to routes, with top allocation sites and named snapshots.
+
+    While tracing, every request records the memory it retained (traced memory after minus before) and the peak
+    reached above the starting point. tracemalloc counters are process-wide: with concurrent requests the
+    numbers of overlapping requests include each other, so compare routes over many requests, not single ones.
+    Named snapshots can be diffed later on to spot what grew in between, e.g. inventories or pricing caches.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.snapshots = {}
+        self.started = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = ALLOCATIONS_FRAMES):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self.started = time.time()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.started = None
+        self.routes = {}
+        self.snapshots = {}
+        self._in_flight = 0
+
+    def request_started(self) -> int:
+        with self._lock:
+            if self._in_flight == 0:
+                tracemalloc.reset_peak()
+            self._in_flight += 1
+        return tracemalloc.get_traced_memory()[0]
+
+    def request_finished(self, route: str, before: int):
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = _RouteAllocations()
+            stats.requests += 1
+            stats.retained += current - before
+            stats.peak = max(stats.peak, peak - before)
+
+    def status(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if self.enabled else (0, 0)
+        return {
+            "enabled": self.enabled,
+            "started": self.started,
+            "frames": tracemalloc.get_traceback_limit() if self.enabled else None,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "snapshots": sorted(self.snapshots),
+            "routes": {route: stats.to_json() for route, stats in sorted(self.routes.items())},
+        }
+
+    def top(self, limit: int = 20, group_by: str = "lineno") -> list[dict]:
+        """Returns the allocation sites holding the most memory right now."""
+        statistics = self._snapshot().statistics(group_by)
+        return [self._statistic(statistic) for statistic in statistics[:limit]]
+
+    def take_snapshot(self, name: str):
+        if len(self.snapshots) >= ALLOCATIONS_MAX_SNAPSHOTS and name not in self.snapshots:
+            # Snapshots are large, the oldest one makes room for the new one
+            del self.snapshots[min(self.snapshots, key=lambda key: self.snapshots[key][0])]
+        self.snapshots[name] = (time.time(), self._snapshot())
+
+    def diff(self, first: str, second: str = None, limit: int = 20, group_by: str = "lineno") -> list[dict]:
+        """Returns the sites that grew the most between two named snapshots (or a snapshot and now).
+
+        Raises:
+            KeyError: Raised when a snapshot does not exist.
+        """
+        old = self.snapshots[first][1]
+        new = self.snapshots[second][1] if second is not None else self._snapshot()
+        statistics = new.compare_to(old, group_by)
+        return [
+            {**self._statistic(statistic), "size_diff": statistic.size_diff, "count_diff": statistic.count_diff}
+            for statistic in statistics[:limit]
+        ]
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    @staticmethod
+    def _statistic(statistic) -> dict:
+        return {
+            "site": [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback],
+            "size": statistic.size,
+            "count": statistic.count,
+        }
+
+
+allocations = AllocationProfiler()
+if ALLOCATIONS_ENABLED:
+    allocations.start()
+
+
+class AllocationMiddleware:
+    """ASGI middleware attributing the allocations of every request to its route while tracemalloc is on."""
+
+    def __init__(self, app, profiler: AllocationProfiler = allocations):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        before = self.profiler.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            if self.profiler.enabled:
+                self.profiler.request_finished(route.path if route is not None else "unmatched", before)
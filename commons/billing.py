@@ -1,7 +1,12 @@
 import logging
 import requests
 import os
+import threading
+import time
 from commons.utils import get_from_dict
+from commons.instrumentation import registry
+from commons.tracing import instrument_module
+from models.FingerprintModel import FingerprintMixin
 
 # TODO: redo the logic
 
@@ -13,6 +18,10 @@ else:
     PORTAL_URL = os.getenv("ELEMENTO_PORTAL")
 #! -------------------------------
 
+PRICING_CACHE_TTL = int(os.getenv("PRICING_CACHE_TTL", 300))  # seconds
+pricing_cache = {}
+pricing_cache_lock = threading.Lock()
+
 
 # Athentication into the billing portal
 def auth_billing():
@@ -102,6 +111,40 @@ def update_billing_details(billing_uuid: str, status: str, reseller_id: str):
         raise Exception(f"update_billing_details - {error.__str__()}")
 
 
+# Updates (or stops) the billing of several services at once: a single authentication and connection
+# are shared by all the updates, a failed update does not stop the others
+def update_billing_details_bulk(billing_uuids: list[str], status: str, reseller_id: str) -> dict:
+    try:
+        authz_token = auth_billing()
+    except Exception as error:
+        logging.error(f"update_billing_details_bulk - {error.__str__()}")
+        raise Exception(f"update_billing_details_bulk - {error.__str__()}")
+
+    results = {}
+    headers = {"Content-Type": "application/json"}
+    with requests.Session() as session:
+        for billing_uuid in billing_uuids:
+            payload = {
+                "authz_account_entity": os.getenv("ELEMENTO_ACCOUNT_ENTITY"),
+                "authz_token": authz_token,
+                "target_entity": os.getenv("ELEMENTO_ACCOUNT_TARGET"),
+                "reseller_id": reseller_id,
+                "billing_entry_id": billing_uuid,
+                "status": status,
+            }
+            try:
+                with session.post(PORTAL_URL + "/billing/update/status", headers=headers, json=payload) as r:
+                    if r.status_code == 200:
+                        results[billing_uuid] = r.json()
+                    else:
+                        raise Exception(f"portal error - {r.text}")
+            except Exception as error:
+                logging.error(f"update_billing_details_bulk ({billing_uuid}) - {error.__str__()}")
+                results[billing_uuid] = Exception(f"update_billing_details_bulk - {error.__str__()}")
+    logging.info(f"Billing status updated for {len(billing_uuids)} services")
+    return results
+
+
 def get_pricing(config) -> dict:
     try:
         if os.getenv("PORTAL_DEV_MODE"):  ##! TMP
@@ -144,4 +187,41 @@ def get_pricing(config) -> dict:
         return pricing
     except ValueError as error:
         logging.error(f"get_pricing - {error.__str__()}")
-        raise Exception(f"get_pricing: error in retrieve pricing - {error.__str__()}")
\ No newline at end of file
+        raise Exception(f"get_pricing: error in retrieve pricing - {error.__str__()}")
+
+
+# Returns the pricing of a model, configurations sharing the same fingerprint share the same price. A machine
+# referencing its volumes by id (volume_uuids) is priced with them: volumes are the ElementoStorage by volume_uuid
+def get_model_pricing(model: FingerprintMixin, volumes: dict = None) -> dict:
+    attached = {}
+    if getattr(model, "volumes", None) is None and volumes:
+        attached = {
+            volume_uuid: volumes[volume_uuid]
+            for volume_uuid in getattr(model, "volume_uuids", None) or []
+            if volume_uuid in volumes
+        }
+    key = (
+        model.fingerprint(),
+        getattr(model, "csp_region", None),
+        tuple(sorted(storage.fingerprint() for storage in attached.values())),
+    )
+    now = time.monotonic()
+    cached = pricing_cache.get(key)
+    hit = cached is not None and cached[0] > now
+    registry.record_cache("pricing", hit)
+    if hit:
+        return cached[1]
+
+    if len(attached) > 0:
+        pricing = get_pricing(model.to_json(volumes={volume_uuid: storage.to_json() for volume_uuid, storage in attached.items()}))
+    else:
+        pricing = get_pricing(model.to_json())
+    if pricing is not None and PRICING_CACHE_TTL > 0:
+        with pricing_cache_lock:
+            if len(pricing_cache) > 10000:
+                pricing_cache.clear()
+            pricing_cache[key] = (now + PRICING_CACHE_TTL, pricing)
+    return pricing
+
+# Every public function above is traced (see commons/tracing.py), keep this call at the end of the module
+instrument_module(__name__, phase="billing", phases={"get_pricing": "pricing", "get_model_pricing": "pricing"})
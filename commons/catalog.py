@@ -0,0 +1,360 @@
+import bisect
+import logging
+import os
+import threading
+from typing import Callable
+from commons.scoring import VmToleranceScorer, arch_key, pci_key, storage_flags_key
+from commons.utils import TOLERANCE, check_vm_tolerance
+from commons.instrumentation import registry
+from models.ComputeModel import ElementoMachine, ElementoCpu, ElementoMemory
+from models.StorageModel import ElementoStorage
+
+
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", 900))  # seconds
+
+
+def nearest_index(values: list, target) -> int:
+    """Returns the index of the value closest to target in a sorted list.
+
+    Ties are resolved upwards, so 6GiB between 4GiB and 8GiB resolves to 8GiB, while
+    512MiB between 500MiB and 1GiB resolves to 500MiB.
+    """
+    i = bisect.bisect_left(values, target)
+    if i == 0:
+        return 0
+    if i == len(values):
+        return i - 1
+    return i - 1 if (target - values[i - 1]) < (values[i] - target) else i
+
+
+class _ComputeCell:
+    """Flavors sharing the same slots and memory capacity, sorted by cpu frequency, the ECC ones also apart."""
+
+    def __init__(self):
+        self.frequencies = []
+        self.flavors = []
+        self.ecc_frequencies = []
+        self.ecc_flavors = []
+
+    def add(self, flavor: ElementoMachine):
+        i = bisect.bisect_right(self.frequencies, flavor.cpu.min_frequency)
+        self.frequencies.insert(i, flavor.cpu.min_frequency)
+        self.flavors.insert(i, flavor)
+        if flavor.mem.requireECC:
+            i = bisect.bisect_right(self.ecc_frequencies, flavor.cpu.min_frequency)
+            self.ecc_frequencies.insert(i, flavor.cpu.min_frequency)
+            self.ecc_flavors.insert(i, flavor)
+
+    def max_frequency(self, require_ecc: bool) -> float:
+        frequencies = self.ecc_frequencies if require_ecc else self.frequencies
+        return frequencies[-1] if frequencies else float("-inf")
+
+    def find(self, min_frequency: float, require_ecc: bool):
+        frequencies, flavors = (
+            (self.ecc_frequencies, self.ecc_flavors) if require_ecc else (self.frequencies, self.flavors)
+        )
+        i = bisect.bisect_left(frequencies, min_frequency)
+        return flavors[i] if i < len(flavors) else None
+
+
+def _suffix_max(values: list) -> list:
+    result = list(values)
+    for i in range(len(result) - 2, -1, -1):
+        result[i] = max(result[i], result[i + 1])
+    return result
+
+
+class _ComputeGroup:
+    """
+    Flavors sharing the same arch and PCI devices, indexed by slots and then memory.
+
+    For each slots tier, reach[require_ecc][tier][c] is the highest cpu frequency offered by the cells of
+    capacity index c or above, so the fallback search stops as soon as no bigger cell can match instead of
+    visiting every cell and flavor.
+    """
+
+    def __init__(self, flavors: list[ElementoMachine]):
+        cells = {}
+        for flavor in flavors:
+            cells.setdefault(flavor.cpu.slots, {}).setdefault(
+                flavor.mem.capacity, _ComputeCell()
+            ).add(flavor)
+
+        self.slots = sorted(cells.keys())
+        self.capacities = [sorted(cells[slots].keys()) for slots in self.slots]
+        self.cells = [
+            [cells[slots][capacity] for capacity in capacities]
+            for slots, capacities in zip(self.slots, self.capacities)
+        ]
+        self.reach = {
+            require_ecc: [_suffix_max([cell.max_frequency(require_ecc) for cell in tier]) for tier in self.cells]
+            for require_ecc in (False, True)
+        }
+
+    def find(self, config: ElementoMachine):
+        require_ecc = bool(config.mem.requireECC)
+        start_slot = nearest_index(self.slots, config.cpu.slots)
+        # Nearest slots tier first, then fall back to bigger tiers only
+        for s in range(start_slot, len(self.slots)):
+            capacities = self.capacities[s]
+            reach = self.reach[require_ecc][s]
+            start_capacity = (
+                nearest_index(capacities, config.mem.capacity)
+                if s == start_slot
+                else bisect.bisect_left(capacities, config.mem.capacity)
+            )
+            for c in range(start_capacity, len(capacities)):
+                if reach[c] < config.cpu.min_frequency:
+                    break
+                flavor = self.cells[s][c].find(config.cpu.min_frequency, require_ecc)
+                if flavor is not None:
+                    return flavor
+        return None
+
+
+class ComputeIndex:
+    """Immutable index over the flavors offered by the provider in a single region."""
+
+    def __init__(self, flavors: list[ElementoMachine]):
+        self.flavors = flavors
+        self._scorer = None
+        grouped = {}
+        for flavor in flavors:
+            if flavor.cpu is None or flavor.mem is None:
+                continue
+            grouped.setdefault((arch_key(flavor.cpu), pci_key(flavor.pci)), []).append(flavor)
+
+        self.size = sum(len(group) for group in grouped.values())
+        self.groups = {key: _ComputeGroup(group) for key, group in grouped.items()}
+
+    def find(self, config: ElementoMachine):
+        group = self.groups.get((arch_key(config.cpu), pci_key(config.pci)))
+        return group.find(config) if group is not None else None
+
+    @property
+    def scorer(self) -> VmToleranceScorer:
+        if self._scorer is None:
+            self._scorer = VmToleranceScorer(self.flavors)
+        return self._scorer
+
+
+def propose_machine(requested: ElementoMachine, flavor: ElementoMachine) -> ElementoMachine:
+    """Builds the proposed configuration by fitting the requested machine onto a flavor."""
+    return ElementoMachine(
+        csp_region=requested.csp_region,
+        client_uuid=requested.client_uuid,
+        vm_name=requested.vm_name,
+        volumes=requested.volumes,
+        volume_uuids=requested.volume_uuids,
+        billing_uuid=requested.billing_uuid,
+        vm_uuid=requested.vm_uuid,
+        cpu=ElementoCpu(
+            slots=flavor.cpu.slots,
+            fullPhysical=flavor.cpu.fullPhysical,
+            maxOverprovision=flavor.cpu.maxOverprovision,
+            min_frequency=flavor.cpu.min_frequency,
+            arch=list(flavor.cpu.arch),
+            flags=list(flavor.cpu.flags or requested.cpu.flags or []),
+        ),
+        mem=ElementoMemory(
+            capacity=flavor.mem.capacity,
+            requireECC=flavor.mem.requireECC,
+        ),
+        pci=requested.pci if requested.pci is not None else [],
+        misc=requested.misc,
+        network_config=requested.network_config,
+        private_network_config=requested.private_network_config,
+        auth=requested.auth,
+        notes=dict(flavor.notes or {}),
+    )
+
+
+class StorageIndex:
+    """Immutable index over the storage offers of a single region, one sorted size array per flags combination."""
+
+    def __init__(self, offers: list[ElementoStorage]):
+        self.offers = offers
+        grouped = {}
+        for offer in sorted((offer for offer in offers if offer.size is not None), key=lambda offer: offer.size):
+            grouped.setdefault(storage_flags_key(offer), []).append(offer)
+
+        self.size = sum(len(group) for group in grouped.values())
+        self.groups = grouped
+        self.sizes = {key: [offer.size for offer in group] for key, group in grouped.items()}
+
+    def find(self, config: ElementoStorage, tolerance: float = TOLERANCE):
+        key = storage_flags_key(config)
+        sizes = self.sizes.get(key)
+        if sizes is None or not config.size:
+            return None
+        i = nearest_index(sizes, config.size)
+        # The nearest size is the one with the smallest relative error, if it is out of tolerance every size is
+        if abs((sizes[i] - config.size) / config.size) > tolerance:
+            return None
+        return self.groups[key][i]
+
+
+def propose_storage(requested: ElementoStorage, offer: ElementoStorage) -> ElementoStorage:
+    """Builds the proposed volume by fitting the requested volume onto a storage offer."""
+    return ElementoStorage(
+        csp_region=requested.csp_region,
+        volume_uuid=requested.volume_uuid,
+        creator_id=requested.creator_id,
+        billing_uuid=requested.billing_uuid,
+        name=requested.name,
+        private=offer.private,
+        readonly=offer.readonly,
+        shareable=offer.shareable,
+        bootable=offer.bootable,
+        size=offer.size,
+        notes=dict(offer.notes or {}),
+    )
+
+
+class OfferCatalog:
+    """
+    Keeps the provider offers of each region indexed, base of the compute and storage catalogs.
+
+    Offers are loaded once per region through the given loader and refreshed by a background thread every
+    refresh_interval seconds. Lookups never call the provider once the region is loaded. Subclasses set
+    index_class (built from the list returned by the loader) and name (used for metrics, logs and the thread).
+
+    Attributes:
+        loader (Callable[[str], list]): Returns all the offers of a region.
+        refresh_interval (int): Seconds between two background refreshes.
+    """
+
+    index_class = None
+    name = None
+
+    def __init__(self, loader: Callable[[str], list], refresh_interval: int = CATALOG_REFRESH_INTERVAL):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def index(self, service_country: str):
+        index = self._indexes.get(service_country)
+        registry.record_cache(f"{self.name}_catalog", index is not None)
+        if index is not None:
+            return index
+        with self._lock:
+            if service_country not in self._indexes:
+                self._indexes[service_country] = self.index_class(self.loader(service_country))
+                self._start_refresher()
+            return self._indexes[service_country]
+
+    def refresh(self, service_country: str = None):
+        regions = [service_country] if service_country is not None else list(self._indexes)
+        for region in regions:
+            try:
+                # Swapping the whole index keeps concurrent lookups lock-free
+                self._indexes[region] = self.index_class(self.loader(region))
+            except Exception as error:
+                logging.error(f"{self.name} catalog refresh ({region}) - {error.__str__()}")
+
+    def stop(self):
+        self._stop.set()
+
+    def _start_refresher(self):
+        if self._refresher is not None or self.refresh_interval <= 0:
+            return
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, name=f"{self.name}-catalog-refresh", daemon=True
+        )
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+
+class ComputeOfferCatalog(OfferCatalog):
+    """
+    Keeps the provider flavors of each region indexed for nearest-fit lookups.
+
+    Flavors are loaded once per region through the given loader (usually list_flavors from
+    the compute manager) and refreshed by a background thread every refresh_interval seconds.
+    Lookups never call the provider once the region is loaded.
+
+    Attributes:
+        loader (Callable[[str], list[ElementoMachine]]): Returns all the flavors of a region.
+        refresh_interval (int): Seconds between two background refreshes.
+    """
+
+    index_class = ComputeIndex
+    name = "compute"
+
+    def closest(self, config: ElementoMachine, service_country: str, tolerance: float = TOLERANCE) -> ElementoMachine:
+        """Returns the closest acceptable configuration for the requested machine.
+
+        The nearest fit honours the requested frequency and ECC as floors. When it finds no flavor, or one out of
+        tolerance, the flavor ranked first by the tolerance scorer (with ECC if requested) is proposed instead.
+
+        Args:
+            config (ElementoMachine): The requested configuration.
+            service_country (str): The region to look into.
+            tolerance (float): Maximum global relative error, as computed by check_vm_tolerance.
+        Returns:
+            An ElementoMachine fitted on the closest flavor, None if no flavor matches the
+            requested arch, PCI devices, frequency and ECC constraints nor is within tolerance.
+        """
+        try:
+            flavor = self.index(service_country).find(config)
+            proposed = propose_machine(config, flavor) if flavor is not None else None
+            if proposed is None or not check_vm_tolerance(config, proposed, tolerance):
+                flavor = next(
+                    (
+                        candidate
+                        for candidate, _ in self.candidates(config, service_country, tolerance)
+                        if candidate.mem.requireECC or not config.mem.requireECC
+                    ),
+                    None,
+                )
+                if flavor is not None:
+                    proposed = propose_machine(config, flavor)
+            return proposed
+        except Exception as error:
+            raise Exception(f"compute catalog lookup - {error.__str__()}")
+
+    def candidates(
+        self, config: ElementoMachine, service_country: str, tolerance: float = TOLERANCE
+    ) -> list[tuple[ElementoMachine, float]]:
+        """Returns every flavor of the region within tolerance, ranked by relative error."""
+        return self.index(service_country).scorer.rank(config, tolerance)
+
+
+class StorageOfferCatalog(OfferCatalog):
+    """
+    Keeps the provider storage offers (size tiers and flags combinations) of each region indexed.
+
+    Offers are loaded once per region through the given loader (usually list_storage_offers from the
+    storage manager). For each private/readonly/shareable/bootable combination the sizes are kept in a
+    sorted array, so the nearest size is found by bisection without calling the provider.
+
+    Attributes:
+        loader (Callable[[str], list[ElementoStorage]]): Returns all the storage offers of a region.
+        refresh_interval (int): Seconds between two background refreshes.
+    """
+
+    index_class = StorageIndex
+    name = "storage"
+
+    def closest(self, config: ElementoStorage, service_country: str, tolerance: float = TOLERANCE) -> ElementoStorage:
+        """Returns the requested volume fitted on the nearest size offered with the same flags.
+
+        Args:
+            config (ElementoStorage): The requested volume.
+            service_country (str): The region to look into.
+            tolerance (float): Maximum relative error between the requested and the offered size.
+        Returns:
+            An ElementoStorage fitted on the nearest offer, None if no offer has the requested flags
+            or a size within tolerance.
+        """
+        try:
+            offer = self.index(service_country).find(config, tolerance)
+            return propose_storage(config, offer) if offer is not None else None
+        except Exception as error:
+            raise Exception(f"storage catalog lookup - {error.__str__()}")
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Callable
+
+
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", 5))  # seconds
+EVENTS_KEEPALIVE_INTERVAL = float(os.getenv("EVENTS_KEEPALIVE_INTERVAL", 15))  # seconds
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 256))
+
+
+class _Subscriber:
+    def __init__(self, client_uuid: str = None, vm_uuid: str = None):
+        self.client_uuid = client_uuid
+        self.vm_uuid = vm_uuid
+        self.queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+    def push(self, event: dict):
+        if self.queue.full():
+            # Slow consumers lose the oldest transitions instead of blocking everyone else
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class StateChangeBroadcaster:
+    """
+    Streams VM state transitions to any number of subscribers from a single shared poll.
+
+    A single task polls the snapshot function (usually get_status) every interval seconds while at least one
+    subscriber is connected, diffs it with the previous snapshot and fans the transitions out: a VM appearing
+    in the snapshot becomes "running", a VM disappearing becomes "stopped". Subscribers are indexed by vm_uuid
+    and client_uuid, so each transition only reaches the interested ones.
+
+    Attributes:
+        snapshot (Callable): Returns the current list of running ElementoMachines.
+        interval (float): Seconds between two polls.
+    """
+
+    def __init__(self, snapshot: Callable, interval: float = EVENTS_POLL_INTERVAL):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.states = {}
+        self._subscribers = set()
+        self._by_vm = {}
+        self._by_client = {}
+        self._everything = set()
+        self._task = None
+        self._ready = None
+
+    def diff(self, machines: list) -> list[dict]:
+        now = time.time()
+        current = {machine.vm_uuid: machine.client_uuid for machine in machines if machine.vm_uuid is not None}
+        events = []
+        for vm_uuid, client_uuid in current.items():
+            previous = self.states.get(vm_uuid)
+            if previous is None or previous["state"] != "running":
+                events.append(self._event(vm_uuid, client_uuid, "running", previous, now))
+        for vm_uuid, previous in self.states.items():
+            if vm_uuid not in current and previous["state"] != "stopped":
+                events.append(self._event(vm_uuid, previous["client_uuid"], "stopped", previous, now))
+        for event in events:
+            self.states[event["vm_uuid"]] = event
+        return events
+
+    def publish(self, event: dict):
+        targets = (
+            self._everything
+            | self._by_vm.get(event["vm_uuid"], set())
+            | self._by_client.get(event["client_uuid"], set())
+        )
+        for subscriber in targets:
+            if subscriber.vm_uuid is None or subscriber.client_uuid is None or (
+                subscriber.vm_uuid == event["vm_uuid"] and subscriber.client_uuid == event["client_uuid"]
+            ):
+                subscriber.push(event)
+
+    async def stream(self, client_uuid: str = None, vm_uuid: str = None):
+        """Yields the SSE frames of the transitions matching the filters, starting with the current states."""
+        subscriber = self._subscribe(client_uuid, vm_uuid)
+        try:
+            await self._ready.wait()
+            for event in list(self.states.values()):
+                if (vm_uuid is None or event["vm_uuid"] == vm_uuid) and (
+                    client_uuid is None or event["client_uuid"] == client_uuid
+                ):
+                    yield self.format(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), EVENTS_KEEPALIVE_INTERVAL)
+                    yield self.format(event)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self._unsubscribe(subscriber)
+
+    @staticmethod
+    def format(event: dict) -> str:
+        return f"event: state\nid: {event['timestamp']}\ndata: {json.dumps(event)}\n\n"
+
+    @staticmethod
+    def _event(vm_uuid: str, client_uuid: str, state: str, previous: dict, timestamp: float) -> dict:
+        return {
+            "vm_uuid": vm_uuid,
+            "client_uuid": client_uuid,
+            "state": state,
+            "previous": previous["state"] if previous is not None else None,
+            "timestamp": timestamp,
+        }
+
+    def _subscribe(self, client_uuid: str, vm_uuid: str) -> _Subscriber:
+        subscriber = _Subscriber(client_uuid, vm_uuid)
+        self._subscribers.add(subscriber)
+        if vm_uuid is not None:
+            self._by_vm.setdefault(vm_uuid, set()).add(subscriber)
+        elif client_uuid is not None:
+            self._by_client.setdefault(client_uuid, set()).add(subscriber)
+        else:
+            self._everything.add(subscriber)
+
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.create_task(self._poll())
+        return subscriber
+
+    def _unsubscribe(self, subscriber: _Subscriber):
+        self._subscribers.discard(subscriber)
+        self._everything.discard(subscriber)
+        for index, key in [(self._by_vm, subscriber.vm_uuid), (self._by_client, subscriber.client_uuid)]:
+            subscribers = index.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if len(subscribers) == 0:
+                    del index[key]
+
+    async def _poll(self):
+        # Runs only while someone is listening, states are rebuilt from scratch on the next subscription
+        self.states = {}
+        baseline = True
+        while len(self._subscribers) > 0:
+            try:
+                machines = await asyncio.to_thread(self.snapshot)
+                events = self.diff(machines)
+                # The first snapshot is sent to every subscriber as its initial state, not as transitions
+                if not baseline:
+                    for event in events:
+                        self.publish(event)
+                baseline = False
+            except Exception as error:
+                logging.error(f"state change poll - {error.__str__()}")
+            self._ready.set()
+            await asyncio.sleep(self.interval)
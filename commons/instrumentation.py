@@ -0,0 +1,326 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows: the files of exited workers are then left in MESON_METRICS_DIR
+    fcntl = None
+
+METRICS_DIR = os.getenv("MESON_METRICS_DIR")  # shared by the workers of the same app, unset for a single worker
+METRICS_FLUSH_INTERVAL = float(os.getenv("MESON_METRICS_FLUSH_INTERVAL", 5))  # seconds
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _pid_of(path: str, app_name: str) -> int:
+    """The worker pid of a metrics file, None for the exited file."""
+    name = os.path.basename(path)[len(app_name) + 1 : -len(".json")]
+    return int(name) if name.isdigit() else None
+
+
+def _read(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None  # folded by another worker meanwhile
+    except (OSError, ValueError) as error:
+        logging.error(f"metrics merge ({path}) - {error.__str__()}")
+        return None
+
+
+def _merge(snapshots: list[dict]) -> tuple:
+    """Sums the series of several workers: counters, gauges (only of the live workers) and histograms."""
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        pid = snapshot.get("pid")
+        alive = pid is not None and (pid == os.getpid() or _pid_alive(pid))
+        for name, labels, value in snapshot["counters"]:
+            key = _key(name, dict(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot.get("gauges", []) if alive else []:
+            key = _key(name, dict(labels))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, histogram in snapshot["histograms"]:
+            key = _key(name, dict(labels))
+            merged = histograms.setdefault(
+                key, {"buckets": histogram["buckets"], "counts": [0] * len(histogram["counts"]), "sum": 0.0}
+            )
+            merged["counts"] = [a + b for a, b in zip(merged["counts"], histogram["counts"])]
+            merged["sum"] += histogram["sum"]
+    return counters, gauges, histograms
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and fixed-bucket histograms of the running app, exposed in the Prometheus text format.
+
+    With MESON_METRICS_DIR set, every worker periodically dumps its series into <dir>/<app>-<pid>.json and the
+    exposition merges the files of all the workers of the app: counters and histograms are summed (including
+    those of dead workers, so they never go backwards), gauges only for the workers still alive.
+    The counters and histograms of the workers which exited (at exit, or found dead by the exposition) are
+    folded into <dir>/<app>-exited.json and their own file is removed, so the directory does not grow with
+    every restarted worker.
+
+    Attributes:
+        app_name (str): Value of the app label, one of compute, storage or service.
+    """
+
+    def __init__(self, app_name: str = "meson"):
+        self.app_name = app_name
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.callbacks = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._exit_pid = None  # pid which registered stop() at exit
+        self._stopped = False
+
+    def inc(self, name: str, labels: dict = None, value: float = 1):
+        key = _key(name, labels or {})
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add(self, name: str, labels: dict = None, value: float = 1):
+        key = _key(name, labels or {})
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict = None, buckets: tuple = LATENCY_BUCKETS):
+        key = _key(name, labels or {})
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": list(buckets),
+                    "counts": [0] * (len(buckets) + 1),
+                    "sum": 0.0,
+                }
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+                    break
+            else:
+                histogram["counts"][-1] += 1
+            histogram["sum"] += value
+
+    def register_gauge(self, name: str, callback: Callable[[], float], labels: dict = None):
+        """Registers a gauge evaluated at exposition time, e.g. the queue depth of an executor."""
+        self.callbacks[_key(name, labels or {})] = callback
+
+    def record_cache(self, cache: str, hit: bool):
+        self.inc("meson_cache_requests_total", {"cache": cache, "result": "hit" if hit else "miss"})
+
+    def track_executor(self, name: str, executor):
+        """Exposes the number of tasks waiting in a ThreadPoolExecutor (or anything with a _work_queue)."""
+        self.register_gauge(
+            "meson_executor_queue_depth", lambda: executor._work_queue.qsize(), {"executor": name}
+        )
+
+    def snapshot(self) -> dict:
+        gauges = dict(self.gauges)
+        for key, callback in list(self.callbacks.items()):
+            try:
+                gauges[key] = callback()
+            except Exception as error:
+                logging.error(f"metrics gauge {key[0]} - {error.__str__()}")
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+                "histograms": [
+                    [name, labels, {**histogram, "counts": list(histogram["counts"])}]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def flush(self):
+        if METRICS_DIR is None or self._stopped:
+            return
+        self._write(self._path(os.getpid()), self.snapshot())
+        if self._exit_pid != os.getpid():
+            self._exit_pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Folds the final series of this worker into the exited file and removes its own file."""
+        if METRICS_DIR is None or self._stopped:
+            return
+        self._stopped = True
+        try:
+            self._write(self._path(os.getpid()), self.snapshot())
+            self._fold([self._path(os.getpid())])
+        except Exception as error:
+            logging.error(f"metrics stop - {error.__str__()}")
+
+    def start_flusher(self):
+        if METRICS_DIR is None or self._flusher is not None:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def render(self) -> str:
+        """Returns all the series of the app (all its workers) in the Prometheus text format."""
+        if METRICS_DIR is None:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            pattern = os.path.join(METRICS_DIR, f"{self.app_name}-*.json")
+            pids = {path: _pid_of(path, self.app_name) for path in glob.glob(pattern)}
+            self._fold([path for path, pid in pids.items() if pid not in (None, os.getpid()) and not _pid_alive(pid)])
+            snapshots = [snapshot for snapshot in map(_read, glob.glob(pattern)) if snapshot is not None]
+
+        counters, gauges, histograms = _merge(snapshots)
+
+        # Hit ratio of every cache, derived from the hit/miss counters
+        caches = {}
+        for (name, labels), value in counters.items():
+            if name == "meson_cache_requests_total":
+                labels = dict(labels)
+                caches.setdefault(labels["cache"], {"hit": 0, "miss": 0})[labels["result"]] += value
+        for cache, results in caches.items():
+            gauges[_key("meson_cache_hit_ratio", {"cache": cache})] = results["hit"] / (
+                results["hit"] + results["miss"]
+            )
+
+        app_label = (("app", self.app_name),)
+        lines = []
+        for kind, series in [("counter", counters), ("gauge", gauges)]:
+            for name in sorted({name for name, _ in series}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f"{name}{_labels(app_label + labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), histogram in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram["buckets"] + ["+Inf"], histogram["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(app_label + labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(app_label + labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{_labels(app_label + labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def _path(self, pid) -> str:
+        return os.path.join(METRICS_DIR, f"{self.app_name}-{pid}.json")
+
+    @staticmethod
+    def _write(path: str, snapshot: dict):
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+        os.replace(path + ".tmp", path)
+
+    def _fold(self, paths: list[str]):
+        # Adds the counters and histograms of exited workers to the exited file, then removes their files. Done
+        # under an exclusive lock, so that two workers never fold the same file twice
+        if len(paths) == 0 or fcntl is None:
+            return
+        with open(os.path.join(METRICS_DIR, f"{self.app_name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshots = [snapshot for snapshot in map(_read, paths) if snapshot is not None]
+            if len(snapshots) == 0:
+                return
+            exited_path = self._path("exited")
+            if os.path.exists(exited_path):
+                snapshots.append(_read(exited_path) or {"counters": [], "histograms": []})
+            counters, _, histograms = _merge(snapshots)
+            self._write(
+                exited_path,
+                {
+                    "pid": None,
+                    "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+                    "gauges": [],
+                    "histograms": [[name, labels, histogram] for (name, labels), histogram in histograms.items()],
+                },
+            )
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as error:
+                logging.error(f"metrics flush - {error.__str__()}")
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware recording, for every route, the request latency and response size histograms, the
+    request counter by status code and the in-flight requests gauge.
+
+    Routes are labelled by their template (e.g. /api/v1.0/running/{vm_uuid}), unmatched paths as "unmatched".
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.registry.start_flusher()
+        response = {"status": 500, "size": 0}
+
+        async def instrumented_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        self.registry.add("meson_http_requests_in_flight", {"method": scope["method"]}, 1)
+        try:
+            await self.app(scope, receive, instrumented_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.registry.add("meson_http_requests_in_flight", {"method": scope["method"]}, -1)
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": route.path if route is not None else "unmatched"}
+            self.registry.observe("meson_http_request_duration_seconds", elapsed, labels)
+            self.registry.observe("meson_http_response_size_bytes", response["size"], labels, SIZE_BUCKETS)
+            self.registry.inc("meson_http_requests_total", {**labels, "status": str(response["status"])})
@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from commons.instrumentation import registry
+from commons.tracing import span
+
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))  # provider calls in flight for the asynchronous jobs
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 3600))  # seconds a finished job can still be queried
+JOB_MAX_ENTRIES = int(os.getenv("JOB_MAX_ENTRIES", 10000))
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class Job:
+    """
+    A unit of work accepted by an endpoint and completed in background.
+
+    Attributes:
+        job_id (str): The job identifier (uuid4), returned to the caller with the status URL.
+        kind (str): What the job does, e.g. "storage_creation".
+        status (str): pending, running, succeeded or failed.
+        result: What the job function returned (JSON serializable), once succeeded.
+        error (str): Why the job failed, once failed.
+    """
+
+    def __init__(self, kind: str):
+        self.job_id = str(uuid.uuid4())
+        self.kind = kind
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_json(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobEngine:
+    """
+    Runs blocking provider calls on a worker pool so that the HTTP workers answer immediately.
+
+    Jobs are kept in memory by id so that their status can be polled. Once max_entries jobs are held, the jobs
+    finished more than retention seconds ago are dropped (then the oldest finished ones, never the pending).
+    The pool queue depth is exported as meson_executor_queue_depth{executor="jobs"} and every finished job is
+    counted in meson_jobs_total{kind,status}. Each job runs in its own trace (span job.<kind>).
+    Jobs live in the worker process which accepted them: with several workers, the status has to be polled
+    through a sticky load balancer, or with a single worker.
+
+    Attributes:
+        workers (int): Jobs run concurrently.
+        retention (int): Seconds a finished job can still be queried.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, retention: int = JOB_RETENTION, max_entries: int = JOB_MAX_ENTRIES):
+        self.workers = workers
+        self.retention = retention
+        self.max_entries = max_entries
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, kind: str, fun: Callable, *args) -> Job:
+        """Queues fun(*args) and returns its job at once. The job result is what fun returns, its error what it raises."""
+        job = Job(kind)
+        with self._lock:
+            self._evict()
+            self._jobs[job.job_id] = job
+        self._pool().submit(self._run, job, fun, args)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        return self._jobs.get(job_id)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Created on the first job, so that importing a meson does not start threads
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="meson-job")
+                    registry.track_executor("jobs", self._executor)
+        return self._executor
+
+    def _run(self, job: Job, fun: Callable, args: tuple):
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            with span(f"job.{job.kind}", job_id=job.job_id):
+                job.result = fun(*args)
+            job.status = SUCCEEDED
+        except Exception as error:
+            logging.error(f"job {job.kind} {job.job_id} - {error.__str__()}")
+            job.error = error.__str__()
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            registry.inc("meson_jobs_total", {"kind": job.kind, "status": job.status})
+
+    def _evict(self):
+        # Called with the lock held
+        if len(self._jobs) < self.max_entries:
+            return
+        expired = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done and job.finished <= expired]:
+            del self._jobs[job_id]
+        if len(self._jobs) >= self.max_entries:
+            # Still full: the oldest finished jobs go first, pending and running jobs are always kept
+            finished = sorted((job for job in self._jobs.values() if job.done), key=lambda job: job.finished)
+            for job in finished[: len(self._jobs) - self.max_entries + 1]:
+                del self._jobs[job.job_id]
+
+
+jobs = JobEngine()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from commons.instrumentation import registry
+
+
+LOOPWATCH_INTERVAL = float(os.getenv("MESON_LOOPWATCH_INTERVAL", 0.1))  # seconds between two heartbeats
+LOOPWATCH_STALL_MS = float(os.getenv("MESON_LOOPWATCH_STALL_MS", 250))
+LOOPWATCH_MAX_STALLS = int(os.getenv("MESON_LOOPWATCH_MAX_STALLS", 100))
+LOOPWATCH_WINDOW = 600  # lag samples used for the percentiles, one minute with the default interval
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def percentile(values: list, quantile: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+
+class LoopWatchdog:
+    """
+    Measures the event loop lag and captures what blocks it.
+
+    A heartbeat task sleeps interval seconds in a loop: the extra time it takes to wake up is the loop lag, it
+    is observed in the meson_event_loop_lag_seconds histogram and its recent percentiles are exported as gauges.
+    A watchdog thread checks the heartbeat: when it is late by more than stall_ms, the loop is stuck in
+    synchronous code, so the thread captures the stack of the loop thread and the request being served by the
+    running task. The record is completed with the total stall duration once the loop recovers.
+
+    Attributes:
+        interval (float): Seconds between two heartbeats.
+        stall_ms (float): Lag above which a stall is recorded.
+        stalls (deque): The last LOOPWATCH_MAX_STALLS stalls.
+    """
+
+    def __init__(self, interval: float = LOOPWATCH_INTERVAL, stall_ms: float = LOOPWATCH_STALL_MS):
+        self.interval = interval
+        self.stall_ms = stall_ms
+        self.stalls = deque(maxlen=LOOPWATCH_MAX_STALLS)
+        self.lags = deque(maxlen=LOOPWATCH_WINDOW)
+        self.loop = None
+        self._requests = {}
+        self._beat = None
+        self._stall = None
+        self._loop_thread = None
+        self._task = None
+        self._lock = threading.Lock()
+
+        for name, quantile in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)]:
+            registry.register_gauge(
+                "meson_event_loop_lag_quantile_seconds",
+                lambda quantile=quantile: percentile(list(self.lags), quantile),
+                {"quantile": name},
+            )
+
+    def ensure_started(self):
+        """Starts the heartbeat on the running loop and the watchdog thread, once."""
+        if self._task is not None and not self._task.done():
+            return
+        with self._lock:
+            if self._task is not None and not self._task.done():
+                return
+            self.loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._beat = time.monotonic()
+            self._task = self.loop.create_task(self._heartbeat())
+            threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def request_started(self, scope: dict):
+        task = asyncio.current_task()
+        if task is not None:
+            self._requests[task] = scope
+
+    def request_finished(self):
+        self._requests.pop(asyncio.current_task(), None)
+
+    def status(self) -> dict:
+        lags = list(self.lags)
+        return {
+            "interval": self.interval,
+            "stall_ms": self.stall_ms,
+            "lag_ms": {
+                name: percentile(lags, quantile) * 1000
+                for name, quantile in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)]
+            },
+            "stalls": list(reversed(self.stalls)),
+        }
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            lag = max(0.0, self._beat - start - self.interval)
+            self.lags.append(lag)
+            registry.observe("meson_event_loop_lag_seconds", lag, buckets=LAG_BUCKETS)
+            stall = self._stall
+            if stall is not None:
+                self._stall = None
+                stall["lag_ms"] = lag * 1000
+                logging.warning(
+                    f"event loop blocked for {stall['lag_ms']:.0f}ms by {stall['method']} {stall['route']}"
+                )
+
+    def _watch(self):
+        while self._task is not None and not self._task.done():
+            time.sleep(self.interval)
+            late_ms = (time.monotonic() - self._beat - self.interval) * 1000
+            if late_ms > self.stall_ms and self._stall is None:
+                self._stall = self._capture(late_ms)
+                self.stalls.append(self._stall)
+
+    def _capture(self, late_ms: float) -> dict:
+        frame = sys._current_frames().get(self._loop_thread)
+        task = asyncio.current_task(self.loop)
+        scope = self._requests.get(task) if task is not None else None
+        route = scope.get("route") if scope is not None else None
+        return {
+            "timestamp": time.time(),
+            "lag_ms": late_ms,
+            "method": scope["method"] if scope is not None else None,
+            "route": route.path if route is not None else None,
+            "path": scope["path"] if scope is not None else None,
+            "task": task.get_name() if task is not None else None,
+            "stack": traceback.format_stack(frame) if frame is not None else [],
+        }
+
+
+watchdog = LoopWatchdog()
+
+
+class LoopWatchMiddleware:
+    """ASGI middleware starting the loop watchdog and telling it which request each task is serving."""
+
+    def __init__(self, app, watchdog: LoopWatchdog = watchdog):
+        self.app = app
+        self.watchdog = watchdog
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.watchdog.ensure_started()
+        self.watchdog.request_started(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.watchdog.request_finished()
@@ -0,0 +1,343 @@
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+
+METRICS_RAW_POINTS = int(os.getenv("METRICS_RAW_POINTS", 360))
+METRICS_MINUTE_POINTS = int(os.getenv("METRICS_MINUTE_POINTS", 1440))
+METRICS_HOUR_POINTS = int(os.getenv("METRICS_HOUR_POINTS", 720))
+METRICS_COLLECT_INTERVAL = int(os.getenv("METRICS_COLLECT_INTERVAL", 30))  # seconds
+METRICS_COLLECT_JITTER = float(os.getenv("METRICS_COLLECT_JITTER", 0.1))  # fraction of the interval
+METRICS_REGION_RATE = float(os.getenv("METRICS_REGION_RATE", 5))  # provider calls per second per region
+METRICS_REGION_BURST = int(os.getenv("METRICS_REGION_BURST", 20))
+
+RESOLUTIONS = {"raw": 0, "1m": 60, "1h": 3600}
+
+
+def _numeric(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Bucket:
+    """Aggregates the samples of a time window: numeric fields are averaged, the others keep the last value."""
+
+    def __init__(self, start: float):
+        self.start = start
+        self.sums = {}
+        self.counts = {}
+        self.last = {}
+
+    def add(self, sample: dict):
+        for key, value in sample.items():
+            if _numeric(value):
+                self.sums[key] = self.sums.get(key, 0) + value
+                self.counts[key] = self.counts.get(key, 0) + 1
+            else:
+                self.last[key] = value
+
+    def value(self) -> dict:
+        value = dict(self.last)
+        value.update({key: self.sums[key] / self.counts[key] for key in self.sums})
+        return value
+
+
+class _Series:
+    """Fixed-size ring buffers of a single resolution, fed by the finer resolution."""
+
+    def __init__(self, step: int, max_points: int):
+        self.step = step
+        self.points = deque(maxlen=max_points)
+        self.current = None
+
+    def add(self, timestamp: float, sample: dict):
+        """Adds a sample and returns the bucket closed by it as (start, value), if any."""
+        if self.step == 0:
+            self.points.append((timestamp, sample))
+            return None
+
+        start = timestamp - timestamp % self.step
+        closed = None
+        if self.current is not None and self.current.start != start:
+            closed = (self.current.start, self.current.value())
+            self.points.append(closed)
+            self.current = None
+        if self.current is None:
+            self.current = _Bucket(start)
+        self.current.add(sample)
+        return closed
+
+    def between(self, start: float, end: float) -> list[tuple]:
+        points = [point for point in self.points if start <= point[0] <= end]
+        if self.current is not None and start <= self.current.start <= end:
+            points.append((self.current.start, self.current.value()))
+        return points
+
+
+class VmMetrics:
+    """Raw, per-minute and per-hour history of a single VM, bounded to a fixed number of points."""
+
+    def __init__(self, client_uuid: str):
+        self.client_uuid = client_uuid
+        self.latest = None
+        self.updated = 0.0
+        self.series = {
+            "raw": _Series(RESOLUTIONS["raw"], METRICS_RAW_POINTS),
+            "1m": _Series(RESOLUTIONS["1m"], METRICS_MINUTE_POINTS),
+            "1h": _Series(RESOLUTIONS["1h"], METRICS_HOUR_POINTS),
+        }
+
+    def add(self, timestamp: float, sample: dict):
+        self.latest = sample
+        self.updated = timestamp
+        self.series["raw"].add(timestamp, sample)
+        closed = self.series["1m"].add(timestamp, sample)
+        if closed is not None:
+            self.series["1h"].add(*closed)
+
+
+class MetricsStore:
+    """
+    In-memory time series of the VM metrics, indexed by vm_uuid and client_uuid.
+
+    Every VM keeps three fixed-size ring buffers (raw samples, 1 minute and 1 hour averages), so the memory
+    used by a VM never exceeds METRICS_RAW_POINTS + METRICS_MINUTE_POINTS + METRICS_HOUR_POINTS samples.
+    VMs without samples for longer than the hourly retention are dropped.
+    """
+
+    def __init__(self):
+        self._vms = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def add(self, client_uuid: str, vm_uuid: str, sample: dict, timestamp: float = None):
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self._lock:
+            vm = self._vms.get(vm_uuid)
+            if vm is None:
+                vm = self._vms[vm_uuid] = VmMetrics(client_uuid)
+                self._clients.setdefault(client_uuid, set()).add(vm_uuid)
+            vm.add(timestamp, sample)
+
+    def latest(self, vm_uuid: str) -> dict:
+        vm = self._vms.get(vm_uuid)
+        return vm.latest if vm is not None else None
+
+    def vms_of(self, client_uuid: str) -> list[str]:
+        return sorted(self._clients.get(client_uuid, ()))
+
+    def query(self, vm_uuid: str, start: float = None, end: float = None, step: int = None) -> dict:
+        """Returns the history of a VM between start and end (unix timestamps).
+
+        The coarsest resolution not bigger than step is used, points are further aggregated by step if needed.
+        Returns None if the VM is unknown.
+        """
+        vm = self._vms.get(vm_uuid)
+        if vm is None:
+            return None
+        end = end if end is not None else time.time()
+        start = start if start is not None else end - METRICS_RAW_POINTS * METRICS_COLLECT_INTERVAL
+        step = step or 0
+        resolution = max(
+            (name for name, size in RESOLUTIONS.items() if size <= step),
+            key=lambda name: RESOLUTIONS[name],
+        )
+        with self._lock:
+            points = vm.series[resolution].between(start, end)
+
+        if step > RESOLUTIONS[resolution]:
+            buckets = {}
+            for timestamp, sample in points:
+                bucket_start = timestamp - timestamp % step
+                buckets.setdefault(bucket_start, _Bucket(bucket_start)).add(sample)
+            points = [(bucket.start, bucket.value()) for bucket in buckets.values()]
+
+        return {
+            "itemID": vm_uuid,
+            "resolution": resolution,
+            "step": step,
+            "points": [{"timestamp": timestamp, **sample} for timestamp, sample in points],
+        }
+
+    def evict(self, older_than: float):
+        with self._lock:
+            for vm_uuid in [vm_uuid for vm_uuid, vm in self._vms.items() if vm.updated < older_than]:
+                vm = self._vms.pop(vm_uuid)
+                self._clients.get(vm.client_uuid, set()).discard(vm_uuid)
+
+
+class RateLimited(Exception):
+    """The rate budget of a region is exhausted, retry_after is the number of seconds until the next call is allowed."""
+
+    def __init__(self, region: str, retry_after: int):
+        super().__init__(f"Rate budget of {region} exhausted, retry after {retry_after}s")
+        self.region = region
+        self.retry_after = retry_after
+
+
+class RateBudget:
+    """Token bucket limiting the provider calls of a region: rate calls per second, up to burst at once."""
+
+    def __init__(self, rate: float = METRICS_REGION_RATE, burst: int = METRICS_REGION_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def retry_after(self) -> int:
+        """Seconds until a call is allowed again, at least 1."""
+        with self._lock:
+            missing = 1 - min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+        return max(1, math.ceil(missing / self.rate)) if self.rate > 0 else 1
+
+
+class MetricsCollector:
+    """
+    Background thread filling a MetricsStore from the provider in as few calls as possible.
+
+    Machines are grouped by csp_region (the first region for the machines without one). When the adapter exposes
+    a batch API (fetch_all_metrics returns a list) a single call per region collects every VM of the region,
+    samples of VMs not listed are dropped; otherwise the clients owning a machine in the region are collected one
+    by one. Every provider call consumes the
+    RateBudget of its region: clients left out when the budget runs out are collected first on the next round.
+    Rounds are spaced by interval seconds with a random jitter, so several workers do not poll in lockstep.
+    collect_client raises RateLimited when called for a cold start while the budget of its region is exhausted.
+
+    Attributes:
+        store (MetricsStore): The store to be filled.
+        list_machines (Callable): Returns all the machines (usually get_status).
+        fetch_metrics (Callable): Returns the metrics of a client (usually get_servers_metrics).
+        regions (list[str]): The regions to be collected.
+        fetch_all_metrics (Callable): Returns the metrics of every VM of a region (usually
+        get_all_servers_metrics), None if the provider does not support it.
+        interval (int): Seconds between two collections.
+        jitter (float): Maximum deviation from interval, as a fraction of it.
+    """
+
+    def __init__(
+        self,
+        store: MetricsStore,
+        list_machines: Callable,
+        fetch_metrics: Callable,
+        regions: list[str],
+        fetch_all_metrics: Callable = None,
+        interval: int = METRICS_COLLECT_INTERVAL,
+        jitter: float = METRICS_COLLECT_JITTER,
+    ):
+        self.store = store
+        self.list_machines = list_machines
+        self.fetch_metrics = fetch_metrics
+        self.fetch_all_metrics = fetch_all_metrics
+        self.regions = regions
+        self.interval = interval
+        self.jitter = jitter
+        self.budgets = {region: RateBudget() for region in regions}
+        self.last_collection = None
+        self._batch_supported = {region: fetch_all_metrics is not None for region in regions}
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def collect(self):
+        owners_by_region = {}
+        for machine in self.list_machines():
+            region = machine.csp_region or (self.regions[0] if len(self.regions) > 0 else None)
+            owners_by_region.setdefault(region, {})[machine.vm_uuid] = machine.client_uuid
+        for region in self.regions:
+            owners = owners_by_region.get(region, {})
+            clients = set(owners.values())
+            try:
+                if self._batch_supported.get(region) and self.collect_region(region, owners):
+                    continue
+            except Exception as error:
+                logging.error(f"metrics collector ({region}) - {error.__str__()}")
+
+            # Resume from the clients skipped by the previous round, then the others
+            pending = [client for client in self._pending.get(region, []) if client in clients]
+            pending += sorted(clients.difference(pending))
+            while len(pending) > 0 and self._budget(region).take():
+                client_uuid = pending.pop(0)
+                try:
+                    self.collect_client(client_uuid, region, charge=False)
+                except Exception as error:
+                    logging.error(f"metrics collector ({client_uuid}, {region}) - {error.__str__()}")
+            self._pending[region] = pending
+            if len(pending) > 0:
+                logging.warning(f"metrics collector ({region}) - rate budget exhausted, {len(pending)} clients deferred")
+
+        self.last_collection = time.time()
+        self.store.evict(self.last_collection - METRICS_HOUR_POINTS * RESOLUTIONS["1h"])
+
+    def collect_region(self, service_country: str, owners: dict) -> bool:
+        """Collects every VM of a region with a single batch call, returns False if it is not supported.
+
+        owners gives the client_uuid of each vm_uuid of the region, the samples of other VMs are dropped.
+        """
+        if not self._budget(service_country).take():
+            return True
+        metrics = self.fetch_all_metrics(service_country=service_country)
+        if metrics is None:
+            self._batch_supported[service_country] = False
+            return False
+        timestamp = time.time()
+        for sample in metrics:
+            client_uuid = owners.get(sample.get("itemID"))
+            if client_uuid is not None:
+                self.store.add(client_uuid, sample["itemID"], sample, timestamp)
+        return True
+
+    def collect_client(self, client_uuid: str, service_country: str, charge: bool = True) -> list[dict]:
+        """Collects the VMs of a client, consuming the region budget unless charge is False.
+
+        Raises:
+            RateLimited: The region budget is exhausted, nothing was collected.
+        """
+        budget = self._budget(service_country)
+        if charge and not budget.take():
+            raise RateLimited(service_country, budget.retry_after())
+        metrics = self.fetch_metrics(client_uuid=client_uuid, service_country=service_country) or []
+        timestamp = time.time()
+        for sample in metrics:
+            if sample.get("itemID") is not None:
+                self.store.add(client_uuid, sample["itemID"], sample, timestamp)
+        return metrics
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="metrics-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _budget(self, region: str) -> RateBudget:
+        budget = self.budgets.get(region)
+        if budget is None:
+            budget = self.budgets.setdefault(region, RateBudget())
+        return budget
+
+    def _run(self):
+        # Random initial offset, so that workers started together do not collect together
+        self._stop.wait(random.uniform(0, self.interval * self.jitter))
+        while not self._stop.is_set():
+            try:
+                self.collect()
+            except Exception as error:
+                logging.error(f"metrics collector - {error.__str__()}")
+            self._stop.wait(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
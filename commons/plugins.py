@@ -0,0 +1,222 @@
+import ast
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List
+from commons.instrumentation import registry
+from commons.tracing import span, traced
+
+
+PLUGIN_MANIFEST_CACHE = os.getenv("PLUGIN_MANIFEST_CACHE")  # manifest cache file, not cached if unset
+PLUGIN_NEGATIVE_TTL = int(os.getenv("PLUGIN_NEGATIVE_TTL", 60))  # seconds an unknown service name is rejected from memory
+PLUGIN_NEGATIVE_MAX_ENTRIES = 10000
+
+
+def plugin_phase(method: str) -> str:
+    # setup_config only builds the service model, every other plugin method calls the provider
+    return "model" if method == "setup_config" else "provider"
+
+
+def module_exports(file: Path) -> set:
+    """Names defined at the top level of a python file (functions, classes, assignments, imports), without importing it."""
+    exports = set()
+    for node in ast.parse(file.read_text(), filename=str(file)).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            exports.add(node.name)
+        elif isinstance(node, ast.Assign):
+            exports.update(target.id for target in node.targets if isinstance(target, ast.Name))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            exports.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+    return exports
+
+
+class PluginRegistry:
+    """
+    Service plugins of the plugin roots, imported on first use.
+
+    At startup only a manifest is built: for every <prefix>_<service>.py file of the roots, the service name, its
+    module path and the methods it defines, read with ast without importing it. If PLUGIN_MANIFEST_CACHE is set the
+    manifest is stored there and reused as long as the roots modification times are unchanged (a plugin added,
+    removed or renamed), so a cold start does not even parse the plugins.
+    A plugin module is imported the first time its service is used, and its methods are traced like the other
+    provider calls. Endpoints use resolve(name): services added to the roots after startup are found too, and
+    unknown names (or plugins failing to import) are remembered for negative_ttl seconds, so they are rejected
+    without touching the filesystem nor importlib.
+
+    Attributes:
+        roots (list[str]): The plugin folders, e.g. platforms and software.
+        prefix (str): The plugin file prefix, e.g. service.
+        methods (list[str]): The methods every plugin has to define.
+    """
+
+    def __init__(
+        self,
+        roots: List[str],
+        prefix: str,
+        methods: List[str],
+        cache_path: str = PLUGIN_MANIFEST_CACHE,
+        negative_ttl: int = PLUGIN_NEGATIVE_TTL,
+    ):
+        self.roots = list(roots)
+        self.prefix = prefix
+        self.methods = list(methods)
+        self.cache_path = cache_path
+        self.negative_ttl = negative_ttl
+        self._services = {}
+        self._unknown = {}  # service_name -> (monotonic time until which it is rejected, reason)
+        self._lock = threading.Lock()
+        self.manifest = self._load_manifest()
+
+    def names(self) -> list[str]:
+        return list(self.manifest)
+
+    def get(self, service_name: str) -> dict:
+        """Returns the traced methods of a service by name, importing its plugin if needed, None if it is unknown."""
+        service = self._services.get(service_name)
+        if service is not None:
+            return service
+        entry = self.manifest.get(service_name)
+        if entry is None:
+            return None
+        with self._lock:
+            if service_name not in self._services:
+                self._services[service_name] = self._import(service_name, entry["module"])
+            return self._services[service_name]
+
+    def resolve(self, service_name: str) -> dict:
+        """Returns the traced methods of a service by name, looking for its plugin in every root if not listed yet.
+
+        Raises:
+            LookupError: No root provides the service, or it was rejected less than negative_ttl seconds ago.
+            Exception: The plugin exists but could not be imported (then rejected for negative_ttl seconds).
+        """
+        service = self._services.get(service_name)
+        registry.record_cache("plugins", service is not None)
+        if service is not None:
+            return service
+        rejected = self._unknown.get(service_name)
+        if rejected is not None and rejected[0] > time.monotonic():
+            raise LookupError(rejected[1])
+
+        if service_name not in self.manifest:
+            entry = self._find(service_name)
+            if entry is None:
+                self._reject(service_name, f"Service {service_name} does not exist")
+                raise LookupError(f"Service {service_name} does not exist")
+            self.manifest[service_name] = entry
+        try:
+            service = self.get(service_name)
+        except Exception as error:
+            self._reject(service_name, f"Service {service_name} could not be imported - {error.__str__()}")
+            raise
+        self._unknown.pop(service_name, None)
+        return service
+
+    def _reject(self, service_name: str, reason: str):
+        with self._lock:
+            if len(self._unknown) >= PLUGIN_NEGATIVE_MAX_ENTRIES:
+                self._unknown.clear()
+            self._unknown[service_name] = (time.monotonic() + self.negative_ttl, reason)
+
+    def __getitem__(self, service_name: str) -> dict:
+        service = self.get(service_name)
+        if service is None:
+            raise KeyError(service_name)
+        return service
+
+    def __setitem__(self, service_name: str, service: dict):
+        self._services[service_name] = service
+
+    def __contains__(self, service_name: str) -> bool:
+        return service_name in self._services or service_name in self.manifest
+
+    def __len__(self) -> int:
+        return len(set(self.manifest) | set(self._services))
+
+    def _import(self, service_name: str, module_name: str) -> dict:
+        with span("plugin.import", service=service_name):
+            module = importlib.import_module(module_name)
+        return {
+            method: traced(f"{service_name}.{method}", plugin_phase(method))(getattr(module, method))
+            for method in self.methods
+        }
+
+    def _find(self, service_name: str) -> dict:
+        # Only plain names can match a plugin file, anything else (e.g. "../x") is unknown
+        if not service_name.isidentifier():
+            return None
+        for root in self.roots:
+            file = Path(root) / f"{self.prefix}_{service_name}.py"
+            if file.is_file():
+                entry = self._entry(root, file, service_name)
+                if entry is not None:
+                    return entry
+        return None
+
+    def _entry(self, root: str, file: Path, service_name: str) -> dict:
+        """The manifest entry of a plugin file, None (logged) if it cannot be parsed or misses a method."""
+        try:
+            exports = module_exports(file)
+        except Exception as error:
+            logging.error(f"Error reading service {service_name} from {file}: {error.__str__()}")
+            return None
+        missing = [method for method in self.methods if method not in exports]
+        if len(missing) > 0:
+            logging.error(f"Service {service_name} ({file}) does not define {', '.join(missing)}")
+            return None
+        return {
+            "module": root.replace("/", ".") + "." + file.stem,
+            "path": str(file),
+            "methods": sorted(exports & set(self.methods)),
+        }
+
+    def _cache_key(self) -> dict:
+        return {root: os.stat(root).st_mtime_ns for root in self.roots if os.path.isdir(root)}
+
+    def _load_manifest(self) -> dict:
+        key = self._cache_key()
+        if self.cache_path is not None:
+            try:
+                with open(self.cache_path) as file:
+                    cached = json.load(file)
+                if (cached["key"], cached["prefix"], cached["methods"]) == (key, self.prefix, self.methods):
+                    return cached["manifest"]
+            except FileNotFoundError:
+                pass
+            except Exception as error:
+                logging.error(f"plugin manifest cache {self.cache_path} - {error.__str__()}")
+
+        manifest = self._scan()
+        if self.cache_path is not None:
+            try:
+                # Written aside and renamed, so that concurrent workers never read a partial file
+                temporary = f"{self.cache_path}.{os.getpid()}.tmp"
+                with open(temporary, "w") as file:
+                    json.dump({"key": key, "prefix": self.prefix, "methods": self.methods, "manifest": manifest}, file)
+                os.replace(temporary, self.cache_path)
+            except Exception as error:
+                logging.error(f"plugin manifest cache {self.cache_path} - {error.__str__()}")
+        return manifest
+
+    def _scan(self) -> dict:
+        manifest = {}
+        for root in self.roots:
+            try:
+                files = sorted(Path(root).glob(f"{self.prefix}_*.py"))
+            except Exception as error:
+                logging.error(f"Error listing services from {root}: {error.__str__()}")
+                continue
+            for file in files:
+                service_name = file.stem.replace(f"{self.prefix}_", "", 1)
+                entry = self._entry(root, file, service_name)
+                if entry is None:
+                    continue
+                if service_name in manifest:
+                    logging.error(f"Service {service_name} ({file}) is already provided by {manifest[service_name]['path']}")
+                    continue
+                manifest[service_name] = entry
+        return manifest
@@ -0,0 +1,82 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+
+PROFILER_ENABLED = os.getenv("MESON_PROFILER_ENABLED", "false").lower() in ("1", "true")
+PROFILER_MAX_SECONDS = float(os.getenv("MESON_PROFILER_MAX_SECONDS", 60))
+PROFILER_INTERVAL = float(os.getenv("MESON_PROFILER_INTERVAL", 0.01))  # seconds between two samples
+PROFILER_MAX_DEPTH = 128
+
+# A single profile per worker at a time: cProfile cannot run twice and two samplers would double the overhead
+profiler_lock = threading.Lock()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Statistical profiler sampling the stacks of every thread of the worker.
+
+    A daemon thread walks sys._current_frames() every interval seconds and counts the identical stacks, the
+    profiled code is never instrumented so the overhead only depends on the interval and the number of threads.
+    The result is in the collapsed stack format ("thread;outer;...;inner count" per line) read by
+    flamegraph.pl, speedscope and inferno.
+
+    Attributes:
+        interval (float): Seconds between two samples.
+        samples (int): Number of samples taken so far.
+    """
+
+    def __init__(self, interval: float = PROFILER_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILER_MAX_DEPTH:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            self.sample()
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - start)))
+
+
+def pstats_report(profiler: cProfile.Profile, sort: str = "cumulative", limit: int = 100) -> str:
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
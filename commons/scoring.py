@@ -0,0 +1,91 @@
+import numpy as np
+from commons.utils import TOLERANCE, installed_pci, is_set
+from models.ComputeModel import ElementoMachine
+from models.StorageModel import ElementoStorage
+
+
+def _encode(keys: list) -> tuple[np.ndarray, dict]:
+    """Maps hashable keys to integer codes, None is encoded as -1 (matches anything)."""
+    mapping = {}
+    codes = np.fromiter(
+        (-1 if key is None else mapping.setdefault(key, len(mapping)) for key in keys),
+        dtype=np.int64,
+        count=len(keys),
+    )
+    return codes, mapping
+
+
+def _exact_mask(codes: np.ndarray, mapping: dict, key) -> np.ndarray:
+    code = mapping.get(key, -2)
+    return (codes == code) | (codes == -1)
+
+
+def _rank(candidates: list, errors: np.ndarray, mask: np.ndarray, tolerance: float) -> list[tuple]:
+    mask &= np.isfinite(errors) & (errors <= tolerance)
+    selected = np.flatnonzero(mask)
+    order = selected[np.argsort(errors[selected], kind="stable")]
+    return [(candidates[i], float(errors[i])) for i in order]
+
+
+def misc_key(misc) -> tuple:
+    return (misc.os_family, misc.os_flavour) if misc is not None else None
+
+
+def arch_key(cpu) -> tuple:
+    return tuple(sorted(cpu.arch)) if cpu is not None and cpu.arch else ()
+
+
+def pci_key(pci: list) -> tuple:
+    return tuple(sorted((dev.vendor, dev.model, dev.quantity) for dev in installed_pci(pci) or []))
+
+
+def storage_flags_key(storage: ElementoStorage) -> tuple:
+    # Normalized, so that "True" (as some providers send it) matches True
+    return (is_set(storage.private), is_set(storage.readonly), is_set(storage.shareable), is_set(storage.bootable))
+
+
+class VmToleranceScorer:
+    """
+    Scores a requested machine against a whole flavor catalog at once.
+
+    It is the batch counterpart of check_vm_tolerance: the numeric dimensions of the catalog are stored as
+    arrays, so the relative error of every flavor is computed in a single vectorized pass, while misc, arch
+    and PCI devices are compared through exact-match masks. Flavors without misc accept any OS.
+
+    Attributes:
+        flavors (list[ElementoMachine]): The flavors to be scored, in catalog order.
+    """
+
+    def __init__(self, flavors: list[ElementoMachine]):
+        self.flavors = [flavor for flavor in flavors if flavor.cpu is not None and flavor.mem is not None]
+        self.capacity = np.array([flavor.mem.capacity for flavor in self.flavors], dtype=np.float64)
+        self.slots = np.array([flavor.cpu.slots for flavor in self.flavors], dtype=np.float64)
+        self.overprovision = np.array(
+            [flavor.cpu.maxOverprovision for flavor in self.flavors], dtype=np.float64
+        )
+        self.frequency = np.array([flavor.cpu.min_frequency for flavor in self.flavors], dtype=np.float64)
+        self.misc, self._misc_codes = _encode([misc_key(flavor.misc) for flavor in self.flavors])
+        self.arch, self._arch_codes = _encode([arch_key(flavor.cpu) for flavor in self.flavors])
+        self.pci, self._pci_codes = _encode([pci_key(flavor.pci) for flavor in self.flavors])
+
+    def errors(self, requested: ElementoMachine) -> np.ndarray:
+        """Returns the global relative error of every flavor, as computed by check_vm_tolerance."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(
+                ((self.capacity - requested.mem.capacity) / requested.mem.capacity) ** 2
+                + ((self.slots - requested.cpu.slots) / requested.cpu.slots) ** 2
+                + ((self.overprovision - requested.cpu.maxOverprovision) / requested.cpu.maxOverprovision) ** 2
+                + ((self.frequency - requested.cpu.min_frequency) / requested.cpu.min_frequency) ** 2
+            )
+
+    def rank(self, requested: ElementoMachine, tolerance: float = TOLERANCE) -> list[tuple[ElementoMachine, float]]:
+        """Returns the flavors within tolerance as (flavor, error) tuples, best candidate first."""
+        try:
+            mask = (
+                _exact_mask(self.misc, self._misc_codes, misc_key(requested.misc))
+                & _exact_mask(self.arch, self._arch_codes, arch_key(requested.cpu))
+                & _exact_mask(self.pci, self._pci_codes, pci_key(requested.pci))
+            )
+            return _rank(self.flavors, self.errors(requested), mask, tolerance)
+        except Exception as error:
+            raise Exception(f"vm tolerance scoring - {error.__str__()}")
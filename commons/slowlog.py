@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+
+SLOWLOG_THRESHOLD_MS = float(os.getenv("MESON_SLOWLOG_THRESHOLD_MS", 500))
+SLOWLOG_RING_SIZE = int(os.getenv("MESON_SLOWLOG_RING_SIZE", 1000))
+SLOWLOG_FILE = os.getenv("MESON_SLOWLOG_FILE")  # JSON lines copy of the slow requests, disabled if unset
+
+PHASES = ("parsing", "model", "provider", "pricing", "billing", "serialization")
+
+_request = ContextVar("meson_slowlog_request", default=None)
+_phase = ContextVar("meson_slowlog_phase", default=None)
+
+
+class RequestPhases:
+    """Time spent by a request in each phase (exclusive of nested phases) and its counters."""
+
+    __slots__ = ("phases", "counts", "service_country")
+
+    def __init__(self, service_country: str = None):
+        self.phases = {}
+        self.counts = {}
+        self.service_country = service_country
+
+
+class phase:
+    """Accounts the duration of the with block to a phase of the current request, if any.
+
+    Nested phases are exclusive: a provider call made while pricing counts as provider, not as pricing.
+    A class rather than a generator based context manager: it wraps every parsing, model and provider call.
+    """
+
+    __slots__ = ("name", "request", "parent", "token", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.request = _request.get()
+        if self.request is not None:
+            self.parent = _phase.get()
+            self.token = _phase.set(self.name)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        request = self.request
+        if request is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        _phase.reset(self.token)
+        request.phases[self.name] = request.phases.get(self.name, 0.0) + elapsed
+        if self.parent is not None:
+            request.phases[self.parent] = request.phases.get(self.parent, 0.0) - elapsed
+        return False
+
+
+def count(**counts: int):
+    """Records counters of the current request, e.g. count(vms=len(machines))."""
+    request = _request.get()
+    if request is not None:
+        request.counts.update(counts)
+
+
+class SlowRequestLog:
+    """Keeps the last SLOWLOG_RING_SIZE slow requests in memory and appends them to SLOWLOG_FILE, if set."""
+
+    def __init__(self, size: int = SLOWLOG_RING_SIZE, path: str = SLOWLOG_FILE):
+        self.records = deque(maxlen=size)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, record: dict):
+        self.records.append(record)
+        if self.path is None:
+            return
+        try:
+            with self._lock, open(self.path, "a") as file:
+                file.write(json.dumps(record, default=str) + "\n")
+        except OSError as error:
+            logging.error(f"slow request log ({self.path}) - {error.__str__()}")
+
+    def query(self, route: str = None, min_ms: float = 0, limit: int = 100) -> list[dict]:
+        """Returns the most recent slow requests first, optionally filtered by route template."""
+        records = []
+        # Copied first: other threads keep adding, and a deque mutated while iterated raises RuntimeError
+        for record in reversed(list(self.records)):
+            if (route is None or record["route"] == route) and record["duration_ms"] >= min_ms:
+                records.append(record)
+                if len(records) >= limit:
+                    break
+        return records
+
+
+slow_requests = SlowRequestLog()
+
+
+class SlowRequestMiddleware:
+    """
+    ASGI middleware recording the requests slower than SLOWLOG_THRESHOLD_MS, with their time broken down by
+    phase (see PHASES, the remainder is reported as "other"), their counters and their service_country.
+    """
+
+    def __init__(self, app, threshold_ms: float = SLOWLOG_THRESHOLD_MS, log: SlowRequestLog = slow_requests):
+        self.app = app
+        self.threshold_ms = threshold_ms
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        service_country = headers.get(b"service_country", headers.get(b"service-country"))
+        request = RequestPhases(
+            service_country.decode("latin-1") if service_country is not None else os.getenv("PROVIDER_REGION")
+        )
+        status = {}
+
+        async def phased_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                status["streaming"] = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", [])
+                )
+            await send(message)
+
+        token = _request.set(request)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, phased_send)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            _request.reset(token)
+            # Event streams are long-lived by design, they are never slow
+            if elapsed_ms >= self.threshold_ms and not status.get("streaming", False):
+                self.log.add(self._record(scope, request, status.get("code", 500), elapsed_ms))
+
+    @staticmethod
+    def _record(scope, request: RequestPhases, status_code: int, elapsed_ms: float) -> dict:
+        route = scope.get("route")
+        phases = {name: max(0.0, seconds * 1000) for name, seconds in request.phases.items()}
+        phases["other"] = max(0.0, elapsed_ms - sum(phases.values()))
+        return {
+            "timestamp": time.time(),
+            "method": scope["method"],
+            "route": route.path if route is not None else "unmatched",
+            "path": scope["path"],
+            "status_code": status_code,
+            "duration_ms": elapsed_ms,
+            "phases_ms": phases,
+            "counts": request.counts,
+            "service_country": request.service_country,
+        }
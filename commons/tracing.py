@@ -0,0 +1,276 @@
+import atexit
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from collections.abc import Sized
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from commons.slowlog import phase as request_phase
+
+
+TRACE_RING_SIZE = int(os.getenv("MESON_TRACE_RING_SIZE", 5000))  # spans kept in memory
+TRACE_FILE = os.getenv("MESON_TRACE_FILE")  # JSON lines exporter, disabled if unset
+TRACE_FLUSH_INTERVAL = float(os.getenv("MESON_TRACE_FLUSH_INTERVAL", 1))  # seconds
+
+_current_span = ContextVar("meson_current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation of a trace. Spans opened while another span is active in the same context (the same
+    request, or a thread started from it with asyncio.to_thread / run_in_threadpool) become its children.
+
+    Attributes:
+        name (str): The operation, e.g. compute_manager.get_status.
+        trace_id (str): Shared by all the spans of the same request.
+        span_id (str): Unique id of the span.
+        parent_id (str): The span_id of the enclosing span, None for the root span.
+        attributes (dict): Cardinalities (e.g. result_count) and other low-cardinality details.
+        outcome (str): ok or error.
+        error (str): The exception type, if the operation failed.
+    """
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id", "attributes", "outcome", "error", "start", "duration"
+    )
+
+    def __init__(self, name: str, parent: "Span" = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes or {}
+        self.outcome = "ok"
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "outcome": self.outcome,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter:
+    """
+    Keeps the last TRACE_RING_SIZE finished spans in memory and appends them to TRACE_FILE, if set.
+
+    Exporting never touches the file: the spans are queued and a daemon thread of the worker appends them in
+    batches every TRACE_FLUSH_INTERVAL seconds, and once more at exit.
+    """
+
+    def __init__(self, size: int = TRACE_RING_SIZE, path: str = TRACE_FILE):
+        self.spans = deque(maxlen=size)
+        self.path = path
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flusher_pid = None  # pid which started the flusher, forked workers start their own
+
+    def export(self, span: Span):
+        self.spans.append(span)
+        if self.path is None:
+            return
+        if self._flusher_pid != os.getpid():
+            self.start_flusher()
+        with self._lock:
+            self._pending.append(span)
+
+    def start_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            forked = self._flusher_pid is not None
+            self._flusher_pid = os.getpid()
+            # Spans queued before a fork are written by the parent, and its exit handler is inherited
+            self._pending = []
+        threading.Thread(target=self._flush_loop, name="trace-flusher", daemon=True).start()
+        if not forked:
+            atexit.register(self.flush)
+
+    def flush(self):
+        """Appends the queued spans to TRACE_FILE with a single write."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        lines = "".join(json.dumps(span.to_json(), default=str) + "\n" for span in batch)
+        try:
+            with open(self.path, "a") as file:
+                file.write(lines)
+        except OSError as error:
+            logging.error(f"trace exporter ({self.path}) - {error.__str__()}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(TRACE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as error:
+                logging.error(f"trace flush - {error.__str__()}")
+
+    def traces(self, trace_id: str = None, limit: int = 100) -> list[dict]:
+        """Returns the spans of the last limit traces (or of a single trace), grouped by trace_id."""
+        traces = {}
+        # Copied first: other threads keep exporting, and a deque mutated while iterated raises RuntimeError
+        for span in reversed(list(self.spans)):
+            if trace_id is not None and span.trace_id != trace_id:
+                continue
+            if span.trace_id not in traces:
+                if len(traces) >= limit:
+                    break
+                traces[span.trace_id] = []
+            traces[span.trace_id].append(span.to_json())
+        return [{"trace_id": key, "spans": spans[::-1]} for key, spans in traces.items()]
+
+
+exporter = SpanExporter()
+
+
+def current_span() -> Span:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Opens a span, child of the active one, for the duration of the with block."""
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as error:
+        current.outcome = "error"
+        current.error = type(error).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        exporter.export(current)
+
+
+def _cardinality(signature: inspect.Signature, args: tuple, kwargs: dict) -> dict:
+    try:
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+    except TypeError:
+        return {}
+    return {
+        f"{name}_count": len(value)
+        for name, value in arguments.items()
+        if isinstance(value, Sized) and not isinstance(value, (str, bytes))
+    }
+
+
+def _record_result(current: Span, result):
+    # Plugins return (response, status_code)
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], int):
+        current.attributes["status_code"] = result[1]
+        result = result[0]
+    if result is None:
+        current.attributes["result_count"] = 0
+    elif isinstance(result, Sized) and not isinstance(result, (str, bytes)):
+        current.attributes["result_count"] = len(result)
+
+
+def traced(name: str = None, phase: str = None):
+    """Decorator recording a span for every call of a (sync or async) function, with the size of its
+    collection arguments (<argument>_count), of its result (result_count) and its outcome.
+
+    With phase, the duration of the calls is also accounted to that phase of the slow request log.
+    """
+
+    def decorator(fun):
+        if getattr(fun, "__traced__", False):
+            return fun
+        span_name = name or f"{fun.__module__.rsplit('.', 1)[-1]}.{fun.__name__}"
+        signature = inspect.signature(fun)
+        phase_of = (lambda: request_phase(phase)) if phase is not None else nullcontext
+
+        if inspect.iscoroutinefunction(fun):
+
+            @functools.wraps(fun)
+            async def async_wrapper(*args, **kwargs):
+                with phase_of(), span(span_name, **_cardinality(signature, args, kwargs)) as current:
+                    result = await fun(*args, **kwargs)
+                    _record_result(current, result)
+                    return result
+
+            async_wrapper.__traced__ = True
+            return async_wrapper
+
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with phase_of(), span(span_name, **_cardinality(signature, args, kwargs)) as current:
+                result = fun(*args, **kwargs)
+                _record_result(current, result)
+                return result
+
+        wrapper.__traced__ = True
+        return wrapper
+
+    return decorator
+
+
+def instrument_module(module_name: str, exclude: tuple = (), phase: str = None, phases: dict = None):
+    """Wraps with traced every public function defined in a module.
+
+    It must run at the end of the module (or before any `from module import ...`), so that the callers
+    import the wrapped functions.
+
+    Args:
+        module_name (str): The module, usually __name__.
+        exclude (tuple): Names of the functions to leave untouched.
+        phase (str): The slow request log phase of the functions (e.g. provider).
+        phases (dict): Overrides of phase for single functions, by function name.
+    """
+    phases = phases or {}
+    module = sys.modules[module_name]
+    for attribute, value in list(vars(module).items()):
+        if (
+            inspect.isfunction(value)
+            and value.__module__ == module_name
+            and not attribute.startswith("_")
+            and attribute not in exclude
+        ):
+            setattr(module, attribute, traced(phase=phases.get(attribute, phase))(value))
+
+
+class TracingMiddleware:
+    """ASGI middleware opening the root span of every request, named after the method and route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {}
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with span(scope["method"]) as root:
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                route = scope.get("route")
+                root.name = f"{scope['method']} {route.path if route is not None else 'unmatched'}"
+                root.attributes["status_code"] = status.get("code", 500)
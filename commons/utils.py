@@ -5,6 +5,7 @@ import uuid
 from pathlib import Path
 from typing import List
 from models.ComputeModel import ElementoMachine
+from models.FingerprintModel import fingerprint_of, fingerprints_of
 from models.StorageModel import ElementoStorage
 
 
@@ -12,17 +13,27 @@ logger = logging.getLogger("__name__")
 TOLERANCE = 10  # TODO: define a proper tolerance
 
 
+def is_set(flag) -> bool:
+    """Volume flags may come from the providers as booleans or as "True"/"False" strings."""
+    return flag is True or str(flag).lower() == "true"
+
+
+def installed_pci(pci: list) -> list:
+    """The PCI devices actually requested, a device with a quantity of 0 is no device."""
+    return [dev for dev in pci if dev.quantity > 0] if pci is not None else None
+
+
 def check_storage_tolerance(
     requested: ElementoStorage, proposed: ElementoStorage
 ) -> bool:
     try:
-        err_margin = math.sqrt(((proposed.size - requested.size) / requested.size) ** 2)
+        err_margin = abs((proposed.size - requested.size) / requested.size)
         is_config_ok = (
             err_margin <= TOLERANCE
-            and proposed.private == requested.private
-            and proposed.readonly == requested.readonly
-            and proposed.shareable == requested.shareable
-            and proposed.bootable == requested.bootable
+            and is_set(proposed.private) == is_set(requested.private)
+            and is_set(proposed.readonly) == is_set(requested.readonly)
+            and is_set(proposed.shareable) == is_set(requested.shareable)
+            and is_set(proposed.bootable) == is_set(requested.bootable)
         )
         return is_config_ok
     except Exception as error:
@@ -42,7 +53,7 @@ def check_storage_params(config: ElementoStorage) -> bool:
     return True
 
 
-def check_vm_tolerance(requested: ElementoMachine, proposed: ElementoMachine) -> bool:
+def check_vm_tolerance(requested: ElementoMachine, proposed: ElementoMachine, tolerance: float = TOLERANCE) -> bool:
     try:
         err_margin_capacity = (
             (proposed.mem.capacity - requested.mem.capacity) / requested.mem.capacity
@@ -67,19 +78,10 @@ def check_vm_tolerance(requested: ElementoMachine, proposed: ElementoMachine) ->
         )
 
         is_config_ok = (
-            err_margin_global <= TOLERANCE
-            and proposed.misc.to_json() == requested.misc.to_json()
-            and proposed.cpu.arch.sort() == requested.cpu.arch.sort()
-            and (
-                [pci.to_json() for pci in proposed.pci].sort()
-                if proposed.pci is not None
-                else []
-            )
-            == (
-                [pci.to_json() for pci in requested.pci].sort()
-                if requested.pci is not None
-                else []
-            )
+            err_margin_global <= tolerance
+            and fingerprint_of(proposed.misc) == fingerprint_of(requested.misc)
+            and sorted(proposed.cpu.arch or []) == sorted(requested.cpu.arch or [])
+            and fingerprints_of(installed_pci(proposed.pci)) == fingerprints_of(installed_pci(requested.pci))
         )
         return is_config_ok
     except Exception as error:
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Callable
+from commons.instrumentation import registry
+from commons.utils import is_set
+from models.StorageModel import ElementoStorage
+
+
+VOLUME_CACHE_TTL = int(os.getenv("VOLUME_CACHE_TTL", 60))  # seconds
+VOLUME_CACHE_MAX_ENTRIES = int(os.getenv("VOLUME_CACHE_MAX_ENTRIES", 100000))
+VOLUME_FETCH_CONCURRENCY = int(os.getenv("VOLUME_FETCH_CONCURRENCY", 8))  # provider calls in flight per lookup
+
+
+class StorageUsage:
+    """
+    Running storage usage of each creator, per region: volume count and GB, in total, bootable and shareable.
+
+    A creator is tracked from its first full listing (reset), then every volume added or removed through the
+    meson updates its totals in constant time. Volumes of creators not tracked yet are ignored, so the totals
+    are never built from a partial listing, and the shared volumes of other creators in a listing are not
+    counted. Adding a volume already counted replaces it (e.g. resized).
+    """
+
+    def __init__(self):
+        self._totals = {}  # (region, creator_id) -> [volumes, size, bootable volumes, bootable size, shareable ...]
+        self._volumes = {}  # (region, volume_uuid) -> (creator_id, size, bootable, shareable)
+        self._owned = {}  # (region, creator_id) -> set of volume_uuid counted in its totals
+        self._lock = threading.Lock()
+
+    def tracked(self, creator_id: str, service_country: str) -> bool:
+        return (service_country, creator_id) in self._totals
+
+    def reset(self, creator_id: str, service_country: str, storages: list[ElementoStorage]):
+        """Starts (or restarts) tracking a creator from the full listing of its volumes."""
+        with self._lock:
+            for volume_uuid in self._owned.pop((service_country, creator_id), ()):
+                self._volumes.pop((service_country, volume_uuid), None)
+            self._totals[(service_country, creator_id)] = [0, 0, 0, 0, 0, 0]
+            for storage in storages:
+                if storage.creator_id == creator_id:
+                    self._discard(storage.volume_uuid, service_country)
+                    self._add(storage, service_country)
+
+    def add(self, storage: ElementoStorage, service_country: str):
+        with self._lock:
+            if (service_country, storage.creator_id) in self._totals:
+                self._discard(storage.volume_uuid, service_country)
+                self._add(storage, service_country)
+
+    def remove(self, volume_uuid: str, service_country: str):
+        with self._lock:
+            self._discard(volume_uuid, service_country)
+
+    def get(self, creator_id: str, service_country: str) -> dict:
+        """Returns the usage of a creator, None if it is not tracked yet."""
+        totals = self._totals.get((service_country, creator_id))
+        if totals is None:
+            return None
+        totals = list(totals)
+        return {
+            "creator_id": creator_id,
+            "region": service_country,
+            "volumes": totals[0],
+            "size": totals[1],
+            "bootable": {"volumes": totals[2], "size": totals[3]},
+            "shareable": {"volumes": totals[4], "size": totals[5]},
+        }
+
+    def invalidate(self, service_country: str = None):
+        with self._lock:
+            for index in (self._totals, self._volumes, self._owned):
+                for key in [key for key in index if service_country is None or key[0] == service_country]:
+                    del index[key]
+
+    def _add(self, storage: ElementoStorage, service_country: str):
+        # Called with the lock held
+        entry = (storage.creator_id, int(storage.size or 0), is_set(storage.bootable), is_set(storage.shareable))
+        self._volumes[(service_country, storage.volume_uuid)] = entry
+        self._owned.setdefault((service_country, storage.creator_id), set()).add(storage.volume_uuid)
+        self._update(entry, service_country, 1)
+
+    def _discard(self, volume_uuid: str, service_country: str):
+        # Called with the lock held
+        entry = self._volumes.pop((service_country, volume_uuid), None)
+        if entry is not None:
+            self._owned.get((service_country, entry[0]), set()).discard(volume_uuid)
+            self._update(entry, service_country, -1)
+
+    def _update(self, entry: tuple, service_country: str, sign: int):
+        creator_id, size, bootable, shareable = entry
+        totals = self._totals.get((service_country, creator_id))
+        if totals is None:
+            return
+        totals[0] += sign
+        totals[1] += sign * size
+        if bootable:
+            totals[2] += sign
+            totals[3] += sign * size
+        if shareable:
+            totals[4] += sign
+            totals[5] += sign * size
+
+
+class VolumeInventory:
+    """
+    Read-through cache of the provider volumes, indexed by volume_uuid and by creator_id, per region.
+
+    Lookups by id and listings by creator are answered from memory while fresh (ttl seconds), otherwise they
+    are loaded from the provider. The storage manager registers its lookups (information_about_storages_by_id,
+    _by_ids and _by_client_id) with register_loaders when it is imported, so the compute and storage mesons share
+    the same volumes; a loader can still be given per call. Volumes created or destroyed through the meson are written
+    through (put / remove), so the cache never serves a destroyed volume. A new volume is added to the listing of
+    its creator; a non-private one is listed for every client, so the other listings of its region are dropped
+    and reloaded on their next use. Volumes created outside the meson show up once the listings expire.
+    The storage usage of each creator is kept up to date by the same writes (see StorageUsage), it does not expire.
+
+    Attributes:
+        ttl (int): Seconds a volume (or a creator listing) is served without asking the provider.
+    """
+
+    def __init__(self, ttl: int = VOLUME_CACHE_TTL, max_entries: int = VOLUME_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._volumes = {}  # (region, volume_uuid) -> (expires, ElementoStorage)
+        self._creators = {}  # (region, creator_id) -> (expires, set of volume_uuid)
+        self._lock = threading.Lock()
+        self._batch_supported = True
+        self.usage = StorageUsage()
+        self.loader = None
+        self.batch_loader = None
+        self.creator_loader = None
+
+    def register_loaders(self, loader: Callable, batch_loader: Callable = None, creator_loader: Callable = None):
+        """Sets the default provider lookups: by id, by ids at once (optional) and by creator."""
+        self.loader = loader
+        self.batch_loader = batch_loader
+        self.creator_loader = creator_loader
+
+    def get(self, volume_uuid: str, service_country: str, loader: Callable = None) -> ElementoStorage:
+        """Returns a volume by id, from memory if fresh, otherwise from loader(volume_uuid, service_country)."""
+        cached = self._volumes.get((service_country, volume_uuid))
+        hit = cached is not None and cached[0] > time.monotonic()
+        registry.record_cache("volume_inventory", hit)
+        if hit:
+            return cached[1]
+
+        storage = (loader or self.loader)(volume_uuid, service_country)
+        if storage is not None:
+            self.put(storage, service_country)
+        return storage
+
+    def cached(self, volume_uuid: str, service_country: str) -> ElementoStorage:
+        """Returns a volume by id if it is in memory and fresh, None otherwise, never calling the provider."""
+        cached = self._volumes.get((service_country, volume_uuid))
+        return cached[1] if cached is not None and cached[0] > time.monotonic() else None
+
+    async def get_many(
+        self,
+        volume_uuids: list[str],
+        service_country: str,
+        loader: Callable = None,
+        batch_loader: Callable = None,
+        concurrency: int = VOLUME_FETCH_CONCURRENCY,
+    ) -> list[tuple]:
+        """Returns the volumes in the order of volume_uuids, as (ElementoStorage, None) or (None, error).
+
+        Fresh volumes are answered from memory. The others are fetched with a single
+        batch_loader(volume_uuids, service_country) call if the provider supports it (it returns None
+        otherwise), or with up to concurrency concurrent loader(volume_uuid, service_country) calls.
+        A missing volume is reported as a LookupError, a failed fetch as the raised exception.
+        """
+        loader = loader or self.loader
+        batch_loader = batch_loader or self.batch_loader
+        found = {}
+        for volume_uuid in volume_uuids:
+            storage = self.cached(volume_uuid, service_country)
+            registry.record_cache("volume_inventory", storage is not None)
+            if storage is not None:
+                found[volume_uuid] = storage
+        missing = [volume_uuid for volume_uuid in dict.fromkeys(volume_uuids) if volume_uuid not in found]
+
+        if len(missing) > 0 and batch_loader is not None and self._batch_supported:
+            try:
+                storages = await asyncio.to_thread(batch_loader, missing, service_country)
+                if storages is None:
+                    self._batch_supported = False
+                else:
+                    for storage in storages:
+                        self.put(storage, service_country)
+                        found[storage.volume_uuid] = storage
+                    missing = []
+            except Exception as error:
+                logging.error(f"volume batch lookup ({service_country}) - {error.__str__()}")
+
+        if len(missing) > 0:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def fetch(volume_uuid: str):
+                async with semaphore:
+                    return await asyncio.to_thread(loader, volume_uuid, service_country)
+
+            results = await asyncio.gather(*[fetch(volume_uuid) for volume_uuid in missing], return_exceptions=True)
+            for volume_uuid, result in zip(missing, results):
+                if isinstance(result, ElementoStorage):
+                    self.put(result, service_country)
+                found[volume_uuid] = result
+
+        return [self._outcome(volume_uuid, found.get(volume_uuid)) for volume_uuid in volume_uuids]
+
+    @staticmethod
+    def _outcome(volume_uuid: str, result) -> tuple:
+        if isinstance(result, ElementoStorage):
+            return result, None
+        if isinstance(result, Exception):
+            return None, result
+        return None, LookupError(f"Volume {volume_uuid} not found")
+
+    def by_creator(self, creator_id: str, service_country: str, loader: Callable = None) -> list[ElementoStorage]:
+        """Returns the volumes of a creator, from memory if fresh, otherwise from loader(creator_id, service_country)."""
+        now = time.monotonic()
+        with self._lock:
+            listing = self._creators.get((service_country, creator_id))
+            volume_uuids = tuple(listing[1]) if listing is not None and listing[0] > now else None
+        if volume_uuids is not None:
+            volumes = [self._volumes.get((service_country, volume_uuid)) for volume_uuid in volume_uuids]
+            if all(volume is not None for volume in volumes):
+                registry.record_cache("volume_inventory", True)
+                return [volume[1] for volume in volumes]
+        registry.record_cache("volume_inventory", False)
+        return self._load_creator(creator_id, service_country, loader)
+
+    def usage_of(self, creator_id: str, service_country: str, loader: Callable = None) -> dict:
+        """Returns the storage usage of a creator (see StorageUsage.get).
+
+        Only the first call for a creator lists its volumes with loader(creator_id, service_country), the
+        usage is then updated incrementally by put and remove.
+        """
+        usage = self.usage.get(creator_id, service_country)
+        registry.record_cache("storage_usage", usage is not None)
+        if usage is None:
+            self._load_creator(creator_id, service_country, loader)
+            usage = self.usage.get(creator_id, service_country)
+        return usage
+
+    def _load_creator(self, creator_id: str, service_country: str, loader: Callable) -> list[ElementoStorage]:
+        storages = (loader or self.creator_loader)(creator_id, service_country) or []
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._evict()
+            for storage in storages:
+                self._volumes[(service_country, storage.volume_uuid)] = (expires, storage)
+            self._creators[(service_country, creator_id)] = (expires, {storage.volume_uuid for storage in storages})
+        # A full listing is authoritative: the usage of the creator is recomputed from it
+        self.usage.reset(creator_id, service_country, storages)
+        return storages
+
+    def put(self, storage: ElementoStorage, service_country: str, created: bool = False):
+        """Stores a volume. It is added to the cached listing of its creator, if any.
+
+        Args:
+            storage (ElementoStorage): The volume.
+            service_country (str): Its region.
+            created (bool): The volume was just created: if it is not private, the cached listings of the other
+            creators of the region are dropped, as it is listed for them too.
+        """
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._evict()
+            self._volumes[(service_country, storage.volume_uuid)] = (expires, storage)
+            listing = self._creators.get((service_country, storage.creator_id))
+            if listing is not None:
+                listing[1].add(storage.volume_uuid)
+            if created and not is_set(storage.private):
+                for key in [key for key in self._creators if key[0] == service_country and key[1] != storage.creator_id]:
+                    del self._creators[key]
+        self.usage.add(storage, service_country)
+
+    def remove(self, volume_uuid: str, service_country: str) -> ElementoStorage:
+        """Forgets a volume, e.g. just destroyed, and returns it if it was cached."""
+        self.usage.remove(volume_uuid, service_country)
+        with self._lock:
+            cached = self._volumes.pop((service_country, volume_uuid), None)
+            if cached is None:
+                return None
+            listing = self._creators.get((service_country, cached[1].creator_id))
+            if listing is not None:
+                listing[1].discard(volume_uuid)
+            return cached[1]
+
+    def invalidate(self, service_country: str = None):
+        self.usage.invalidate(service_country)
+        with self._lock:
+            if service_country is None:
+                self._volumes.clear()
+                self._creators.clear()
+                return
+            for index in (self._volumes, self._creators):
+                for key in [key for key in index if key[0] == service_country]:
+                    del index[key]
+
+    def _evict(self):
+        # Called with the lock held: drops the expired entries once the cache grows past max_entries
+        if len(self._volumes) < self.max_entries:
+            return
+        now = time.monotonic()
+        for index in (self._volumes, self._creators):
+            for key in [key for key, value in index.items() if value[0] <= now]:
+                del index[key]
+        if len(self._volumes) >= self.max_entries:
+            self._volumes.clear()
+            self._creators.clear()
+
+
+inventory = VolumeInventory()
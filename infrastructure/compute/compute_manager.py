@@ -1,29 +1,16 @@
 import datetime
+from commons.tracing import instrument_module
+from commons.catalog import ComputeOfferCatalog
 from models.ComputeModel import ElementoAuth, ElementoCpu, ElementoMachine, ElementoMemory, ElementoMisc, ElementoNetworkConfig
-from models.StorageModel import ElementoStorage
 
 
 client_uuid = "079b72f8-edf1-4fa9-8b22-2b1e364acdc7"
 volume_uuid = "4c291861-8622-4e19-a9a1-0e48f305ac00"
 vm_uuid = "65742f3f-f0f6-4f46-bf7c-f2ce95a14bc8"
-volumes = [
-    ElementoStorage(
-        volume_uuid=volume_uuid,
-        creator_id=client_uuid,
-        billing_uuid=volume_uuid,
-        name="test-volume-mockup",
-        private="False",
-        readonly="False",
-        shareable="False",
-        bootable="False",
-        size=40,
-        creation_date=str(datetime.datetime.now()),
-    )
-]
 machine = ElementoMachine(
     client_uuid=client_uuid,
     vm_name="test-mockup",
-    volumes=volumes,
+    volume_uuids=[volume_uuid],
     billing_uuid=vm_uuid,
     vm_uuid=vm_uuid,
     cpu=ElementoCpu(
@@ -49,6 +36,16 @@ machine = ElementoMachine(
     auth=ElementoAuth(),
     creation_date=str(datetime.datetime.now()),
 )
+flavors = [
+    ElementoMachine(
+        cpu=ElementoCpu(slots=slots, min_frequency=2.4, arch=["x86"], flags=[]),
+        mem=ElementoMemory(capacity=capacity),
+        pci=[],
+        notes={"flavor": f"mockup-{slots}c-{capacity // 1024}g"},
+    )
+    for slots in [1, 2, 4, 8, 16]
+    for capacity in [1024, 2048, 4096, 8192, 16384, 32768]
+]
 
 def get_status() -> list[ElementoMachine]:
     """Returns all running machines as a list of ElementoMachines.
@@ -85,6 +82,9 @@ def adapt_csp_instance_to_meson(machine) -> str:
 def retrieve_machine_config(machine_id: str, service_country: str) -> ElementoMachine:
     """Returns an ElementoMachine objects that are owned by the given machine_id.
 
+    The attached volumes can be given by id only (volume_uuids instead of volumes): they are then resolved through
+    the shared volume registry with the storage manager, instead of being fetched again for every machine.
+
     Args:
         machine_id (str): The machine id that refers to the Machine.
         service_country (str): The service country where the Machine is located.
@@ -103,7 +103,8 @@ def list_running(client_uuid: str, service_country: str) -> list[ElementoMachine
     """Returns a list of ElementoMachine objects that are owned by the given client_uuid.
 
     This method should check if a Compute Instance (Machine) that is running is owned by the given client_uuid,
-    and return only the matching ones.
+    and return only the matching ones. As for retrieve_machine_config, the attached volumes can be given by id only
+    (volume_uuids), each volume is then fetched once for the whole listing.
 
     Args:
         client_uuid (str): The client_uuid that needs to be checked.
@@ -128,19 +129,43 @@ def is_config_available(config: ElementoMachine, service_country: str) -> Elemen
     For example, if the requested RAM quantity is 512miB but only a 500miB or 1GiB config is available, the 500miB
     option should be used. Or if 6GiB are requested but the closest available configurations are 4 or 8GiB the 8GiB option
     should be used.
+    The offer catalog already implements this nearest-fit lookup over the flavors returned by list_flavors, without
+    calling the provider on every request.
     Args:
         config (ElementoMachine): The configuration that needs to be checked.
         service_country (str): optional, region to use.
     Returns:
-        A Machine that is compatible with your service.
+        A Machine that is compatible with your service, None if no compatible configuration exists.
     Raises:
         Exception:
             Raised when a fatal error happens. Should only be thrown when an unrecoverable error occurs as it when
             caught it will result in a 500 Internal Server Error API response with the given error message inside the
             Exception.
     """
+    return offer_catalog.closest(config, service_country)
 
-    return machine
+
+def list_flavors(service_country: str) -> list[ElementoMachine]:
+    """Returns every machine configuration (flavor) offered by the provider in a region.
+
+    Used by the offer catalog to build its nearest-fit indexes, it is called once per region and then
+    periodically in background, never per request. Each flavor should fill at least cpu (slots, maxOverprovision,
+    min_frequency, arch, flags), mem (capacity, requireECC) and pci. The provider flavor identifier can be stored
+    inside notes, it will be copied in the configuration returned by is_config_available.
+
+    Args:
+        service_country (str): The region whose flavors have to be listed.
+    Returns:
+        A list of ElementoMachine objects, one for each flavor.
+    Raises:
+        Exception:
+            Raised when a fatal error happens. The offer catalog keeps serving the previous flavors of the region
+            if a background refresh fails.
+    """
+    return flavors
+
+
+offer_catalog = ComputeOfferCatalog(loader=list_flavors)
 
 
 def async_create_compute_machine(machine: ElementoMachine, service_country: str) -> str:
@@ -300,7 +325,31 @@ def get_servers_metrics(client_uuid: str, vm_uuid: str = None, service_country:
     """
     return [
         {
-            "itemID": vm_uuid,
+            "itemID": vm_uuid if vm_uuid is not None else machine.vm_uuid,
             "status": "Active",
         }
     ]
+
+
+def get_all_servers_metrics(service_country: str) -> list[dict]:
+    """Retrieve the metrics of every server of a region with as few provider calls as possible.
+
+    Optional batch counterpart of get_servers_metrics used by the background metrics collector. Implement it
+    when the provider exposes a bulk/list metrics API: a single call per collection round then replaces one
+    get_servers_metrics call per client. Keep returning None otherwise and the collector will fall back to
+    get_servers_metrics.
+
+    Args:
+        service_country (str): The service country whose servers have to be collected.
+
+    Returns:
+        list: A list of dictionaries containing server metrics, in the same format of get_servers_metrics
+        (itemID is mandatory), or None if the provider does not support batch retrieval.
+
+    Raises:
+        Exception: Raised when there is an error in retrieving information about the servers.
+    """
+    return None
+
+# Every public function above is traced (see commons/tracing.py), keep this call at the end of the module
+instrument_module(__name__, phase="provider")
@@ -1,5 +1,27 @@
+import datetime
 from models.StorageModel import ElementoStorage
-from infrastructure.compute.compute_manager import volumes
+from commons.tracing import instrument_module
+from commons.catalog import StorageOfferCatalog
+from commons.utils import is_set
+from commons.volumes import inventory
+
+
+client_uuid = "079b72f8-edf1-4fa9-8b22-2b1e364acdc7"
+volume_uuid = "4c291861-8622-4e19-a9a1-0e48f305ac00"
+volumes = [
+    ElementoStorage(
+        volume_uuid=volume_uuid,
+        creator_id=client_uuid,
+        billing_uuid=volume_uuid,
+        name="test-volume-mockup",
+        private="False",
+        readonly="False",
+        shareable="False",
+        bootable="False",
+        size=40,
+        creation_date=str(datetime.datetime.now()),
+    )
+]
 
 
 def information_about_storages_by_id(volume_uuid: str, service_country: str) -> ElementoStorage:
@@ -10,9 +32,9 @@ def information_about_storages_by_id(volume_uuid: str, service_country: str) ->
         service_country (str): optional, region to use.
 
     Returns:
-        An ElementoStorage objects that match the given ID.
+        An ElementoStorage objects that match the given ID, None if it does not exist.
     """
-    return volumes[0]
+    return next((volume for volume in volumes if volume.volume_uuid == volume_uuid), None)
 
 
 def information_about_storages_by_client_id(client_uuid: str, service_country: str) -> list[ElementoStorage]:
@@ -23,14 +45,36 @@ def information_about_storages_by_client_id(client_uuid: str, service_country: s
         service_country (str): optional, region to use.
 
     Returns:
-        A list of ElementoStorage objects that are linked to the given client ID.
+        A list of ElementoStorage objects that are linked to the given client ID: its own volumes and the
+        non-private volumes of the other clients.
     """
-    return volumes
+    return [volume for volume in volumes if volume.creator_id == client_uuid or not is_set(volume.private)]
+
+
+def information_about_storages_by_ids(volume_uuids: list[str], service_country: str) -> list[ElementoStorage]:
+    """Fetches information about several storages with a single provider call.
+
+    Optional: return None if the provider has no batch API, the storages are then fetched one by one
+    with information_about_storages_by_id.
+
+    Args:
+        volume_uuids (list[str]): The IDs of the storages.
+        service_country (str): optional, region to use.
+
+    Returns:
+        The ElementoStorage objects found (missing IDs are simply left out), None if not supported.
+    """
+    return None
 
 
 def is_storage_available(config: ElementoStorage, service_country: str) -> ElementoStorage:
     """Checks if a given storage is available.
 
+    A volume is available when an offer has exactly the requested private/readonly/shareable/bootable flags and a
+    size within TOLERANCE of the requested one; the returned storage takes the size (and notes) of the closest such
+    offer. storage_offer_catalog answers this from the size tiers of list_storage_offers, so the provider is not
+    called per request: only override it if the provider can size volumes freely.
+
     Args:
         config (ElementoStorage): The storage configuration to check.
         service_country (str): optional, region to use.
@@ -39,7 +83,39 @@ def is_storage_available(config: ElementoStorage, service_country: str) -> Eleme
         The storage pricing if it is available, None otherwise, and
 
     """
-    return volumes[0]
+    return storage_offer_catalog.closest(config, service_country)
+
+
+def list_storage_offers(service_country: str) -> list[ElementoStorage]:
+    """Returns every volume configuration offered by the provider in a region.
+
+    Used by the storage offer catalog to build its size tiers, it is called once per region and then periodically
+    in background, never per request. Each offer should fill at least size and the private, readonly, shareable
+    and bootable flags, one offer per size and flags combination. The provider volume type can be stored inside
+    notes, it will be copied in the storage returned by is_storage_available.
+
+    Args:
+        service_country (str): The region whose storage offers have to be listed.
+    Returns:
+        A list of ElementoStorage objects, one for each offer.
+    Raises:
+        Exception:
+            Raised when a fatal error happens. The offer catalog keeps serving the previous offers of the region
+            if a background refresh fails.
+    """
+    return [
+        ElementoStorage(
+            private=volumes[0].private,
+            readonly=volumes[0].readonly,
+            shareable=volumes[0].shareable,
+            bootable=volumes[0].bootable,
+            size=size,
+        )
+        for size in [10, 20, 40, 80, 160, 320, 640, 1280]
+    ]
+
+
+storage_offer_catalog = StorageOfferCatalog(loader=list_storage_offers)
 
 
 def create_storage(storage_data: ElementoStorage, service_country: str) -> ElementoStorage:
@@ -66,3 +142,10 @@ def destroy_storage(volume_uuid: str, service_country: str) -> str:
         The ID of the storage that was deleted.
     """
     return volumes[0].volume_uuid
+
+# Every public function above is traced (see commons/tracing.py), keep this call at the end of the module
+instrument_module(__name__, phase="provider")
+# The lookups are made through the shared volume inventory (commons/volumes.py), by every meson
+inventory.register_loaders(
+    information_about_storages_by_id, information_about_storages_by_ids, information_about_storages_by_client_id
+)
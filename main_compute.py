@@ -1,32 +1,31 @@
-import json
 import logging
 import traceback
 import uuid
 import os
 import requests
+from contextlib import asynccontextmanager
 
 from __init__ import __version__
 from fastapi import FastAPI, Request
-from fastapi.responses import Response, JSONResponse, PlainTextResponse
+from fastapi.responses import Response, JSONResponse, PlainTextResponse, StreamingResponse
 from commons.utils import (
     get_from_dict,
     check_vm_tolerance,
     check_vm_params
 )
+from commons.metrics_store import MetricsStore, MetricsCollector, RateLimited
+from commons.events import StateChangeBroadcaster
+from commons.admin import install_admin
+from commons.instrumentation import registry
+from commons.slowlog import phase, count
+from commons.volumes import inventory
 from commons.billing import (
     add_billing_details,
     update_billing_details,
-    get_pricing,
+    get_model_pricing,
 )
-from models.ComputeModel import (
-    ElementoMachine,
-    ElementoCpu,
-    ElementoMisc,
-    ElementoAuth,
-    ElementoMemory,
-    ElementoPciDev,
-)
-from models.StorageModel import ElementoStorage
+from models.ComputeModel import ElementoMachine
+from models.RequestModel import parse_machine_request, RequestParsingError
 from infrastructure.compute.compute_manager import (
     get_status,
     retrieve_machine_config,
@@ -38,11 +37,15 @@ from infrastructure.compute.compute_manager import (
     stop_server,
     restart_server,
     get_servers_metrics,
+    get_all_servers_metrics,
 )
+# Registers the volume lookups of the shared volume inventory
+import infrastructure.storage.storage_manager
 from errors.server_errors import (
     ElementoBillingFailed,
     ElementoCreationFailed,
     ElementoInternalServerError,
+    ElementoServiceUnavailable,
 )
 from errors.client_errors import (
     ElementoBadRequest,
@@ -51,7 +54,72 @@ from errors.client_errors import (
     ElementoTooEarly,
 )
 
-app = FastAPI(docs_url=None)
+metrics_store = MetricsStore()
+metrics_collector = MetricsCollector(
+    store=metrics_store,
+    list_machines=get_status,
+    fetch_metrics=get_servers_metrics,
+    fetch_all_metrics=get_all_servers_metrics,
+    regions=os.getenv("METRICS_REGIONS", os.getenv("PROVIDER_REGION", "")).split(","),
+)
+
+state_changes = StateChangeBroadcaster(snapshot=get_status)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics_collector.start()
+    yield
+    metrics_collector.stop()
+
+
+app = FastAPI(docs_url=None, lifespan=lifespan)
+install_admin(app, "compute")
+
+
+def request_field_errors(error: RequestParsingError) -> list[BadRequestFieldError]:
+    return [
+        BadRequestFieldError(
+            field=field_error["field"],
+            where="BODY",
+            error=field_error["error"],
+            type=field_error["type"],
+            expected_value=field_error["expected_value"],
+        )
+        for field_error in error.field_errors
+    ]
+
+
+async def resolve_volumes(machines: list[ElementoMachine], service_country: str) -> dict:
+    """Looks up once each volume the machines reference by volume_uuid, in the shared volume registry.
+
+    Returns:
+        The ElementoStorage by volume_uuid, for get_model_pricing (see serialize_volumes for to_json_running).
+        Volumes not found are left out.
+    """
+    volume_uuids = list(
+        dict.fromkeys(
+            volume_uuid
+            for machine in machines
+            if machine.volumes is None
+            for volume_uuid in machine.volume_uuids or []
+        )
+    )
+    if len(volume_uuids) == 0:
+        return {}
+    lookups = await inventory.get_many(volume_uuids, service_country)
+    volumes = {}
+    for volume_uuid, (storage, error) in zip(volume_uuids, lookups):
+        if storage is not None:
+            volumes[volume_uuid] = storage
+        elif not isinstance(error, LookupError):
+            logging.error(f"resolve_volumes ({volume_uuid}) - {error.__str__()}")
+    return volumes
+
+
+def serialize_volumes(volumes: dict) -> dict:
+    """Serializes once each volume returned by resolve_volumes, shared by all the machines of a listing."""
+    return {volume_uuid: storage.to_json() for volume_uuid, storage in volumes.items()}
 
 
 @app.get("/")
@@ -111,10 +179,13 @@ async def server_description_by_id(req: Request, vm_uuid: str):
         service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
         machine_config = retrieve_machine_config(machine_id=vm_uuid, service_country=service_country)
 
-        price = get_pricing(machine_config.to_json())
-        return JSONResponse(
-            status_code=200, content=machine_config.to_json_running(price=price)
-        )
+        volumes = await resolve_volumes([machine_config], service_country)
+        price = get_model_pricing(machine_config, volumes)
+        with phase("serialization"):
+            return JSONResponse(
+                status_code=200,
+                content=machine_config.to_json_running(price=price, volumes=serialize_volumes(volumes)),
+            )
 
     except Exception as error:
         logging.error(error.__str__())
@@ -152,16 +223,23 @@ async def servers_description(req: Request):
 
         vm_list_response = {"vms": []}
         running_machines = list_running(client_uuid=client_uuid, service_country=service_country)
+        count(vms=len(running_machines))
 
         if len(running_machines) == 0:
             logging.error("No machine found")
             return Response(status_code=204)
 
-        for machine in running_machines:
-            price = get_pricing(machine.to_json())
-            vm_list_response["vms"].append(machine.to_json_running(price=price))
+        # Every volume is fetched and serialized once, even if several machines share it
+        volumes = await resolve_volumes(running_machines, service_country)
 
-        return JSONResponse(status_code=200, content=vm_list_response)
+        # Pricing calls made while serializing are accounted to the pricing phase
+        with phase("serialization"):
+            serialized = serialize_volumes(volumes)
+            for machine in running_machines:
+                price = get_model_pricing(machine, volumes)
+                vm_list_response["vms"].append(machine.to_json_running(price=price, volumes=serialized))
+
+            return JSONResponse(status_code=200, content=vm_list_response)
 
     except Exception as error:
         logging.error(error.__str__())
@@ -173,10 +251,31 @@ async def servers_description(req: Request):
         )
 
 
+@app.get("/api/v1.0/events")
+async def state_events(req: Request):
+    try:
+        client_uuid = req.query_params.get("client_uuid")
+        vm_uuid = req.query_params.get("vm_uuid")
+        return StreamingResponse(
+            state_changes.stream(client_uuid=client_uuid, vm_uuid=vm_uuid),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    except Exception as error:
+        logging.error(error.__str__())
+        return ElementoInternalServerError(
+            origin="MESON",
+            error=f"Internal Server Error - {error.__str__()}",
+            trace=traceback.format_exc(),
+            meson_source="state_events()"
+        )
+
+
 @app.post("/api/v1.0/register")
 async def server_creation(req: Request):
     try:
-        servers_to_create = await req.json()
+        body = await req.body()
         async_flag = "false"
         if req.headers.get("Async") is not None:
             async_flag = req.headers.get("Async")
@@ -184,116 +283,19 @@ async def server_creation(req: Request):
 
         # SETUP OF ELEMENTO MACHINE
         try:
-            req_data = (
-                get_from_dict(servers_to_create, "req")
-                if type(servers_to_create["req"]) is dict
-                else json.loads(get_from_dict(servers_to_create, "req"))
-            )
-            client_uuid = get_from_dict(servers_to_create, "client_uuid")
-            vm_name = get_from_dict(servers_to_create, "vm_name")
-
-            if req_data.get("pci") is not None:
-                pci_devices = get_from_dict(req_data, "pci", "devices")
-                elemento_pci_devices = []
-                for key in pci_devices:
-                    pci_vendor, pci_model = key.split(":")
-                    pci_quantity = get_from_dict(pci_devices, key)
-                    elemento_pci_devices.append(
-                        ElementoPciDev(
-                            vendor=pci_vendor,
-                            model=pci_model,
-                            quantity=pci_quantity,
-                        )
-                    )
-            else:
-                elemento_pci_devices = None
-
-            if servers_to_create.get("volumes") != [] and servers_to_create.get("volumes") is not None:
-                volumes_to_attach = get_from_dict(servers_to_create, "volumes")
-                elemento_volumes = []
-                for volume in volumes_to_attach:
-                    elemento_volumes.append(
-                        ElementoStorage(
-                            creator_id=client_uuid,
-                            csp_region=service_country,
-                            volume_uuid=volume.get("volume_uuid"),
-                            name=get_from_dict(volume, "name"),
-                            private=volume.get("private"),
-                            readonly=volume.get("readonly"),
-                            shareable=volume.get("shareable"),
-                            bootable=volume.get("bootable"),
-                            size=get_from_dict(volume, "size"),
-                        )
-                    )
-            elif servers_to_create.get("volume") is not None:
-                volumes_to_attach = get_from_dict(servers_to_create, "volumes")
-                elemento_volumes = []
-                for volume in volumes_to_attach:
-                    elemento_volumes.append(
-                        ElementoStorage(
-                            creator_id=client_uuid,
-                            csp_region=service_country,
-                            volume_uuid=volume.get("volume_uuid"),
-                            name=get_from_dict(volume, "name"),
-                            private=volume.get("private"),
-                            readonly=volume.get("readonly"),
-                            shareable=volume.get("shareable"),
-                            bootable=volume.get("bootable"),
-                            size=get_from_dict(volume, "size"),
-                        )
-                    )
-            else:
-                elemento_volumes = None
-
-            vm_data = ElementoMachine(
-                csp_region=service_country,
-                client_uuid=client_uuid,
-                vm_name=vm_name,
-                volumes=elemento_volumes,
-                cpu=ElementoCpu(
-                    slots=get_from_dict(req_data, "cpu", "slots"),
-                    fullPhysical=(
-                        get_from_dict(req_data, "cpu").get("fullPhysical")
-                        if get_from_dict(req_data, "cpu").get("fullPhysical")
-                        is not None
-                        else False  # default value
-                    ),
-                    maxOverprovision=(
-                        get_from_dict(req_data, "cpu").get("maxOverprovision")
-                        if get_from_dict(req_data, "cpu").get("maxOverprovision")
-                        is not None
-                        else 1  # default value
-                    ),
-                    min_frequency=get_from_dict(req_data, "cpu", "min_frequency"),
-                    arch=get_from_dict(req_data, "cpu", "arch"),
-                    flags=get_from_dict(req_data, "cpu", "flags"),
-                ),
-                mem=ElementoMemory(
-                    capacity=get_from_dict(req_data, "mem", "capacity"),
-                    requireECC=get_from_dict(req_data, "mem").get("reqECC"),
-                ),
-                pci=elemento_pci_devices,
-                misc=ElementoMisc(
-                    os_family=get_from_dict(req_data, "misc", "os_family"),
-                    os_flavour=get_from_dict(req_data, "misc", "os_flavour"),
-                ),
-                network_config=None,
-                auth=ElementoAuth(
-                    username=get_from_dict(servers_to_create, "authentication").get("username"),
-                    password=get_from_dict(servers_to_create, "authentication").get("password"),
-                    ssh_key=get_from_dict(servers_to_create, "authentication").get("ssh-key"),
-                ),
-            )
-        except Exception as error:
+            vm_data = parse_machine_request(body, service_country, register=True)
+        except RequestParsingError as error:
             return ElementoBadRequest(
                 origin="MESON",
                 error="Bad Request - bad payload",
-                field_errors=[],
+                field_errors=request_field_errors(error),
                 docs_url="",
                 trace=traceback.format_exc(),
                 meson_source="server_creation()"
             )
 
+        count(volumes=len(vm_data.volumes or []))
+
         # CREATE MACHINE
         try:
             vm_uuid = create_compute_machine(vm_data, service_country)
@@ -331,112 +333,17 @@ async def server_creation(req: Request):
 @app.get("/api/v1.0/canallocate")
 async def cancreate(req: Request):
     try:
-        servers_to_create = await req.json()
+        body = await req.body()
         service_country = req.headers["service-country"] if "service-country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
 
         # SETUP OF ELEMENTO MACHINE
         try:
-            req_data = (
-                get_from_dict(servers_to_create, "req")
-                if type(servers_to_create["req"]) is dict
-                else json.loads(get_from_dict(servers_to_create, "req"))
-            )
-            client_uuid = get_from_dict(servers_to_create, "client_uuid")
-
-            if req_data.get("pci") is not None:
-                pci_devices = get_from_dict(req_data, "pci", "devices")
-                elemento_pci_devices = []
-                for key in pci_devices:
-                    pci_vendor, pci_model = key.split(":")
-                    pci_quantity = get_from_dict(pci_devices, key)
-                    elemento_pci_devices.append(
-                        ElementoPciDev(
-                            vendor=pci_vendor,
-                            model=pci_model,
-                            quantity=pci_quantity,
-                        )
-                    )
-            else:
-                elemento_pci_devices = None
-
-            if servers_to_create.get("volumes") is not None:
-                volumes_to_attach = get_from_dict(servers_to_create, "volumes")
-                elemento_volumes = []
-                for volume in volumes_to_attach:
-                    elemento_volumes.append(
-                        ElementoStorage(
-                            csp_region=service_country,
-                            volume_uuid=volume.get("volume_uuid"),
-                            name=get_from_dict(volume, "name"),
-                            private=volume.get("private"),
-                            readonly=volume.get("readonly"),
-                            shareable=volume.get("shareable"),
-                            bootable=volume.get("bootable"),
-                            size=get_from_dict(volume, "size"),
-                        )
-                    )
-            if servers_to_create.get("volume") is not None:
-                volumes_to_attach = get_from_dict(servers_to_create, "volumes")
-                elemento_volumes = []
-                for volume in volumes_to_attach:
-                    elemento_volumes.append(
-                        ElementoStorage(
-                            creator_id=client_uuid,
-                            csp_region=service_country,
-                            volume_uuid=volume.get("volume_uuid"),
-                            name=get_from_dict(volume, "name"),
-                            private=volume.get("private"),
-                            readonly=volume.get("readonly"),
-                            shareable=volume.get("shareable"),
-                            bootable=volume.get("bootable"),
-                            size=get_from_dict(volume, "size"),
-                        )
-                    )
-            else:
-                elemento_volumes = None
-
-            vm_data = ElementoMachine(
-                csp_region=service_country,
-                volumes=elemento_volumes,
-                cpu=ElementoCpu(
-                    slots=get_from_dict(req_data, "cpu", "slots"),
-                    fullPhysical=(
-                        get_from_dict(req_data, "cpu").get("fullPhysical")
-                        if get_from_dict(req_data, "cpu").get("fullPhysical")
-                        is not None
-                        else False  # default value
-                    ),
-                    maxOverprovision=(
-                        get_from_dict(req_data, "cpu").get("maxOverprovision")
-                        if get_from_dict(req_data, "cpu").get("maxOverprovision")
-                        is not None
-                        else 1  # default value
-                    ),
-                    min_frequency=get_from_dict(req_data, "cpu", "min_frequency"),
-                    arch=get_from_dict(req_data, "cpu", "arch"),
-                    flags=get_from_dict(req_data, "cpu", "flags"),
-                ),
-                mem=ElementoMemory(
-                    capacity=get_from_dict(req_data, "mem", "capacity"),
-                    requireECC=get_from_dict(req_data, "mem").get("requireECC"),
-                ),
-                pci=elemento_pci_devices,
-                misc=ElementoMisc(
-                    os_family=get_from_dict(req_data, "misc").get("os_family"),
-                    os_flavour=get_from_dict(req_data, "misc").get("os_flavour"),
-                ),
-                network_config=None,
-                auth=ElementoAuth(
-                    username=get_from_dict(servers_to_create, "authentication").get("username"),
-                    password=get_from_dict(servers_to_create, "authentication").get("password"),
-                    ssh_key=get_from_dict(servers_to_create, "authentication").get("ssh-key"),
-                ),
-            )
-        except Exception as error:
+            vm_data = parse_machine_request(body, service_country, register=False)
+        except RequestParsingError as error:
             return ElementoBadRequest(
                 origin="MESON",
                 error="Bad Request - bad payload",
-                field_errors=[],
+                field_errors=request_field_errors(error),
                 docs_url="",
                 trace=traceback.format_exc(),
                 meson_source="cancreate()"
@@ -457,7 +364,7 @@ async def cancreate(req: Request):
             )
 
         # GET PRICING
-        price = get_pricing(vm_config.to_json())
+        price = get_model_pricing(vm_config)
         if price is None:
             return ElementoCreationFailed(
                 origin="MESON",
@@ -705,32 +612,100 @@ async def server_restart(req: Request):
         )
 
 
+def metrics_range(req: Request) -> tuple:
+    """Reads the optional start, end (unix timestamps) and step (seconds, positive) query params.
+
+    Raises:
+        ValueError: With the name of the wrong field.
+    """
+    values = []
+    for field, cast in [("start", float), ("end", float), ("step", int)]:
+        value = req.query_params.get(field)
+        try:
+            values.append(cast(value) if value is not None else None)
+        except ValueError:
+            raise ValueError(field)
+    if values[2] is not None and values[2] <= 0:
+        raise ValueError("step")
+    return tuple(values)
+
+
+def metrics_missing_client(meson_source: str):
+    return ElementoBadRequest(
+        origin="MESON",
+        error="Bad Request",
+        field_errors=[
+            BadRequestFieldError(
+                field="client_uuid",
+                where="QUERY",
+                error="MISSING",
+                type="str",
+                expected_value="550e8400-e29b-41d4-a716-446655440000",
+            )
+        ],
+        docs_url="",
+        trace=traceback.format_exc(),
+        meson_source=meson_source,
+    )
+
+
+def metrics_rate_limited(error: RateLimited, meson_source: str):
+    response = ElementoServiceUnavailable(
+        origin="MESON",
+        error=error.__str__(),
+        trace="",
+        meson_source=meson_source,
+        service_failed=["metrics"],
+    )
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+def metrics_bad_request(field: str, meson_source: str):
+    return ElementoBadRequest(
+        origin="MESON",
+        error="Bad Request",
+        field_errors=[
+            BadRequestFieldError(
+                field=field,
+                where="QUERY",
+                error="WRONG_VALUE",
+                type="int" if field == "step" else "float",
+                expected_value="1700000000" if field != "step" else "a positive number of seconds, e.g. 60",
+            )
+        ],
+        docs_url="",
+        trace=traceback.format_exc(),
+        meson_source=meson_source,
+    )
+
+
 @app.get("/api/v1.0/metrics")
 async def server_metrics(req: Request):
     try:
-        
-
         service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
+        client_uuid = req.query_params.get("client_uuid")
+        if client_uuid is None:
+            return metrics_missing_client("server_metrics()")
         try:
-            client_uuid = req.query_params.get("client_uuid")
-        except Exception:
-            return ElementoBadRequest(
-                origin="MESON",
-                error="Bad Request",
-                field_errors=[
-                    BadRequestFieldError(
-                        field="client_uuid",
-                        where="BODY",
-                        error="WRONG_VALUE",
-                        type="str",
-                        expected_value="550e8400-e29b-41d4-a716-446655440000",
-                    )
-                ],
-                docs_url="",
-                trace=traceback.format_exc(),
-                meson_source="server_metrics()",
-            )
-        servers_dict = get_servers_metrics(client_uuid, service_country)
+            start, end, step = metrics_range(req)
+        except ValueError as error:
+            return metrics_bad_request(error.__str__(), "server_metrics()")
+
+        vms = metrics_store.vms_of(client_uuid)
+        registry.record_cache("metrics_store", len(vms) > 0)
+        if len(vms) == 0:
+            # Cold start: the collector has not seen this client yet
+            try:
+                metrics_collector.collect_client(client_uuid, service_country)
+            except RateLimited as error:
+                return metrics_rate_limited(error, "server_metrics()")
+            vms = metrics_store.vms_of(client_uuid)
+
+        if start is None and end is None and step is None:
+            servers_dict = [metrics_store.latest(vm_uuid) for vm_uuid in vms]
+        else:
+            servers_dict = [metrics_store.query(vm_uuid, start, end, step) for vm_uuid in vms]
 
         return JSONResponse(
             status_code=200,
@@ -749,26 +724,27 @@ async def server_metrics(req: Request):
 async def server_metrics_single(req: Request, vm_uuid: str):
     try:
         service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
+        client_uuid = req.query_params.get("client_uuid")
+        if client_uuid is None:
+            return metrics_missing_client("server_metrics_single()")
         try:
-            client_uuid = req.query_params.get("client_uuid")
-        except Exception:
-            return ElementoBadRequest(
-                origin="MESON",
-                error="Bad Request",
-                field_errors=[
-                    BadRequestFieldError(
-                        field="client_uuid",
-                        where="BODY",
-                        error="WRONG_VALUE",
-                        type="str",
-                        expected_value="550e8400-e29b-41d4-a716-446655440000",
-                    )
-                ],
-                docs_url="",
-                trace=traceback.format_exc(),
-                meson_source="server_metrics_single()",
-            )
-        server_info = get_servers_metrics(client_uuid, vm_uuid, service_country)
+            start, end, step = metrics_range(req)
+        except ValueError as error:
+            return metrics_bad_request(error.__str__(), "server_metrics_single()")
+
+        if metrics_store.latest(vm_uuid) is None:
+            # Cold start: the collector has not seen this VM yet
+            try:
+                metrics_collector.collect_client(client_uuid, service_country)
+            except RateLimited as error:
+                return metrics_rate_limited(error, "server_metrics_single()")
+
+        if vm_uuid not in metrics_store.vms_of(client_uuid):
+            server_info = None
+        elif start is None and end is None and step is None:
+            server_info = [metrics_store.latest(vm_uuid)]
+        else:
+            server_info = [metrics_store.query(vm_uuid, start, end, step)]
 
         if server_info is None:
             return ElementoNotFound(
@@ -1,22 +1,25 @@
+import asyncio
 import json
 import traceback
 import logging
 import uuid
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from __init__ import __version__
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, PlainTextResponse
+from commons.admin import install_admin
+from commons.instrumentation import registry
+from commons.slowlog import phase
 from commons.billing import (
     add_billing_details,
     update_billing_details,
     get_pricing,
 )
-from commons.utils import (
-    get_from_dict,
-    dynamic_global_import_fun,
-    try_dynamic_import_fun
-)
+from commons.plugins import PluginRegistry
+from commons.utils import get_from_dict
 from errors.client_errors import (
     ElementoBadRequest,
     ElementoNotFound,
@@ -28,6 +31,9 @@ from errors.server_errors import (
     ElementoServiceUnavailable,
 )
 
+SERVICE_FANOUT_TIMEOUT = float(os.getenv("SERVICE_FANOUT_TIMEOUT", 10))  # seconds, per plugin
+SERVICE_FANOUT_WORKERS = int(os.getenv("SERVICE_FANOUT_WORKERS", 16))  # plugin calls in flight for /running
+
 root_path = ["platforms", "software"]
 prefix = "service"
 methods = [
@@ -37,24 +43,22 @@ methods = [
     "create",
     "delete",
 ]
-try:
-    services = {}
-    for path in root_path:
-        try:
-            service = dynamic_global_import_fun(
-                folder_path=path, prefix=prefix, methods=methods
-            )
-            services.update(service)
-        except Exception as error:
-            logging.error(f"Error importing services from {path}: {error.__str__()}")
-        
-        if len(services.keys()) == 0:
-            raise Exception("No services found in the specified paths.")
-except Exception as error:
-    logging.error(error.__str__())
+# Plugins are listed here and imported on first use, see commons/plugins.py
+services = PluginRegistry(roots=root_path, prefix=prefix, methods=methods)
+if len(services) == 0:
+    logging.error("No services found in the specified paths.")
     exit(1)
 
 app = FastAPI(docs_url=None)
+install_admin(app, "service")
+
+# A plugin call cannot be interrupted: after SERVICE_FANOUT_TIMEOUT it is abandoned but keeps its worker until it
+# returns. The pool bounds the threads a hung plugin can hold, and a plugin is not called again while one of its
+# abandoned calls is still running (meson_fanout_abandoned_total counts the abandoned calls).
+fanout_executor = ThreadPoolExecutor(max_workers=SERVICE_FANOUT_WORKERS, thread_name_prefix="meson-fanout")
+registry.track_executor("services_fanout", fanout_executor)
+hung_calls = {}  # service -> abandoned calls still running
+hung_calls_lock = threading.Lock()
 
 # This is an example implementation for the routing of services supported on this specific provider.
 
@@ -75,6 +79,115 @@ def health():
     )
 
 
+def service_unavailable(service: str, error: Exception, meson_source: str):
+    # An unknown service (LookupError, often a cached rejection) is expected and answered without a traceback
+    return ElementoServiceUnavailable(
+        origin="MESON",
+        error=f"Service unavailable - {error.__str__()}",
+        trace="" if isinstance(error, LookupError) else traceback.format_exc(),
+        meson_source=meson_source,
+        service_failed=[service],
+    )
+
+
+async def fetch_all_services(service: str, client_uuid: str, service_country: str) -> tuple:
+    """Calls get_all_services of a plugin on the fan-out pool, within SERVICE_FANOUT_TIMEOUT seconds.
+
+    Returns:
+        (response, None) on success, (None, {"service", "status", "error"}) otherwise.
+    """
+    if hung_calls.get(service, 0) > 0:
+        return None, {"service": service, "status": 504, "error": "A previous call is still running"}
+
+    def call():
+        return services.resolve(service)["get_all_services"](client_uuid, service_country=service_country)
+
+    def release(future):
+        with hung_calls_lock:
+            hung_calls[service] -= 1
+
+    future = fanout_executor.submit(call)
+    try:
+        response, status_code = await asyncio.wait_for(asyncio.wrap_future(future), timeout=SERVICE_FANOUT_TIMEOUT)
+    except TimeoutError:
+        if not future.cancel():
+            # Already running: it holds its worker until the plugin returns
+            registry.inc("meson_fanout_abandoned_total", {"service": service})
+            with hung_calls_lock:
+                hung_calls[service] = hung_calls.get(service, 0) + 1
+            future.add_done_callback(release)
+        return None, {"service": service, "status": 504, "error": f"No answer within {SERVICE_FANOUT_TIMEOUT}s"}
+    except LookupError as error:
+        # Rejected by the plugin registry (negative cache), the failure was logged when it happened
+        return None, {"service": service, "status": 503, "error": error.__str__()}
+    except Exception as error:
+        logging.error(f"fetch_all_services ({service}) - {error.__str__()}")
+        return None, {"service": service, "status": 500, "error": error.__str__()}
+    if status_code != 200:
+        return None, {"service": service, "status": status_code, "error": f"Internal Server Error: {response}"}
+    return response, None
+
+
+@app.get("/api/v1.0/running")
+async def services_description(request: Request):
+    try:
+        client_uuid = request.headers.get("client_uuid")
+        if client_uuid is None:
+            return ElementoBadRequest(
+                origin="MESON",
+                error="Bad Request in 1 field",
+                field_errors=[
+                    BadRequestFieldError(
+                        field="client_uuid",
+                        where="HEADER",
+                        error="MISSING",
+                        type="UUID",
+                        expected_value="",
+                    )
+                ],
+                docs_url="",
+                trace=traceback.format_exc(),
+                meson_source="services_description()",
+            )
+        service_country = (
+            request.headers["service_country"]
+            if "service_country" in request.headers.keys()
+            else os.getenv("PROVIDER_REGION")
+        )
+
+        # Every plugin is asked at the same time: the latency is the one of the slowest plugin
+        names = services.names()
+        results = await asyncio.gather(
+            *[fetch_all_services(name, client_uuid, service_country) for name in names]
+        )
+        response = {"services": {}, "failed": []}
+        for name, (result, failure) in zip(names, results):
+            if failure is None:
+                response["services"][name] = result
+            else:
+                response["failed"].append(failure)
+
+        if len(names) > 0 and len(response["failed"]) == len(names):
+            return ElementoServiceUnavailable(
+                origin="MESON",
+                error="Service unavailable",
+                trace=traceback.format_exc(),
+                meson_source="services_description()",
+                service_failed=names,
+            )
+        # Partial failures are reported in the body: 206 is reserved for Range requests
+        return JSONResponse(status_code=200, content=response)
+
+    except Exception as error:
+        logging.error(error.__str__())
+        return ElementoInternalServerError(
+            origin="MESON",
+            error="Internal Server Error",
+            trace=traceback.format_exc(),
+            meson_source="services_description()",
+        )
+
+
 @app.get("/api/v1.0/{service}/running")
 async def service_description(request: Request, service: str):
     try:
@@ -104,29 +217,13 @@ async def service_description(request: Request, service: str):
                 meson_source="service_description()",
             )
 
-        if services.get(service) is not None:
-            response, status_code = services[service]["get_all_services"](
-                client_uuid, service_country
-            )
-        else:
-            try:
-                services[service] = try_dynamic_import_fun(
-                    folder_path=root_path,
-                    prefix=prefix,
-                    service_name=service,
-                    methods=methods,
-                )
-                response, status_code = services[service]["get_all_services"](
-                    client_uuid, service_country
-                )
-            except Exception as error:
-                return ElementoServiceUnavailable(
-                    origin="MESON",
-                    error="Service unavailable",
-                    trace=traceback.format_exc(),
-                    meson_source="service_description()",
-                    service_failed=[service],
-                )
+        try:
+            plugin = services.resolve(service)
+        except Exception as error:
+            return service_unavailable(service, error, "service_description()")
+        response, status_code = plugin["get_all_services"](
+            client_uuid, service_country
+        )
 
         if status_code==200:
             return JSONResponse(status_code=200, content=response)
@@ -178,29 +275,14 @@ async def service_description_by_id(request: Request, service: str, service_uid:
             )
         
         try:
-            if services.get(service) is not None:
-                response, status_code = services[service]["get_service"](
-                    service_uid, client_uuid, service_country
-                )
-            else:
-                try:
-                    services[service] = try_dynamic_import_fun(
-                        folder_path=root_path,
-                        prefix=prefix,
-                        service_name=service,
-                        methods=methods,
-                    )
-                    response, status_code = services[service]["get_service"](
-                        service_uid, client_uuid, service_country
-                    )
-                except Exception as error:
-                    return ElementoServiceUnavailable(
-                        origin="MESON",
-                        error="Service unavailable",
-                        trace=traceback.format_exc(),
-                        meson_source="service_description()",
-                        service_failed=[service],
-                    )
+            plugin = services.resolve(service)
+        except Exception as error:
+            return service_unavailable(service, error, "service_description()")
+
+        try:
+            response, status_code = plugin["get_service"](
+                service_uid, client_uuid, service_country
+            )
         except Exception as error:
             return ElementoNotFound(
                 origin='MESON',
@@ -233,39 +315,28 @@ async def service_description_by_id(request: Request, service: str, service_uid:
 @app.post("/api/v1.0/{service}/create")
 async def create_service(request: Request, service: str):
     try:
-        service_to_create = await request.json()
-        service_country = (
-            request.headers["service_country"]
-            if "service_country" in request.headers.keys()
-            else os.getenv("PROVIDER_REGION")
-        )
-        async_flag = "false"
-        if request.headers.get("Async") is not None:
-            async_flag = request.headers.get("Async")
-        req_data = (
-            get_from_dict(service_to_create, "req")
-            if type(service_to_create) == dict
-            else json.loads(get_from_dict(service_to_create, "req"))
-        )
-        client_uuid = get_from_dict(service_to_create, "client_uuid")
+        with phase("parsing"):
+            service_to_create = await request.json()
+            service_country = (
+                request.headers["service_country"]
+                if "service_country" in request.headers.keys()
+                else os.getenv("PROVIDER_REGION")
+            )
+            async_flag = "false"
+            if request.headers.get("Async") is not None:
+                async_flag = request.headers.get("Async")
+            req_data = (
+                get_from_dict(service_to_create, "req")
+                if type(service_to_create) == dict
+                else json.loads(get_from_dict(service_to_create, "req"))
+            )
+            client_uuid = get_from_dict(service_to_create, "client_uuid")
 
         ##* Verify presence of service
-        if services.get(service) is None:
-            try:
-                services[service] = try_dynamic_import_fun(
-                    folder_path=root_path,
-                    prefix=prefix,
-                    service_name=service,
-                    methods=methods,
-                )
-            except Exception as error:
-                return ElementoServiceUnavailable(
-                    origin="MESON",
-                    error="Service unavailable",
-                    trace=traceback.format_exc(),
-                    meson_source="create_service()",
-                    service_failed=[service],
-                )
+        try:
+            plugin = services.resolve(service)
+        except Exception as error:
+            return service_unavailable(service, error, "create_service()")
 
         ##* START BILLING
         try:
@@ -299,7 +370,7 @@ async def create_service(request: Request, service: str):
 
         ##* SETUP CONFIG
         try:
-            service_config = services[service]["setup_config"](
+            service_config = plugin["setup_config"](
                 req_data, client_uuid, billing_uuid, service_country
             )
         except Exception as error:
@@ -312,7 +383,7 @@ async def create_service(request: Request, service: str):
 
         ##* SERVICE CREATION
         try:
-            service_created, status_code = services[service]["create"](
+            service_created, status_code = plugin["create"](
                 service_config, service_country
             )
         except Exception as error:
@@ -327,7 +398,8 @@ async def create_service(request: Request, service: str):
             )
 
         if status_code==200:
-            return JSONResponse(status_code=status_code, content=service_created.to_json())
+            with phase("serialization"):
+                return JSONResponse(status_code=status_code, content=service_created.to_json())
         else:
             return ElementoInternalServerError(
                 origin="PROVIDER",
@@ -359,22 +431,10 @@ async def delete_service(request: Request, service: str):
         service_uid = get_from_dict(service_to_delete, "id")
 
         ##* Verify presence of service
-        if services.get(service) is None:
-            try:
-                services[service] = try_dynamic_import_fun(
-                    folder_path=root_path,
-                    prefix=prefix,
-                    service_name=service,
-                    methods=methods,
-                )
-            except Exception as error:
-                return ElementoServiceUnavailable(
-                    origin="MESON",
-                    error="Service unavailable",
-                    trace=traceback.format_exc(),
-                    meson_source="delete_service()",
-                    service_failed=[service],
-                )
+        try:
+            plugin = services.resolve(service)
+        except Exception as error:
+            return service_unavailable(service, error, "delete_service()")
 
         if service_uid is None:
             return ElementoBadRequest(
@@ -397,11 +457,11 @@ async def delete_service(request: Request, service: str):
         ##* DELETE
         try:
             billing_uuid, status_code = (
-                services[service]["get_service"](
+                plugin["get_service"](
                     service_uid, client_uuid, service_country, True
                 )
                 if service_to_delete.get("metadata") is None
-                else services[service]["get_service"](
+                else plugin["get_service"](
                     service_to_delete.get("metadata"),
                     service_uid,
                     client_uuid,
@@ -419,7 +479,7 @@ async def delete_service(request: Request, service: str):
             )
 
         try:
-            response, status_code = services[service]["delete"](
+            response, status_code = plugin["delete"](
                 service_uid, client_uuid, service_country
             )
         except Exception as error:
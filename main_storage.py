@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import traceback
 import uuid
@@ -6,12 +7,18 @@ import os
 from __init__ import __version__
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, PlainTextResponse
-from commons.billing import add_billing_details, update_billing_details, get_pricing
+from commons.admin import install_admin
+from commons.billing import (
+    add_billing_details,
+    update_billing_details,
+    update_billing_details_bulk,
+    get_model_pricing,
+)
 from commons.utils import check_storage_params, check_storage_tolerance, get_from_dict
+from commons.volumes import inventory
+from commons.jobs import jobs
 from models.StorageModel import ElementoStorage
 from infrastructure.storage.storage_manager import (
-    information_about_storages_by_id,
-    information_about_storages_by_client_id,
     is_storage_available,
     create_storage,
     destroy_storage,
@@ -29,7 +36,87 @@ from errors.server_errors import (
     ElementoServiceUnavailable
 )
 
+VOLUME_BATCH_MAX = int(os.getenv("VOLUME_BATCH_MAX", 100))
+STORAGE_BULK_MAX = int(os.getenv("STORAGE_BULK_MAX", 100))
+STORAGE_BULK_CONCURRENCY = int(os.getenv("STORAGE_BULK_CONCURRENCY", 4))  # provider calls in flight per bulk
+
 app = FastAPI()
+install_admin(app, "storage")
+
+
+def storage_field_errors(payload, prefix: str = "") -> list[BadRequestFieldError]:
+    """Validates a create payload without building it, one entry per wrong field."""
+    if type(payload) != dict:
+        return [
+            BadRequestFieldError(
+                field=prefix.rstrip(".") or "body", where="BODY", error="WRONG_VALUE", type="dict", expected_value=""
+            )
+        ]
+    field_errors = []
+    for field, type_name in [("creatorID", "UUID"), ("name", "str"), ("size", "int")]:
+        if payload.get(field) is None:
+            field_errors.append(
+                BadRequestFieldError(
+                    field=prefix + field, where="BODY", error="MISSING", type=type_name, expected_value=""
+                )
+            )
+    try:
+        if payload.get("size") is not None and int(payload["size"]) <= 0:
+            raise ValueError(payload["size"])
+    except (TypeError, ValueError):
+        field_errors.append(
+            BadRequestFieldError(
+                field=prefix + "size", where="BODY", error="WRONG_VALUE", type="int", expected_value="a positive size"
+            )
+        )
+    return field_errors
+
+
+def build_storage(payload: dict, service_country: str) -> ElementoStorage:
+    return ElementoStorage(
+        csp_region=service_country,
+        creator_id=get_from_dict(payload, "creatorID"),
+        name=get_from_dict(payload, "name"),
+        size=get_from_dict(payload, "size"),
+        private=payload.get("private"),
+        readonly=payload.get("readonly"),
+        shareable=payload.get("shareable"),
+        bootable=payload.get("bootable"),
+    )
+
+
+def volume_not_found(volume_uuid: str, meson_source: str):
+    return ElementoNotFound(
+        origin="MESON",
+        error=f"Volume {volume_uuid} not found",
+        trace="",
+        meson_source=meson_source,
+    )
+
+
+def provision_storage(storage_data: ElementoStorage, service_country: str) -> ElementoStorage:
+    """Creates a volume on the provider, checks it and publishes it in the volume inventory."""
+    storage = create_storage(storage_data, service_country)
+    if not check_storage_params(storage):
+        raise Exception(
+            "Some mandatory Storage params are missing (volume_uuid, billing_uuid, creator_id, name, size)"
+        )
+    inventory.put(storage, service_country, created=True)
+    return storage
+
+
+async def run_bounded(fun, items: list, limit: int = STORAGE_BULK_CONCURRENCY) -> list:
+    """Runs the blocking fun(item) for every item in threads, at most limit at a time.
+
+    Returns the results in the order of items, a failed call returns its exception.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await asyncio.to_thread(fun, item)
+
+    return await asyncio.gather(*[run(item) for item in items], return_exceptions=True)
 
 
 @app.get("/")
@@ -73,7 +160,9 @@ async def storages_description(req: Request):
                 meson_source="storage_accessible()"
             )
 
-        response = information_about_storages_by_id(volume_uuid, service_country)
+        response = inventory.get(volume_uuid, service_country)
+        if response is None:
+            return volume_not_found(volume_uuid, "storage_accessible()")
         return JSONResponse(response.to_json_response(), status_code=200)
 
     except Exception as error:
@@ -85,11 +174,66 @@ async def storages_description(req: Request):
             meson_source="storage_destruction()"
         )
 
+@app.post("/api/v1.0/info/batch")
+async def storages_description_batch(req: Request):
+    try:
+        info = await req.json()
+        service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
+        volume_uuids = info.get("volume_uuids") if type(info) == dict else None
+        if (
+            type(volume_uuids) != list
+            or len(volume_uuids) > VOLUME_BATCH_MAX
+            or not all(type(volume_uuid) == str for volume_uuid in volume_uuids)
+        ):
+            return ElementoBadRequest(
+                origin="MESON",
+                error="Bad request - bad payload",
+                field_errors=[
+                    BadRequestFieldError(
+                        field="volume_uuids",
+                        where="BODY",
+                        error="MISSING" if volume_uuids is None else "WRONG_VALUE",
+                        type="list[UUID]",
+                        expected_value=f"up to {VOLUME_BATCH_MAX} volume UUIDs"
+                    )
+                ],
+                docs_url="",
+                trace=traceback.format_exc(),
+                meson_source="storages_description_batch()"
+            )
+
+        results = await inventory.get_many(volume_uuids, service_country)
+        response = []
+        for volume_uuid, (storage, error) in zip(volume_uuids, results):
+            if error is None:
+                response.append({"volume_uuid": volume_uuid, "status": 200, "volume": storage.to_json_response()})
+            else:
+                response.append(
+                    {
+                        "volume_uuid": volume_uuid,
+                        "status": 404 if isinstance(error, LookupError) else 500,
+                        "error": error.__str__(),
+                    }
+                )
+        return JSONResponse({"volumes": response}, status_code=200)
+
+    except Exception as error:
+        logging.error(error.__str__())
+        return ElementoInternalServerError(
+            origin="MESON",
+            error=f"Internal Server Error - {error.__str__()}",
+            trace=traceback.format_exc(),
+            meson_source="storages_description_batch()"
+        )
+
+
 @app.get("/api/v1.0/info/{volume_uuid}")
 async def server_description_by_id(req: Request, volume_uuid: str):
     try:
         service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
-        response = information_about_storages_by_id(volume_uuid=volume_uuid, service_country=service_country)
+        response = inventory.get(volume_uuid, service_country)
+        if response is None:
+            return volume_not_found(volume_uuid, "server_description_by_id()")
 
         return JSONResponse(
             status_code=200, content=response.to_json_response()
@@ -130,7 +274,7 @@ async def storage_accessible(req: Request):
                 meson_source="storage_accessible()"
             )
 
-        client_volumes = information_about_storages_by_client_id(client_uuid, service_country)
+        client_volumes = inventory.by_creator(client_uuid, service_country)
         response = []
         for volume in client_volumes:
             response.append(volume.to_json_response())
@@ -146,6 +290,42 @@ async def storage_accessible(req: Request):
         )
 
 
+@app.get("/api/v1.0/usage")
+async def storage_usage(req: Request):
+    try:
+        service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
+        client_uuid = req.query_params.get("client_uuid")
+        if client_uuid is None:
+            return ElementoBadRequest(
+                origin="MESON",
+                error="Bad request - bad payload",
+                field_errors=[
+                    BadRequestFieldError(
+                        field="client_uuid",
+                        where="QUERY",
+                        error="MISSING",
+                        type="UUID",
+                        expected_value=""
+                    )
+                ],
+                docs_url="",
+                trace=traceback.format_exc(),
+                meson_source="storage_usage()"
+            )
+
+        usage = inventory.usage_of(client_uuid, service_country)
+        return JSONResponse(content=usage, status_code=200)
+
+    except Exception as error:
+        logging.error(error.__str__())
+        return ElementoInternalServerError(
+            origin="MESON",
+            error=f"Internal Server Error - {error.__str__()}",
+            trace=traceback.format_exc(),
+            meson_source="storage_usage()"
+        )
+
+
 @app.post("/api/v1.0/create")
 async def storage_creation(req: Request):
     try:
@@ -155,16 +335,7 @@ async def storage_creation(req: Request):
             async_flag = req.headers.get("Async")
         service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
         try:
-            storage_data = ElementoStorage(
-                csp_region=service_country,
-                creator_id=get_from_dict(storages_to_create, "creatorID"),
-                name=get_from_dict(storages_to_create, "name"),
-                size=get_from_dict(storages_to_create, "size"),
-                private=storages_to_create.get("private"),
-                readonly=storages_to_create.get("readonly"),
-                shareable=storages_to_create.get("shareable"),
-                bootable=storages_to_create.get("bootable"),
-            )
+            storage_data = build_storage(storages_to_create, service_country)
         except Exception as error:
             return ElementoBadRequest(
                 origin="MESON",
@@ -175,12 +346,21 @@ async def storage_creation(req: Request):
                 meson_source="storage_creation()"
             )
 
+        if async_flag.lower() == "true":
+            # The volume is created by a job, the caller polls its status URL
+            job = jobs.submit(
+                "storage_creation",
+                lambda: provision_storage(storage_data, service_country).to_json_response(),
+            )
+            status_url = f"/api/v1.0/jobs/{job.job_id}"
+            return JSONResponse(
+                content={"job_id": job.job_id, "status": job.status, "status_url": status_url},
+                status_code=202,
+                headers={"Location": status_url},
+            )
+
         try:
-            storage = create_storage(storage_data, service_country)
-            if not check_storage_params(storage):
-                raise Exception(
-                    "Some mandatory Storage params are missing (volume_uuid, billing_uuid, creator_id, name, size)"
-                )
+            storage = provision_storage(storage_data, service_country)
             return JSONResponse(content=storage.to_json_response(), status_code=200)
         except Exception as error:
             # update_billing_details(billing_uuid, "ended")
@@ -203,6 +383,87 @@ async def storage_creation(req: Request):
         )
 
 
+@app.post("/api/v1.0/create/bulk")
+async def storage_creation_bulk(req: Request):
+    try:
+        storages_to_create = await req.json()
+        service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
+        volumes = storages_to_create.get("volumes") if type(storages_to_create) == dict else None
+
+        # Everything is validated before creating anything
+        if type(volumes) != list or len(volumes) == 0 or len(volumes) > STORAGE_BULK_MAX:
+            field_errors = [
+                BadRequestFieldError(
+                    field="volumes",
+                    where="BODY",
+                    error="MISSING" if volumes is None else "WRONG_VALUE",
+                    type="list",
+                    expected_value=f"from 1 to {STORAGE_BULK_MAX} volumes"
+                )
+            ]
+        else:
+            field_errors = [
+                field_error
+                for index, volume in enumerate(volumes)
+                for field_error in storage_field_errors(volume, prefix=f"volumes.{index}.")
+            ]
+        if len(field_errors) > 0:
+            return ElementoBadRequest(
+                origin="MESON",
+                error="Bad request - bad payload",
+                field_errors=field_errors,
+                docs_url="",
+                trace=traceback.format_exc(),
+                meson_source="storage_creation_bulk()"
+            )
+        storages_data = [build_storage(volume, service_country) for volume in volumes]
+
+        results = await run_bounded(
+            lambda storage_data: provision_storage(storage_data, service_country), storages_data
+        )
+        response = []
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                logging.error(f"storage_creation_bulk ({index}) - {result.__str__()}")
+                response.append({"index": index, "status": 500, "error": f"Error during storage creation - {result.__str__()}"})
+            else:
+                response.append({"index": index, "status": 200, "volume": result.to_json_response()})
+
+        return JSONResponse(content={"volumes": response}, status_code=200)
+
+    except Exception as error:
+        logging.error(error.__str__())
+        return ElementoInternalServerError(
+            origin="MESON",
+            error=f"Internal Server Error - {error.__str__()}",
+            trace=traceback.format_exc(),
+            meson_source="storage_creation_bulk()"
+        )
+
+
+@app.get("/api/v1.0/jobs/{job_id}")
+async def job_status(req: Request, job_id: str):
+    try:
+        job = jobs.get(job_id)
+        if job is None:
+            return ElementoNotFound(
+                origin="MESON",
+                error=f"Job {job_id} not found",
+                trace=traceback.format_exc(),
+                meson_source="job_status()"
+            )
+        return JSONResponse(content=job.to_json(), status_code=200)
+
+    except Exception as error:
+        logging.error(error.__str__())
+        return ElementoInternalServerError(
+            origin="MESON",
+            error=f"Internal Server Error - {error.__str__()}",
+            trace=traceback.format_exc(),
+            meson_source="job_status()"
+        )
+
+
 @app.get("/api/v1.0/cancreate")
 async def storage_cancreate(req: Request):
     try:
@@ -239,7 +500,7 @@ async def storage_cancreate(req: Request):
                 meson_source="storage_cancreate()",
             )
 
-        price = get_pricing(storage_config.to_json())
+        price = get_model_pricing(storage_config)
         if price is None:
             return ElementoCreationFailed(
                 origin="MESON",
@@ -290,7 +551,8 @@ async def storage_destruction(req: Request):
             )
 
         try:
-            storage_config = information_about_storages_by_id(volume_uuid, service_country)
+            if inventory.get(volume_uuid, service_country) is None:
+                raise LookupError(f"Volume {volume_uuid} not found")
         except Exception as error:
             return ElementoNotFound(
                 origin="MESON",
@@ -301,6 +563,7 @@ async def storage_destruction(req: Request):
 
         try:
             response = destroy_storage(volume_uuid, service_country)
+            inventory.remove(volume_uuid, service_country)
         except Exception as error:
             return ElementoInternalServerError(
                 origin="MESON",
@@ -333,3 +596,101 @@ async def storage_destruction(req: Request):
             trace=traceback.format_exc(),
             meson_source="storage_destruction()"
         )
+
+
+@app.delete("/api/v1.0/destroy/bulk")
+async def storage_destruction_bulk(req: Request):
+    try:
+        to_destroy = await req.json()
+        service_country = req.headers["service_country"] if "service_country" in req.headers.keys() else os.getenv("PROVIDER_REGION")
+        volume_uuids = to_destroy.get("volume_uuids") if type(to_destroy) == dict else None
+        if (
+            type(volume_uuids) != list
+            or len(volume_uuids) == 0
+            or len(volume_uuids) > STORAGE_BULK_MAX
+            or not all(type(volume_uuid) == str for volume_uuid in volume_uuids)
+        ):
+            return ElementoBadRequest(
+                origin="MESON",
+                error="Bad Request",
+                field_errors=[
+                    BadRequestFieldError(
+                        field="volume_uuids",
+                        where="BODY",
+                        error="MISSING" if volume_uuids is None else "WRONG_VALUE",
+                        type="list[UUID]",
+                        expected_value=f"from 1 to {STORAGE_BULK_MAX} volume UUIDs"
+                    )
+                ],
+                docs_url="",
+                trace=traceback.format_exc(),
+                meson_source="storage_destruction_bulk()"
+            )
+        volume_uuids = list(dict.fromkeys(volume_uuids))
+
+        # Lookups first (cached or concurrent), only the volumes found are destroyed
+        lookups = await inventory.get_many(volume_uuids, service_country)
+        response = {}
+        found = {}
+        for volume_uuid, (storage, error) in zip(volume_uuids, lookups):
+            if error is None:
+                found[volume_uuid] = storage
+            else:
+                response[volume_uuid] = {
+                    "uniqueID": volume_uuid,
+                    "status": 404 if isinstance(error, LookupError) else 500,
+                    "error": f"Error during storage retrieve information - {error.__str__()}",
+                }
+
+        def destroy(volume_uuid: str) -> str:
+            result = destroy_storage(volume_uuid, service_country)
+            inventory.remove(volume_uuid, service_country)
+            return result
+
+        results = await run_bounded(destroy, list(found))
+        for volume_uuid, result in zip(found, results):
+            if isinstance(result, Exception):
+                logging.error(f"storage_destruction_bulk ({volume_uuid}) - {result.__str__()}")
+                response[volume_uuid] = {
+                    "uniqueID": volume_uuid,
+                    "status": 500,
+                    "error": f"Error during storage destruction - {result.__str__()}",
+                }
+            else:
+                response[volume_uuid] = {"uniqueID": volume_uuid, "status": 200, "unregistered": result}
+
+        # The billing of every destroyed volume is stopped with a single portal authentication
+        billing_uuids = {
+            found[volume_uuid].billing_uuid: volume_uuid
+            for volume_uuid in found
+            if response[volume_uuid]["status"] == 200 and found[volume_uuid].billing_uuid is not None
+        }
+        if len(billing_uuids) > 0:
+            try:
+                billing = await asyncio.to_thread(
+                    update_billing_details_bulk, list(billing_uuids), "STOP", os.getenv("ELEMENTO_RESELLER_ID")
+                )
+            except Exception as error:
+                return ElementoBillingFailed(
+                    origin="MESON",
+                    error="Error during billing suspension",
+                    trace=traceback.format_exc(),
+                    stopped_successfully=True,
+                    meson_source="storage_destruction_bulk()"
+                )
+            for billing_uuid, result in billing.items():
+                if isinstance(result, Exception):
+                    response[billing_uuids[billing_uuid]]["billing_error"] = result.__str__()
+
+        return JSONResponse(
+            content={"volumes": [response[volume_uuid] for volume_uuid in volume_uuids]}, status_code=200
+        )
+
+    except Exception as error:
+        logging.error(error.__str__())
+        return ElementoInternalServerError(
+            origin="MESON",
+            error=f"Internal Server Error - {error.__str__()}",
+            trace=traceback.format_exc(),
+            meson_source="storage_destruction_bulk()"
+        )
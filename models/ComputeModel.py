@@ -1,7 +1,8 @@
 import os
+from models.FingerprintModel import FingerprintMixin, fingerprint_of, fingerprints_of
 from models.StorageModel import ElementoStorage
 
-class ElementoCpu:
+class ElementoCpu(FingerprintMixin):
     """
     Describes the cpu configuration of the machine.
 
@@ -14,6 +15,10 @@ class ElementoCpu:
         flags (list[str]): The instruction sets that the cpu will use.
     """
 
+    _fingerprint_fields = frozenset(
+        {"slots", "fullPhysical", "maxOverprovision", "min_frequency", "arch", "flags"}
+    )
+
     def __init__(
         self,
         slots: int = 1,
@@ -30,6 +35,16 @@ class ElementoCpu:
         self.arch = arch
         self.flags = flags
 
+    def fingerprint_key(self) -> tuple:
+        return (
+            self.slots,
+            self.fullPhysical,
+            self.maxOverprovision,
+            self.min_frequency,
+            tuple(sorted(self.arch or [])),
+            tuple(sorted(self.flags or [])),
+        )
+
     def to_json(self):
         return {
             "slots": self.slots,
@@ -41,7 +56,7 @@ class ElementoCpu:
         }
 
 
-class ElementoMemory:
+class ElementoMemory(FingerprintMixin):
     """
     Describes the memory configuration of the machine.
 
@@ -50,6 +65,8 @@ class ElementoMemory:
         requireECC (bool): If the memory requires the error correcting code.
     """
 
+    _fingerprint_fields = frozenset({"capacity", "requireECC"})
+
     def __init__(
         self,
         capacity: int = 1024,
@@ -58,11 +75,14 @@ class ElementoMemory:
         self.capacity = int(capacity)
         self.requireECC = requireECC
 
+    def fingerprint_key(self) -> tuple:
+        return (self.capacity, self.requireECC)
+
     def to_json(self):
         return {"capacity": self.capacity, "requireECC": self.requireECC}
 
 
-class ElementoPciDev:
+class ElementoPciDev(FingerprintMixin):
     """
     Describes the PCI devices configuration of the machine.
 
@@ -74,6 +94,8 @@ class ElementoPciDev:
         quantity (int): The quantity of the PCI device.
     """
 
+    _fingerprint_fields = frozenset({"vendor", "model", "quantity"})
+
     def __init__(
         self,
         vendor: str = None,
@@ -84,11 +106,14 @@ class ElementoPciDev:
         self.model = model
         self.quantity = int(quantity)
 
+    def fingerprint_key(self) -> tuple:
+        return (self.vendor, self.model, self.quantity)
+
     def to_json(self):
         return {f"{self.vendor}:{self.model}": self.quantity}
 
 
-class ElementoMisc:
+class ElementoMisc(FingerprintMixin):
     """
     Describes the OS configuration of the machine.
 
@@ -100,6 +125,8 @@ class ElementoMisc:
         os_flavour (str): The OS flavour of the machine.
     """
 
+    _fingerprint_fields = frozenset({"os_family", "os_flavour"})
+
     def __init__(
         self,
         os_family: str = None,
@@ -108,6 +135,9 @@ class ElementoMisc:
         self.os_family = os_family
         self.os_flavour = os_flavour
 
+    def fingerprint_key(self) -> tuple:
+        return (self.os_family, self.os_flavour)
+
     def to_json(self):
         return {"os_family": self.os_family, "os_flavour": self.os_flavour}
 
@@ -168,7 +198,7 @@ class ElementoAuth:
         }
 
 
-class ElementoMachine:
+class ElementoMachine(FingerprintMixin):
     """
     Describes a machine configuration to be created.
 
@@ -182,6 +212,8 @@ class ElementoMachine:
         vm_name (str): The name of the machine that will be displayed in the response.
         volumes (list[ElementoStorage]): The volume models that will be attached to the machine.
         if the id is given, the volume already exists otherwise it has to be created from the given configuration.
+        volume_uuids (list[str]): The ids of the attached volumes, used instead of volumes by the listings so that
+        the volume data is held once in the shared volume registry and resolved at serialization time.
         billing_uuid (str): The billing id that will be used to charge the client.
         vm_uuid (str): The unique identifier of the machine.
         cpu (ElementoCpu): The cpu configuration of the machine.
@@ -197,6 +229,8 @@ class ElementoMachine:
         All the information won't be displayed in the Elemento's response.
     """
 
+    _fingerprint_fields = frozenset({"volumes", "volume_uuids", "cpu", "mem", "pci", "misc"})
+
     def __init__(
         self,
         csp_region: str = None,
@@ -214,6 +248,7 @@ class ElementoMachine:
         auth: ElementoAuth = None,
         creation_date: str = None,
         notes: dict = dict(),
+        volume_uuids: list[str] = None,
     ):
         self.csp_region = csp_region
         self.client_uuid = client_uuid
@@ -230,11 +265,50 @@ class ElementoMachine:
         self.auth = auth
         self.creation_date = creation_date
         self.notes = notes
+        self.volume_uuids = volume_uuids
 
-    def to_json(self):
+    def fingerprint_key(self) -> tuple:
+        """
+        The configuration relevant fields of the machine: cpu, mem, PCI devices, OS and volumes.
+        PCI devices and volumes are compared regardless of their order, volumes referenced only by
+        volume_uuids are compared by id.
+        """
+        return (
+            fingerprint_of(self.cpu),
+            fingerprint_of(self.mem),
+            fingerprints_of(self.pci),
+            fingerprint_of(self.misc),
+            (
+                fingerprints_of(self.volumes)
+                if self.volumes is not None
+                else tuple(sorted(self.volume_uuids or ()))
+            ),
+        )
+
+    def volumes_json(self, volumes: dict = None) -> list[dict]:
+        """
+        The attached volumes as dicts: the volume models if set, otherwise the volume_uuids looked up in volumes.
+
+        Args:
+            volumes (dict): The volumes already serialized with to_json, by volume_uuid, shared by all the machines
+            of a listing. A volume_uuid missing from it is returned as {"vid": volume_uuid}.
+        Returns:
+            A list of volume dicts, empty if the machine has no volume.
+        """
+        if self.volumes is not None:
+            return [volume.to_json() for volume in self.volumes]
+        if self.volume_uuids is not None:
+            volumes = volumes or {}
+            return [volumes.get(volume_uuid, {"vid": volume_uuid}) for volume_uuid in self.volume_uuids]
+        return list()
+
+
+    def to_json(self, volumes: dict = None):
         """
         create a dict from an ElementoMachine object with all fields
 
+        Args:
+            volumes (dict): The serialized volumes by volume_uuid, see volumes_json.
         Returns:
             A json version of the ElementoMachine.
         """
@@ -245,11 +319,7 @@ class ElementoMachine:
             "csp_region": self.csp_region,
             "client_uuid": self.client_uuid,
             "vm_name": self.vm_name,
-            "volumes": (
-                [volume.to_json() for volume in self.volumes]
-                if self.volumes is not None
-                else list()
-            ),
+            "volumes": self.volumes_json(volumes),
             "billing_uuid": self.billing_uuid,
             "vm_uuid": self.vm_uuid,
             "cpu": self.cpu.to_json() if self.cpu is not None else None,
@@ -273,10 +343,12 @@ class ElementoMachine:
             "notes": self.notes,
         }
 
-    def to_json_register(self):
+    def to_json_register(self, volumes: dict = None):
         """
         create a dict from an ElementoMachine object for the register response
 
+        Args:
+            volumes (dict): The serialized volumes by volume_uuid, see volumes_json.
         Returns:
             A dict for the register response.
         """
@@ -293,11 +365,7 @@ class ElementoMachine:
                 "flags": self.cpu.flags,
                 "ramsize": self.mem.capacity,
                 "reqECC": self.mem.requireECC,
-                "volumes": (
-                    [volume.to_json() for volume in self.volumes]
-                    if self.volumes is not None
-                    else list()
-                ),
+                "volumes": self.volumes_json(volumes),
                 "pcidevs": {
                     "devices": pci_dict if self.pci is not None else dict()
                 },
@@ -348,9 +416,12 @@ class ElementoMachine:
             },
         }
 
-    def to_json_running(self, price: dict) -> dict:
+    def to_json_running(self, price: dict, volumes: dict = None) -> dict:
         """A toJson method for the running API response.
 
+        Args:
+            price (dict): The price of the machine.
+            volumes (dict): The serialized volumes by volume_uuid, see volumes_json.
         Returns:
             The dict for the running api response
         """
@@ -367,11 +438,7 @@ class ElementoMachine:
                 "flags": self.cpu.flags,
                 "ramsize": self.mem.capacity,
                 "reqECC": self.mem.requireECC,
-                "volumes": (
-                    [volume.to_json() for volume in self.volumes]
-                    if self.volumes is not None
-                    else list()
-                ),
+                "volumes": self.volumes_json(volumes),
                 "pcidevs": {
                     "devices": pci_dict if self.pci is not None else dict()
                 },
@@ -0,0 +1,75 @@
+import abc
+import hashlib
+import weakref
+
+
+class FingerprintMixin(abc.ABC):
+    """
+    Gives a model a stable, order-independent structural fingerprint of its configuration.
+
+    The fingerprint is a 128 bit blake2b digest (32 hex chars) of fingerprint_key(), it is computed once
+    and cached until one of the _fingerprint_fields is reassigned. Nested models invalidate the models
+    containing them (through a weak reference to each parent), so changing machine.cpu.slots also
+    invalidates the machine fingerprint.
+    In-place mutations of list fields (e.g. machine.volumes.append, cpu.flags.append) are not tracked:
+    reassign the list or call invalidate_fingerprint() afterwards.
+
+    Two models have the same configuration if and only if their fingerprints are equal, identifiers
+    (uuids, names, dates) are never part of it.
+    """
+
+    _fingerprint_fields = frozenset()
+
+    @abc.abstractmethod
+    def fingerprint_key(self) -> tuple:
+        """The configuration relevant fields of the model."""
+
+    def fingerprint(self) -> str:
+        fingerprint = self.__dict__.get("_fingerprint")
+        if fingerprint is None:
+            fingerprint = hashlib.blake2b(repr(self.fingerprint_key()).encode(), digest_size=16).hexdigest()
+            self.__dict__["_fingerprint"] = fingerprint
+        return fingerprint
+
+    def invalidate_fingerprint(self):
+        # A parent can only be cached if this model is, so the propagation stops at the first uncached model
+        if self.__dict__.pop("_fingerprint", None) is not None:
+            for reference in self.__dict__.get("_fingerprint_parents", ()):
+                parent = reference()
+                if parent is not None:
+                    parent.invalidate_fingerprint()
+
+    def __setattr__(self, name, value):
+        if name in self._fingerprint_fields:
+            self.invalidate_fingerprint()
+            self._link(value)
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_fingerprint", None)
+        state.pop("_fingerprint_parents", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self._fingerprint_fields:
+            self._link(state.get(name))
+
+    def _link(self, value):
+        for child in value if isinstance(value, list) else (value,):
+            if isinstance(child, FingerprintMixin):
+                # A tuple of weak references rather than a WeakSet: a model has one parent in practice
+                parents = child.__dict__.get("_fingerprint_parents", ())
+                parents = tuple(reference for reference in parents if reference() is not None)
+                if not any(reference() is self for reference in parents):
+                    child.__dict__["_fingerprint_parents"] = parents + (weakref.ref(self),)
+
+
+def fingerprint_of(model: FingerprintMixin):
+    return model.fingerprint() if model is not None else None
+
+
+def fingerprints_of(models: list) -> tuple:
+    """Order-independent fingerprint key of a list of models."""
+    return tuple(sorted(model.fingerprint() for model in models)) if models is not None else ()
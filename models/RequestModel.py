@@ -0,0 +1,269 @@
+from typing import Annotated, Optional, Union
+from typing_extensions import NotRequired, TypedDict
+from pydantic import Discriminator, Json, Tag, TypeAdapter, ValidationError
+from models.ComputeModel import (
+    ElementoMachine,
+    ElementoCpu,
+    ElementoMemory,
+    ElementoPciDev,
+    ElementoMisc,
+    ElementoAuth,
+)
+from models.StorageModel import ElementoStorage
+from commons.slowlog import phase
+
+# The request schemas are TypedDicts validated by compiled pydantic-core TypeAdapters: the raw body is
+# decoded and validated in a single pass, without instantiating intermediate pydantic models. A JSON encoded
+# req is decoded and validated by pydantic-core too (Json), not by json.loads in a Python validator.
+
+# Tags of the two forms of req, they are dropped from the error locations right after req
+_REQ_TAGS = ("object", "encoded")
+
+
+def _field_path(loc: tuple) -> str:
+    if len(loc) > 1 and loc[0] == "req" and loc[1] in _REQ_TAGS:
+        loc = loc[:1] + loc[2:]
+    return ".".join(str(part) for part in loc) or "body"
+
+
+class RequestParsingError(Exception):
+    """
+    Raised when a request payload does not match the expected schema.
+
+    Attributes:
+        field_errors (list[dict]): One entry per wrong field, with the dotted field path (field),
+        the error kind (MISSING or WRONG_VALUE), the pydantic error type (type) and a human readable
+        description of the expected value (expected_value).
+    """
+
+    def __init__(self, field_errors: list[dict]):
+        self.field_errors = field_errors
+        super().__init__(
+            ", ".join(f"{error['field']}: {error['expected_value']}" for error in field_errors)
+        )
+
+    @classmethod
+    def from_validation_error(cls, error: ValidationError):
+        return cls(
+            [
+                {
+                    "field": _field_path(err["loc"]),
+                    "error": "MISSING" if err["type"] == "missing" else "WRONG_VALUE",
+                    "type": err["type"],
+                    "expected_value": err["msg"],
+                }
+                for err in error.errors(include_url=False, include_input=False)
+            ]
+        )
+
+
+def _req_form(value) -> str:
+    return "encoded" if isinstance(value, (str, bytes)) else "object"
+
+
+class CpuRequest(TypedDict):
+    slots: int
+    fullPhysical: NotRequired[Optional[bool]]
+    maxOverprovision: NotRequired[Optional[int]]
+    min_frequency: float
+    arch: list[str]
+    flags: list[str]
+
+
+class MemoryRequest(TypedDict):
+    capacity: int
+    requireECC: NotRequired[Optional[bool]]
+    reqECC: NotRequired[Optional[bool]]
+
+
+class PciRequest(TypedDict):
+    devices: dict[str, int]
+
+
+class MiscRequest(TypedDict):
+    os_family: NotRequired[Optional[str]]
+    os_flavour: NotRequired[Optional[str]]
+
+
+class RegisterMiscRequest(TypedDict):
+    os_family: str
+    os_flavour: str
+
+
+class MachineSpecRequest(TypedDict):
+    cpu: CpuRequest
+    mem: MemoryRequest
+    misc: MiscRequest
+    pci: NotRequired[Optional[PciRequest]]
+
+
+class RegisterSpecRequest(TypedDict):
+    cpu: CpuRequest
+    mem: MemoryRequest
+    misc: RegisterMiscRequest
+    pci: NotRequired[Optional[PciRequest]]
+
+
+class VolumeRequest(TypedDict):
+    volume_uuid: NotRequired[Optional[str]]
+    name: str
+    size: int
+    private: NotRequired[Optional[bool]]
+    readonly: NotRequired[Optional[bool]]
+    shareable: NotRequired[Optional[bool]]
+    bootable: NotRequired[Optional[bool]]
+
+
+AuthRequest = TypedDict(
+    "AuthRequest",
+    {
+        "username": NotRequired[Optional[str]],
+        "password": NotRequired[Optional[str]],
+        "ssh-key": NotRequired[Optional[str]],
+    },
+)
+
+
+def _object_or_encoded(schema):
+    """req can be given as an object or as a JSON encoded string of the same schema."""
+    return Annotated[
+        Union[Annotated[schema, Tag("object")], Annotated[Json[schema], Tag("encoded")]],
+        Discriminator(_req_form),
+    ]
+
+
+class CanAllocateRequest(TypedDict):
+    """Payload of the canallocate API, req can also be a JSON encoded string."""
+
+    req: _object_or_encoded(MachineSpecRequest)
+    client_uuid: str
+    volumes: NotRequired[Optional[list[VolumeRequest]]]
+    volume: NotRequired[Optional[list[VolumeRequest]]]
+    authentication: AuthRequest
+
+
+class RegisterRequest(TypedDict):
+    """Payload of the register API, it extends the canallocate one with the VM name and a mandatory OS."""
+
+    req: _object_or_encoded(RegisterSpecRequest)
+    client_uuid: str
+    vm_name: str
+    volumes: NotRequired[Optional[list[VolumeRequest]]]
+    volume: NotRequired[Optional[list[VolumeRequest]]]
+    authentication: AuthRequest
+
+
+def _split_pci_devices(devices: dict) -> list[tuple]:
+    split = []
+    for key, quantity in devices.items():
+        parts = key.split(":")
+        if len(parts) != 2:
+            raise ValueError(f"PCI device '{key}' must be in the 'vendor:model' format")
+        split.append((parts, quantity))
+    return split
+
+
+register_request_adapter = TypeAdapter(RegisterRequest)
+canallocate_request_adapter = TypeAdapter(CanAllocateRequest)
+
+
+def build_volumes(volumes: list, client_uuid: str, service_country: str) -> list[ElementoStorage]:
+    return [
+        ElementoStorage(
+            creator_id=client_uuid,
+            csp_region=service_country,
+            volume_uuid=volume.get("volume_uuid"),
+            name=volume["name"],
+            private=volume.get("private"),
+            readonly=volume.get("readonly"),
+            shareable=volume.get("shareable"),
+            bootable=volume.get("bootable"),
+            size=volume["size"],
+        )
+        for volume in volumes
+    ]
+
+
+def build_machine(request: dict, service_country: str) -> ElementoMachine:
+    """Builds an ElementoMachine from an already validated register/canallocate payload."""
+    req_data = request["req"]
+    cpu = req_data["cpu"]
+    mem = req_data["mem"]
+    misc = req_data["misc"]
+    pci = req_data.get("pci")
+    auth = request["authentication"]
+    client_uuid = request["client_uuid"]
+    # Both "volumes" and "volume" are accepted, an empty list means no volume
+    volumes = request.get("volumes") or request.get("volume")
+    full_physical = cpu.get("fullPhysical")
+    max_overprovision = cpu.get("maxOverprovision")
+    require_ecc = mem.get("requireECC")
+
+    return ElementoMachine(
+        csp_region=service_country,
+        client_uuid=client_uuid,
+        vm_name=request.get("vm_name"),
+        volumes=build_volumes(volumes, client_uuid, service_country) if volumes else None,
+        cpu=ElementoCpu(
+            slots=cpu["slots"],
+            fullPhysical=full_physical if full_physical is not None else False,
+            maxOverprovision=max_overprovision if max_overprovision is not None else 1,
+            min_frequency=cpu["min_frequency"],
+            arch=cpu["arch"],
+            flags=cpu["flags"],
+        ),
+        mem=ElementoMemory(
+            capacity=mem["capacity"],
+            requireECC=require_ecc if require_ecc is not None else mem.get("reqECC"),
+        ),
+        pci=(
+            [
+                ElementoPciDev(vendor=vendor, model=model, quantity=quantity)
+                for (vendor, model), quantity in _split_pci_devices(pci["devices"])
+            ]
+            if pci is not None
+            else None
+        ),
+        misc=ElementoMisc(os_family=misc.get("os_family"), os_flavour=misc.get("os_flavour")),
+        network_config=None,
+        auth=ElementoAuth(
+            username=auth.get("username"),
+            password=auth.get("password"),
+            ssh_key=auth.get("ssh-key"),
+        ),
+    )
+
+
+def parse_machine_request(body: bytes, service_country: str, register: bool = True) -> ElementoMachine:
+    """Decodes and validates a register (or canallocate) payload in a single pass.
+
+    Args:
+        body (bytes): The raw request body.
+        service_country (str): The region to use for the machine and its volumes.
+        register (bool): True for register payloads, False for canallocate ones.
+    Returns:
+        The ElementoMachine described by the payload.
+    Raises:
+        RequestParsingError: Raised when the payload is not valid, with one entry per wrong field.
+    """
+    adapter = register_request_adapter if register else canallocate_request_adapter
+    try:
+        with phase("parsing"):
+            request = adapter.validate_json(body)
+    except ValidationError as error:
+        raise RequestParsingError.from_validation_error(error)
+
+    try:
+        with phase("model"):
+            return build_machine(request, service_country)
+    except ValueError as error:
+        raise RequestParsingError(
+            [
+                {
+                    "field": "req.pci.devices",
+                    "error": "WRONG_VALUE",
+                    "type": "value_error",
+                    "expected_value": error.__str__(),
+                }
+            ]
+        )
@@ -1,6 +1,8 @@
 import os
+from models.FingerprintModel import FingerprintMixin
 
-class ElementoStorage:
+
+class ElementoStorage(FingerprintMixin):
     """
     Describes the storage configuration of the machine.
 
@@ -25,6 +27,8 @@ class ElementoStorage:
         All the information won't be displayed in the Elemento's response.
     """
 
+    _fingerprint_fields = frozenset({"size", "private", "readonly", "shareable", "bootable"})
+
     def __init__(
         self,
         csp_region: str = os.getenv("PROVIDER_REGION"),
@@ -53,6 +57,12 @@ class ElementoStorage:
         self.creation_date = creation_date
         self.notes = notes
 
+    def fingerprint_key(self) -> tuple:
+        """
+        The configuration relevant fields of the volume: size and flags, identifiers are excluded.
+        """
+        return (self.size, self.private, self.readonly, self.shareable, self.bootable)
+
     def to_json(self):
         """
         A to json method to format an ElementoStorage into a general dictionary with all fields
@@ -0,0 +1,33 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from commons import admin
+
+ROUTES = ["/metrics", "/traces", "/slow", "/loop"]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    app = FastAPI()
+    app.include_router(admin.router)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("headers", [{}, {"admin_token": "wrong"}])
+def test_internal_routes_hidden_without_the_admin_token(client, route, headers):
+    response = client.get(f"/api/v1.0/internal{route}", headers=headers)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_internal_routes_answer_the_admin(client, route):
+    response = client.get(f"/api/v1.0/internal{route}", headers={"admin_token": "secret"})
+    assert response.status_code == 200
+
+
+def test_internal_routes_hidden_when_no_token_is_configured(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", None)
+    response = client.get("/api/v1.0/internal/metrics", headers={"admin_token": "secret"})
+    assert response.status_code == 404
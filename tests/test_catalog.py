@@ -0,0 +1,93 @@
+import random
+from commons.catalog import ComputeIndex, StorageIndex, propose_machine
+from models.ComputeModel import ElementoMachine, ElementoCpu, ElementoMemory
+from models.StorageModel import ElementoStorage
+
+
+def machine(slots, capacity, frequency=2.0, ecc=False, notes=None):
+    return ElementoMachine(
+        cpu=ElementoCpu(slots=slots, min_frequency=frequency, arch=["X86_64"], flags=[]),
+        mem=ElementoMemory(capacity=capacity, requireECC=ecc),
+        notes=notes,
+    )
+
+
+def test_nearest_tier_is_preferred():
+    index = ComputeIndex([machine(2, 4096), machine(4, 8192), machine(8, 16384)])
+    assert index.find(machine(4, 6144)).cpu.slots == 4
+
+
+def test_falls_back_to_bigger_tiers_for_ecc_and_frequency():
+    flavors = [
+        machine(4, 8192, 2.0),
+        machine(4, 16384, 2.5),
+        machine(8, 8192, 3.0),
+        machine(8, 16384, 3.0, ecc=True),
+    ]
+    index = ComputeIndex(flavors)
+    assert index.find(machine(4, 8192, 2.2)) is flavors[1]
+    assert index.find(machine(4, 8192, 2.6)) is flavors[2]
+    assert index.find(machine(4, 8192, 2.0, ecc=True)) is flavors[3]
+    assert index.find(machine(4, 8192, 3.5)) is None
+    assert index.find(machine(16, 8192, 1.0, ecc=True)) is flavors[3]
+
+
+def legacy_find(flavors, config):
+    """The exhaustive search the index replaces: same tier order, every flavor of every cell visited."""
+    slots = sorted({flavor.cpu.slots for flavor in flavors})
+    start = min(range(len(slots)), key=lambda i: (abs(slots[i] - config.cpu.slots), -slots[i]))
+    for tier in slots[start:]:
+        capacities = sorted({flavor.mem.capacity for flavor in flavors if flavor.cpu.slots == tier})
+        if tier == slots[start]:
+            nearest = min(
+                range(len(capacities)), key=lambda i: (abs(capacities[i] - config.mem.capacity), -capacities[i])
+            )
+            capacities = capacities[nearest:]
+        else:
+            capacities = [capacity for capacity in capacities if capacity >= config.mem.capacity]
+        for capacity in capacities:
+            cell = sorted(
+                (flavor for flavor in flavors if flavor.cpu.slots == tier and flavor.mem.capacity == capacity),
+                key=lambda flavor: flavor.cpu.min_frequency,
+            )
+            for flavor in cell:
+                if flavor.cpu.min_frequency >= config.cpu.min_frequency and (
+                    not config.mem.requireECC or flavor.mem.requireECC
+                ):
+                    return flavor
+    return None
+
+
+def test_index_matches_the_exhaustive_search():
+    generator = random.Random(26)
+    flavors = [
+        machine(
+            generator.choice([1, 2, 4, 8, 16]),
+            generator.choice([1024, 2048, 4096, 8192, 16384]),
+            generator.choice([1.8, 2.2, 2.6, 3.0, 3.4]),
+            generator.random() < 0.2,
+        )
+        for _ in range(200)
+    ]
+    index = ComputeIndex(flavors)
+    for _ in range(500):
+        config = machine(
+            generator.choice([1, 3, 4, 12, 32]),
+            generator.choice([512, 3000, 4096, 12000, 32768]),
+            generator.choice([1.0, 2.4, 3.2, 3.6]),
+            generator.random() < 0.5,
+        )
+        assert index.find(config) is legacy_find(flavors, config)
+
+
+def test_propose_machine_accepts_flavors_without_notes():
+    proposed = propose_machine(machine(2, 4096), machine(2, 4096, notes=None))
+    assert proposed.notes == {}
+
+
+def test_storage_index_respects_tolerance():
+    offers = [ElementoStorage(size=size) for size in (10, 20, 50)]
+    index = StorageIndex(offers)
+    assert index.find(ElementoStorage(size=21), 0.1) is offers[1]
+    assert index.find(ElementoStorage(size=30), 0.1) is None
+    assert index.find(ElementoStorage(size=20, bootable=True), 0.1) is None
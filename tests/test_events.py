@@ -0,0 +1,125 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from commons import events
+from commons.events import StateChangeBroadcaster, _Subscriber
+
+
+def machine(vm_uuid, client_uuid):
+    return SimpleNamespace(vm_uuid=vm_uuid, client_uuid=client_uuid)
+
+
+class Fleet:
+    """The running machines, as returned by get_status, changed by the test between two polls."""
+
+    def __init__(self, *machines):
+        self.machines = list(machines)
+        self.polls = 0
+
+    def snapshot(self):
+        self.polls += 1
+        return list(self.machines)
+
+
+def frame(text: str) -> dict:
+    lines = dict(line.split(": ", 1) for line in text.strip().splitlines())
+    assert lines["event"] == "state"
+    return json.loads(lines["data"])
+
+
+def test_diff_reports_only_the_transitions():
+    broadcaster = StateChangeBroadcaster(snapshot=None)
+    first = broadcaster.diff([machine("vm1", "alice"), machine("vm2", "bob")])
+    assert [(event["vm_uuid"], event["state"], event["previous"]) for event in first] == [
+        ("vm1", "running", None), ("vm2", "running", None)
+    ]
+    assert broadcaster.diff([machine("vm1", "alice"), machine("vm2", "bob")]) == []
+
+    second = broadcaster.diff([machine("vm2", "bob")])
+    assert [(event["vm_uuid"], event["client_uuid"], event["state"], event["previous"]) for event in second] == [
+        ("vm1", "alice", "stopped", "running")
+    ]
+    assert broadcaster.diff([machine("vm2", "bob")]) == []
+    assert [event["state"] for event in broadcaster.diff([machine("vm1", "alice"), machine("vm2", "bob")])] == [
+        "running"
+    ]
+
+
+def test_stream_sends_the_current_states_then_the_matching_transitions():
+    fleet = Fleet(machine("vm1", "alice"), machine("vm2", "bob"))
+    broadcaster = StateChangeBroadcaster(fleet.snapshot, interval=0.01)
+
+    async def scenario():
+        alice = broadcaster.stream(client_uuid="alice")
+        initial = frame(await alice.__anext__())
+        fleet.machines = [machine("vm2", "bob"), machine("vm3", "alice"), machine("vm4", "bob")]
+        changes = [frame(await alice.__anext__()) for _ in range(2)]
+        await alice.aclose()
+        return initial, changes
+
+    initial, changes = asyncio.run(scenario())
+    assert (initial["vm_uuid"], initial["state"]) == ("vm1", "running")
+    assert sorted((change["vm_uuid"], change["state"]) for change in changes) == [
+        ("vm1", "stopped"), ("vm3", "running")
+    ]
+    assert all(change["client_uuid"] == "alice" for change in changes)
+
+
+def test_stream_of_a_single_vm():
+    fleet = Fleet(machine("vm1", "alice"), machine("vm2", "alice"))
+    broadcaster = StateChangeBroadcaster(fleet.snapshot, interval=0.01)
+
+    async def scenario():
+        stream = broadcaster.stream(client_uuid="alice", vm_uuid="vm2")
+        initial = frame(await stream.__anext__())
+        fleet.machines = []
+        change = frame(await stream.__anext__())
+        await stream.aclose()
+        return initial, change
+
+    initial, change = asyncio.run(scenario())
+    assert (initial["vm_uuid"], initial["state"]) == ("vm2", "running")
+    assert (change["vm_uuid"], change["state"]) == ("vm2", "stopped")
+
+
+def test_polling_stops_with_the_last_subscriber():
+    fleet = Fleet(machine("vm1", "alice"))
+    broadcaster = StateChangeBroadcaster(fleet.snapshot, interval=0.01)
+
+    async def scenario():
+        stream = broadcaster.stream()
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.wait_for(broadcaster._task, 1)
+        polls = fleet.polls
+        await asyncio.sleep(0.05)
+        return polls
+
+    polls = asyncio.run(scenario())
+    assert fleet.polls == polls
+    assert broadcaster._subscribers == set() and broadcaster._everything == set()
+
+
+def test_keepalive_when_nothing_changes(monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_KEEPALIVE_INTERVAL", 0.02)
+    broadcaster = StateChangeBroadcaster(Fleet().snapshot, interval=0.01)
+
+    async def scenario():
+        stream = broadcaster.stream(client_uuid="alice")
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(scenario()) == ": keepalive\n\n"
+
+
+def test_slow_subscribers_lose_the_oldest_transitions(monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_QUEUE_SIZE", 2)
+
+    async def scenario():
+        subscriber = _Subscriber()
+        for index in range(4):
+            subscriber.push({"index": index})
+        return [subscriber.queue.get_nowait()["index"] for _ in range(subscriber.queue.qsize())]
+
+    assert asyncio.run(scenario()) == [2, 3]
@@ -0,0 +1,73 @@
+import copy
+import pickle
+from models.ComputeModel import ElementoMachine, ElementoCpu, ElementoMemory, ElementoPciDev
+from models.StorageModel import ElementoStorage
+
+
+def machine(**overrides):
+    fields = {
+        "vm_uuid": "vm1",
+        "vm_name": "web",
+        "cpu": ElementoCpu(slots=4, arch=["X86_64"], flags=[]),
+        "mem": ElementoMemory(capacity=8192),
+        "pci": [ElementoPciDev(vendor="nvidia", model="a100", quantity=1)],
+    }
+    fields.update(overrides)
+    return ElementoMachine(**fields)
+
+
+def test_identifiers_and_order_are_not_part_of_the_fingerprint():
+    first = machine(pci=[ElementoPciDev("nvidia", "a100", 1), ElementoPciDev("amd", "mi300", 2)])
+    second = machine(
+        vm_uuid="vm2", vm_name="db", pci=[ElementoPciDev("amd", "mi300", 2), ElementoPciDev("nvidia", "a100", 1)]
+    )
+    assert first.fingerprint() == second.fingerprint()
+    assert len(first.fingerprint()) == 32
+    volumes = [ElementoStorage(volume_uuid=volume_uuid, size=10) for volume_uuid in ("a", "b")]
+    assert volumes[0].fingerprint() == volumes[1].fingerprint()
+
+
+def test_reassigning_a_field_invalidates_the_cache():
+    storage = ElementoStorage(size=10)
+    before = storage.fingerprint()
+    storage.name = "renamed"
+    assert storage.__dict__["_fingerprint"] == before
+    storage.size = 20
+    assert "_fingerprint" not in storage.__dict__
+    assert storage.fingerprint() != before
+
+
+def test_nested_changes_invalidate_the_parents():
+    vm = machine()
+    before = vm.fingerprint()
+    vm.cpu.slots = 8
+    assert vm.fingerprint() != before
+
+    # A model replaced in its parent is linked to it too
+    vm.mem = ElementoMemory(capacity=8192)
+    before = vm.fingerprint()
+    vm.mem.capacity = 16384
+    assert vm.fingerprint() != before
+    before = vm.fingerprint()
+    vm.pci[0].quantity = 2
+    assert vm.fingerprint() != before
+
+
+def test_shared_child_invalidates_every_parent():
+    cpu = ElementoCpu(slots=4, arch=["X86_64"], flags=[])
+    first, second = machine(cpu=cpu), machine(cpu=cpu)
+    before = (first.fingerprint(), second.fingerprint())
+    cpu.slots = 2
+    assert (first.fingerprint(), second.fingerprint()) != before
+    assert first.fingerprint() == second.fingerprint()
+
+
+def test_copies_are_relinked_without_the_cache():
+    vm = machine()
+    vm.fingerprint()
+    for clone in (pickle.loads(pickle.dumps(vm)), copy.deepcopy(vm)):
+        assert "_fingerprint" not in clone.__dict__
+        before = clone.fingerprint()
+        clone.cpu.slots = 16
+        assert clone.fingerprint() != before
+    assert vm.cpu.slots == 4
@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from commons import instrumentation
+from commons.instrumentation import MetricsRegistry, _merge
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, "METRICS_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def worker_snapshot(pid, requests, gauge=1, latency=0.02):
+    registry = MetricsRegistry("compute")
+    registry.inc("meson_requests_total", {"route": "/a"}, requests)
+    registry.add("meson_in_flight", {"route": "/a"}, gauge)
+    registry.observe("meson_latency_seconds", latency, {"route": "/a"}, buckets=(0.01, 0.1))
+    return {**registry.snapshot(), "pid": pid}
+
+
+def series(text: str) -> dict:
+    return {
+        line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in text.splitlines()
+        if line and not line.startswith("#")
+    }
+
+
+def test_histogram_buckets_and_overflow():
+    registry = MetricsRegistry("compute")
+    for value in (0.005, 0.05, 5):
+        registry.observe("latency", value, buckets=(0.01, 0.1))
+    rendered = series(registry.render())
+    assert rendered['latency_bucket{app="compute",le="0.01"}'] == 1
+    assert rendered['latency_bucket{app="compute",le="0.1"}'] == 2
+    assert rendered['latency_bucket{app="compute",le="+Inf"}'] == 3
+    assert rendered['latency_count{app="compute"}'] == 3
+    assert rendered['latency_sum{app="compute"}'] == pytest.approx(5.055)
+
+
+def test_merge_sums_counters_and_histograms_and_keeps_live_gauges(dead_pid):
+    counters, gauges, histograms = _merge(
+        [worker_snapshot(os.getpid(), 2), worker_snapshot(dead_pid, 3, gauge=5, latency=0.5)]
+    )
+    key = ("meson_requests_total", (("route", "/a"),))
+    assert counters[key] == 5
+    assert gauges[("meson_in_flight", (("route", "/a"),))] == 1
+    histogram = histograms[("meson_latency_seconds", (("route", "/a"),))]
+    assert histogram["counts"] == [0, 1, 1]
+    assert histogram["sum"] == pytest.approx(0.52)
+
+
+def test_cache_hit_ratio():
+    registry = MetricsRegistry("storage")
+    for hit in (True, True, True, False):
+        registry.record_cache("volume_inventory", hit)
+    assert series(registry.render())['meson_cache_hit_ratio{app="storage",cache="volume_inventory"}'] == 0.75
+
+
+def test_render_folds_the_dead_workers_without_losing_their_counters(metrics_dir, dead_pid):
+    registry = MetricsRegistry("compute")
+    registry.inc("meson_requests_total", {"route": "/a"}, 1)
+    (metrics_dir / f"compute-{dead_pid}.json").write_text(json.dumps(worker_snapshot(dead_pid, 3, gauge=5)))
+    (metrics_dir / "compute-exited.json").write_text(json.dumps({**worker_snapshot(None, 10), "gauges": []}))
+    (metrics_dir / "storage-1.json").write_text(json.dumps(worker_snapshot(1, 100)))
+
+    for _ in range(2):
+        rendered = series(registry.render())
+        assert rendered['meson_requests_total{app="compute",route="/a"}'] == 14
+        assert rendered['meson_latency_seconds_count{app="compute",route="/a"}'] == 2
+        assert 'meson_in_flight{app="compute",route="/a"}' not in rendered
+
+    assert {path.name for path in metrics_dir.glob("*.json")} == {
+        "compute-exited.json", f"compute-{os.getpid()}.json", "storage-1.json"
+    }
+
+
+def test_stop_folds_the_worker_into_the_exited_file(metrics_dir):
+    registry = MetricsRegistry("service")
+    registry.inc("meson_requests_total", {"route": "/a"}, 4)
+    registry.flush()
+    registry.stop()
+    registry.inc("meson_requests_total", {"route": "/a"}, 1)
+    registry.flush()
+
+    assert [path.name for path in metrics_dir.glob("*.json")] == ["service-exited.json"]
+    exited = json.loads((metrics_dir / "service-exited.json").read_text())
+    assert exited["counters"] == [["meson_requests_total", [["route", "/a"]], 4]]
@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+import pytest
+from commons import metrics_store
+from commons.metrics_store import MetricsCollector, MetricsStore, RateBudget, RateLimited
+
+HOUR = 3600.0 * 1000  # an hour boundary, so that the buckets below start at round timestamps
+
+
+def test_raw_ring_keeps_the_last_points(monkeypatch):
+    monkeypatch.setattr(metrics_store, "METRICS_RAW_POINTS", 3)
+    store = MetricsStore()
+    for index in range(5):
+        store.add("alice", "vm1", {"cpu": index}, HOUR + index)
+    points = store.query("vm1", start=0, end=HOUR + 10)["points"]
+    assert [point["cpu"] for point in points] == [2, 3, 4]
+    assert store.latest("vm1") == {"cpu": 4}
+
+
+def test_minute_and_hour_averages():
+    store = MetricsStore()
+    for second in range(0, 180, 30):
+        store.add("alice", "vm1", {"cpu": second, "status": f"s{second}"}, HOUR + second)
+
+    minutes = store.query("vm1", start=0, end=HOUR + 600, step=60)
+    assert minutes["resolution"] == "1m"
+    assert [(point["timestamp"] - HOUR, point["cpu"], point["status"]) for point in minutes["points"]] == [
+        (0, 15, "s30"), (60, 75, "s90"), (120, 135, "s150")
+    ]
+
+    # Closed minutes feed the hour, the open minute is not averaged in yet
+    hours = store.query("vm1", start=0, end=HOUR + 600, step=3600)
+    assert hours["resolution"] == "1h"
+    assert [(point["timestamp"], point["cpu"]) for point in hours["points"]] == [(HOUR, 45)]
+
+
+def test_query_aggregates_by_a_step_between_resolutions():
+    store = MetricsStore()
+    for second in range(0, 300, 30):
+        store.add("alice", "vm1", {"cpu": 1 if second < 120 else 3}, HOUR + second)
+    points = store.query("vm1", start=0, end=HOUR + 600, step=120)["points"]
+    assert [(point["timestamp"] - HOUR, point["cpu"]) for point in points] == [(0, 1.0), (120, 3.0), (240, 3.0)]
+
+
+def test_query_window_and_unknown_vm():
+    store = MetricsStore()
+    for index in range(5):
+        store.add("alice", "vm1", {"cpu": index}, HOUR + index)
+    assert [point["cpu"] for point in store.query("vm1", start=HOUR + 1, end=HOUR + 3)["points"]] == [1, 2, 3]
+    assert store.query("unknown") is None
+
+
+def test_evict_drops_the_idle_vms():
+    store = MetricsStore()
+    store.add("alice", "vm1", {"cpu": 1}, HOUR)
+    store.add("alice", "vm2", {"cpu": 1}, HOUR + 100)
+    assert store.vms_of("alice") == ["vm1", "vm2"]
+    store.evict(HOUR + 50)
+    assert store.vms_of("alice") == ["vm2"]
+    assert store.latest("vm1") is None
+
+
+@pytest.mark.parametrize("step, resolution", [(None, "raw"), (59, "raw"), (60, "1m"), (7200, "1h")])
+def test_resolution_is_the_coarsest_not_bigger_than_step(step, resolution):
+    store = MetricsStore()
+    store.add("alice", "vm1", {"cpu": 1}, HOUR)
+    assert store.query("vm1", start=0, end=HOUR + 1, step=step)["resolution"] == resolution
+
+
+class Provider:
+    """Machines and metrics of a fake provider, recording the calls it answers."""
+
+    def __init__(self, machines, batch=True):
+        self.machines = machines
+        self.batch = batch
+        self.calls = []
+
+    def list_machines(self):
+        return [
+            SimpleNamespace(vm_uuid=vm_uuid, client_uuid=client, csp_region=region)
+            for vm_uuid, client, region in self.machines
+        ]
+
+    def fetch_metrics(self, client_uuid, service_country):
+        self.calls.append(("client", client_uuid, service_country))
+        return [
+            {"itemID": vm_uuid, "cpu": 1}
+            for vm_uuid, client, region in self.machines
+            if client == client_uuid and (region or "eu") == service_country
+        ]
+
+    def fetch_all_metrics(self, service_country):
+        self.calls.append(("region", service_country))
+        if not self.batch:
+            return None
+        return [{"itemID": vm_uuid, "cpu": 2} for vm_uuid, _, region in self.machines + [("foreign", "eve", None)]]
+
+
+def collector(provider, regions=("eu", "us"), batch=True):
+    return MetricsCollector(
+        MetricsStore(),
+        provider.list_machines,
+        provider.fetch_metrics,
+        list(regions),
+        fetch_all_metrics=provider.fetch_all_metrics if batch else None,
+        interval=0,
+    )
+
+
+MACHINES = [("vm1", "alice", "eu"), ("vm2", "bob", "us"), ("vm3", "alice", None), ("vm4", "carol", "us")]
+
+
+def test_one_batch_call_per_region_keeps_only_the_known_vms():
+    provider = Provider(MACHINES)
+    metrics = collector(provider)
+    metrics.collect()
+    assert provider.calls == [("region", "eu"), ("region", "us")]
+    assert metrics.store.vms_of("alice") == ["vm1", "vm3"]
+    assert metrics.store.vms_of("bob") == ["vm2"]
+    assert metrics.store.latest("foreign") is None
+
+
+def test_clients_are_collected_only_in_the_regions_of_their_machines():
+    provider = Provider(MACHINES, batch=False)
+    metrics = collector(provider)
+    metrics.collect()
+    metrics.collect()
+    # The batch API is given up after its first None
+    assert provider.calls.count(("region", "eu")) == 1
+    client_calls = [call for call in provider.calls if call[0] == "client"]
+    assert sorted(client_calls) == sorted(
+        [("client", "alice", "eu"), ("client", "bob", "us"), ("client", "carol", "us")] * 2
+    )
+    assert metrics.store.vms_of("alice") == ["vm1", "vm3"]
+
+
+def test_budget_defers_the_clients_to_the_next_round():
+    provider = Provider([(f"vm{index}", f"client{index}", "eu") for index in range(5)])
+    metrics = collector(provider, regions=("eu",), batch=False)
+    metrics.budgets["eu"] = RateBudget(rate=0, burst=2)
+    metrics.collect()
+    assert [call[1] for call in provider.calls] == ["client0", "client1"]
+    assert metrics._pending["eu"] == ["client2", "client3", "client4"]
+
+    metrics.budgets["eu"] = RateBudget(rate=0, burst=2)
+    metrics.collect()
+    assert [call[1] for call in provider.calls[2:]] == ["client2", "client3"]
+
+
+def test_collect_client_raises_rate_limited_when_the_budget_is_exhausted():
+    provider = Provider(MACHINES, batch=False)
+    metrics = collector(provider, batch=False)
+    metrics.budgets["eu"] = RateBudget(rate=0.5, burst=1)
+    assert metrics.collect_client("alice", "eu") == [{"itemID": "vm1", "cpu": 1}, {"itemID": "vm3", "cpu": 1}]
+    with pytest.raises(RateLimited) as raised:
+        metrics.collect_client("alice", "eu")
+    assert raised.value.region == "eu"
+    assert 1 <= raised.value.retry_after <= 2
+    assert len(provider.calls) == 1
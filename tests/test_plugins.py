@@ -0,0 +1,122 @@
+import sys
+import uuid
+from types import SimpleNamespace
+import pytest
+from commons import plugins
+from commons.plugins import PluginRegistry
+
+METHODS = ["get_all_services", "setup_config"]
+
+PLUGIN = """
+def get_all_services(client_uuid, service_country=None):
+    return [{"id": "%(name)s"}], 200
+
+
+def setup_config(config):
+    return config
+"""
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    """A plugin root importable as a package, named uniquely so that no module is shared between tests."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    name = f"plugins_{uuid.uuid4().hex[:8]}"
+    (tmp_path / name).mkdir()
+    (tmp_path / name / "__init__.py").write_text("")
+    return tmp_path / name
+
+
+def add_plugin(root, name, source=None):
+    (root / f"service_{name}.py").write_text(source if source is not None else PLUGIN % {"name": name})
+
+
+def test_manifest_lists_the_plugins_without_importing_them(root):
+    add_plugin(root, "alpha")
+    add_plugin(root, "incomplete", "def get_all_services(client_uuid):\n    return [], 200\n")
+    registry = PluginRegistry([root.name], "service", METHODS, cache_path=None)
+
+    assert registry.names() == ["alpha"]
+    assert registry.manifest["alpha"]["methods"] == METHODS
+    assert f"{root.name}.service_alpha" not in sys.modules
+
+    assert registry["alpha"]["get_all_services"]("client") == ([{"id": "alpha"}], 200)
+    assert f"{root.name}.service_alpha" in sys.modules
+    assert registry.get("incomplete") is None
+
+
+def test_manifest_cache_is_reused_while_the_roots_are_unchanged(root, tmp_path, monkeypatch):
+    add_plugin(root, "alpha")
+    cache_path = str(tmp_path / "manifest.json")
+    PluginRegistry([root.name], "service", METHODS, cache_path=cache_path)
+
+    def scan(registry):
+        raise AssertionError("the plugins were scanned again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(PluginRegistry, "_scan", scan)
+        assert PluginRegistry([root.name], "service", METHODS, cache_path=cache_path).names() == ["alpha"]
+
+    add_plugin(root, "beta")
+    assert sorted(PluginRegistry([root.name], "service", METHODS, cache_path=cache_path).names()) == ["alpha", "beta"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(plugins, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_unknown_service_is_rejected_from_memory_until_the_ttl(root, clock, monkeypatch):
+    registry = PluginRegistry([root.name], "service", METHODS, cache_path=None, negative_ttl=60)
+    lookups = []
+    find = registry._find
+    monkeypatch.setattr(registry, "_find", lambda name: lookups.append(name) or find(name))
+
+    for _ in range(3):
+        with pytest.raises(LookupError, match="does not exist"):
+            registry.resolve("late")
+    assert lookups == ["late"]
+
+    # Added after startup: found once the rejection expires
+    add_plugin(root, "late")
+    with pytest.raises(LookupError):
+        registry.resolve("late")
+    clock.now += 61
+    assert registry.resolve("late")["get_all_services"]("client") == ([{"id": "late"}], 200)
+    assert lookups == ["late", "late"]
+    assert "late" not in registry._unknown
+
+
+def test_failed_import_is_rejected_until_the_ttl(root, clock):
+    add_plugin(root, "broken", "import missing_dependency\n\ndef get_all_services(): pass\n\ndef setup_config(): pass\n")
+    registry = PluginRegistry([root.name], "service", METHODS, cache_path=None, negative_ttl=60)
+
+    with pytest.raises(ImportError):
+        registry.resolve("broken")
+    with pytest.raises(LookupError, match="could not be imported"):
+        registry.resolve("broken")
+
+    add_plugin(root, "broken")
+    sys.modules.pop(f"{root.name}.service_broken", None)
+    clock.now += 61
+    assert registry.resolve("broken")["setup_config"]({"a": 1}) == {"a": 1}
+
+
+def test_names_that_cannot_be_plugins_are_rejected(root, clock):
+    (root.parent / "service_outside.py").write_text(PLUGIN % {"name": "outside"})
+    registry = PluginRegistry([root.name], "service", METHODS, cache_path=None)
+    for name in ("../outside", "outside", "a.b"):
+        with pytest.raises(LookupError):
+            registry.resolve(name)
+
+
+def test_negative_cache_is_bounded(root, clock, monkeypatch):
+    monkeypatch.setattr(plugins, "PLUGIN_NEGATIVE_MAX_ENTRIES", 3)
+    registry = PluginRegistry([root.name], "service", METHODS, cache_path=None)
+    for index in range(5):
+        with pytest.raises(LookupError):
+            registry.resolve(f"unknown{index}")
+    assert len(registry._unknown) <= 3
@@ -0,0 +1,57 @@
+from commons.catalog import ComputeOfferCatalog
+from commons.scoring import VmToleranceScorer, pci_key
+from commons.utils import check_vm_tolerance
+from models.ComputeModel import ElementoMachine, ElementoCpu, ElementoMemory, ElementoPciDev, ElementoMisc
+
+
+def machine(slots, capacity, frequency=2.0, ecc=False, pci=None, misc=None):
+    return ElementoMachine(
+        cpu=ElementoCpu(slots=slots, min_frequency=frequency, arch=["X86_64"], flags=[]),
+        mem=ElementoMemory(capacity=capacity, requireECC=ecc),
+        pci=pci,
+        misc=misc,
+    )
+
+
+def gpu(quantity):
+    return ElementoPciDev(vendor="nvidia", model="a100", quantity=quantity)
+
+
+def test_zero_quantity_devices_are_ignored_by_key_and_tolerance():
+    assert pci_key([gpu(0)]) == pci_key([]) == pci_key(None)
+    assert check_vm_tolerance(requested=machine(4, 8192, pci=[gpu(0)]), proposed=machine(4, 8192))
+    assert check_vm_tolerance(requested=machine(4, 8192), proposed=machine(4, 8192, pci=[gpu(0)]))
+    assert not check_vm_tolerance(requested=machine(4, 8192, pci=[gpu(1)]), proposed=machine(4, 8192))
+
+
+def test_rank_agrees_with_check_vm_tolerance():
+    misc = ElementoMisc(os_family="linux", os_flavour="ubuntu")
+    flavors = [
+        machine(4, 8192, misc=misc),
+        machine(4, 8192, pci=[gpu(1)], misc=misc),
+        machine(4, 8192, pci=[gpu(0)], misc=misc),
+        machine(4, 8000, misc=misc),
+        machine(8, 16384, misc=misc),
+    ]
+    requested = machine(4, 8192, misc=misc)
+    ranked = VmToleranceScorer(flavors).rank(requested, 0.1)
+    assert [flavor for flavor, _ in ranked] == [flavors[0], flavors[2], flavors[3]]
+    assert ranked[0][1] == 0
+    for flavor in flavors:
+        assert check_vm_tolerance(requested, flavor, 0.1) == any(
+            candidate is flavor for candidate, _ in ranked
+        )
+
+
+def test_closest_falls_back_to_the_best_candidate_within_tolerance():
+    # The nearest fit takes the frequency as a floor and lands on the bigger, out of tolerance, flavor
+    flavors = [machine(4, 8192, 1.95), machine(16, 65536, 2.0, ecc=True)]
+    catalog = ComputeOfferCatalog(loader=lambda region: flavors, refresh_interval=0)
+
+    proposed = catalog.closest(machine(4, 8192, 2.0), "region", 0.1)
+    assert (proposed.cpu.slots, proposed.mem.capacity, proposed.cpu.min_frequency) == (4, 8192, 1.95)
+    assert check_vm_tolerance(machine(4, 8192, 2.0), proposed, 0.1)
+
+    # No ECC flavor is within tolerance, the out of tolerance nearest fit is left to the caller to reject
+    proposed = catalog.closest(machine(4, 8192, 1.0, ecc=True), "region", 0.1)
+    assert not check_vm_tolerance(machine(4, 8192, 1.0, ecc=True), proposed, 0.1)
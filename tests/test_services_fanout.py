@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+import main_service
+
+
+@pytest.fixture
+def plugins(monkeypatch):
+    """Replaces the listed plugins with the given get_all_services functions, by service name."""
+
+    def install(**functions):
+        monkeypatch.setattr(main_service.services, "manifest", {name: {} for name in functions})
+        monkeypatch.setattr(
+            main_service.services,
+            "_services",
+            {name: {"get_all_services": function} for name, function in functions.items()},
+        )
+
+    return install
+
+
+@pytest.fixture
+def client():
+    return TestClient(main_service.app)
+
+
+def answer(services):
+    return lambda client_uuid, service_country=None: (services, 200)
+
+
+def fail(client_uuid, service_country=None):
+    raise RuntimeError("provider down")
+
+
+def test_all_plugins_answer(plugins, client):
+    plugins(first=answer([{"id": 1}]), second=answer([]))
+    response = client.get("/api/v1.0/running", headers={"client_uuid": "client"})
+    assert response.status_code == 200
+    assert response.json() == {"services": {"first": [{"id": 1}], "second": []}, "failed": []}
+
+
+def test_partial_failure_is_listed_in_failed(plugins, client):
+    plugins(first=answer([{"id": 1}]), broken=fail)
+    response = client.get("/api/v1.0/running", headers={"client_uuid": "client"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["services"] == {"first": [{"id": 1}]}
+    assert [(failure["service"], failure["status"]) for failure in body["failed"]] == [("broken", 500)]
+
+
+def test_provider_error_status_is_a_failure(plugins, client):
+    plugins(first=answer([]), refused=lambda client_uuid, service_country=None: ("quota", 429))
+    body = client.get("/api/v1.0/running", headers={"client_uuid": "client"}).json()
+    assert [(failure["service"], failure["status"]) for failure in body["failed"]] == [("refused", 429)]
+
+
+def test_all_plugins_failing_is_unavailable(plugins, client):
+    plugins(broken=fail, other=fail)
+    response = client.get("/api/v1.0/running", headers={"client_uuid": "client"})
+    assert response.status_code == 503
+
+
+def test_missing_client_uuid_is_rejected(plugins, client):
+    plugins(first=answer([]))
+    response = client.get("/api/v1.0/running")
+    assert response.status_code == 400
+
+
+def test_hung_plugin_is_abandoned_and_not_called_again(plugins, client, monkeypatch):
+    monkeypatch.setattr(main_service, "SERVICE_FANOUT_TIMEOUT", 0.05)
+    release = threading.Event()
+    calls = []
+
+    def hung(client_uuid, service_country=None):
+        calls.append(client_uuid)
+        release.wait(5)
+        return [], 200
+
+    plugins(first=answer([]), hung=hung)
+    for _ in range(2):
+        body = client.get("/api/v1.0/running", headers={"client_uuid": "client"}).json()
+        assert [(failure["service"], failure["status"]) for failure in body["failed"]] == [("hung", 504)]
+    # The second request did not take another worker while the first call was still running
+    assert len(calls) == 1
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while main_service.hung_calls.get("hung") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert main_service.hung_calls["hung"] == 0
@@ -0,0 +1,85 @@
+import time
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from commons import slowlog
+from commons.slowlog import RequestPhases, SlowRequestLog, SlowRequestMiddleware, count, phase
+
+
+def record(route, duration_ms):
+    return {"route": route, "duration_ms": duration_ms}
+
+
+def test_ring_keeps_the_last_records():
+    log = SlowRequestLog(size=2, path=None)
+    for duration_ms in (1, 2, 3):
+        log.add(record("/a", duration_ms))
+    assert [record["duration_ms"] for record in log.query()] == [3, 2]
+
+
+def test_query_filters_by_route_and_duration():
+    log = SlowRequestLog(size=10, path=None)
+    for route, duration_ms in [("/a", 600), ("/b", 900), ("/a", 1200), ("/a", 700)]:
+        log.add(record(route, duration_ms))
+    assert [record["duration_ms"] for record in log.query(route="/a", min_ms=650)] == [700, 1200]
+    assert [record["duration_ms"] for record in log.query(limit=1)] == [700]
+
+
+def test_nested_phases_are_exclusive():
+    request = RequestPhases()
+    token = slowlog._request.set(request)
+    try:
+        with phase("pricing"):
+            time.sleep(0.02)
+            with phase("provider"):
+                time.sleep(0.02)
+        count(vms=3)
+    finally:
+        slowlog._request.reset(token)
+    assert 0.015 <= request.phases["pricing"] < 0.035
+    assert 0.015 <= request.phases["provider"] < 0.035
+    assert request.counts == {"vms": 3}
+
+
+def test_phase_outside_a_request_is_a_no_op():
+    with phase("parsing") as current:
+        pass
+    assert current.request is None
+    count(vms=1)
+
+
+def slow_app(log):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def item(item_id: str):
+        with phase("provider"):
+            time.sleep(0.01)
+        count(items=1)
+        return {"id": item_id}
+
+    @app.get("/events")
+    def events():
+        return StreamingResponse(iter([b"data: x\n\n"]), media_type="text/event-stream")
+
+    app.add_middleware(SlowRequestMiddleware, threshold_ms=0, log=log)
+    return TestClient(app)
+
+
+def test_middleware_records_the_route_and_its_phases():
+    log = SlowRequestLog(size=10, path=None)
+    slow_app(log).get("/items/1", headers={"service_country": "region"})
+    [entry] = log.query()
+    assert entry["route"] == "/items/{item_id}"
+    assert entry["path"] == "/items/1"
+    assert entry["status_code"] == 200
+    assert entry["service_country"] == "region"
+    assert entry["counts"] == {"items": 1}
+    assert entry["phases_ms"]["provider"] >= 10
+    assert set(entry["phases_ms"]) == {"provider", "other"}
+
+
+def test_middleware_skips_event_streams():
+    log = SlowRequestLog(size=10, path=None)
+    slow_app(log).get("/events")
+    assert log.query() == []
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+import main_storage
+from commons.volumes import VolumeInventory
+from models.StorageModel import ElementoStorage
+
+
+def volume(volume_uuid, creator_id="alice", billing_uuid=None, size=10):
+    return ElementoStorage(
+        csp_region="region",
+        volume_uuid=volume_uuid,
+        creator_id=creator_id,
+        billing_uuid=billing_uuid or f"billing-{volume_uuid}",
+        name=volume_uuid,
+        size=size,
+    )
+
+
+class Provider:
+    """A fake storage provider, tracking the calls in flight."""
+
+    def __init__(self, *storages):
+        self.storages = {storage.volume_uuid: storage for storage in storages}
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def _call(self):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+
+    def by_id(self, volume_uuid, service_country):
+        if volume_uuid == "broken":
+            raise RuntimeError("provider down")
+        return self.storages.get(volume_uuid)
+
+    def create(self, storage_data, service_country):
+        self._call()
+        if storage_data.name == "fails":
+            raise RuntimeError("quota exceeded")
+        with self.lock:
+            self.created += 1
+            storage = volume(f"new{self.created}", storage_data.creator_id, size=storage_data.size)
+        storage.name = storage_data.name
+        self.storages[storage.volume_uuid] = storage
+        return storage
+
+    def destroy(self, volume_uuid, service_country):
+        self._call()
+        if volume_uuid == "undeletable":
+            raise RuntimeError("volume attached")
+        del self.storages[volume_uuid]
+        return volume_uuid
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = Provider(volume("v1"), volume("v2"), volume("undeletable"), volume("free", billing_uuid=None))
+    provider.storages["free"].billing_uuid = None
+    inventory = VolumeInventory(ttl=60)
+    inventory.register_loaders(provider.by_id)
+    monkeypatch.setattr(main_storage, "inventory", inventory)
+    monkeypatch.setattr(main_storage, "create_storage", provider.create)
+    monkeypatch.setattr(main_storage, "destroy_storage", provider.destroy)
+    monkeypatch.setattr(main_storage, "STORAGE_BULK_MAX", 20)
+    return provider
+
+
+@pytest.fixture
+def billing(monkeypatch):
+    calls = []
+
+    def update_billing_details_bulk(billing_uuids, status, reseller_id):
+        calls.append((sorted(billing_uuids), status))
+        return {
+            billing_uuid: RuntimeError("portal error") if billing_uuid == "billing-v2" else {"status": status}
+            for billing_uuid in billing_uuids
+        }
+
+    monkeypatch.setattr(main_storage, "update_billing_details_bulk", update_billing_details_bulk)
+    return calls
+
+
+@pytest.fixture
+def client():
+    return TestClient(main_storage.app, headers={"service_country": "region"})
+
+
+def create_payload(*names):
+    return {"volumes": [{"creatorID": "alice", "name": name, "size": 10} for name in names]}
+
+
+def test_bulk_create_reports_every_volume_in_order(provider, client):
+    response = client.post("/api/v1.0/create/bulk", json=create_payload("a", "fails", "b"))
+    assert response.status_code == 200
+    volumes = response.json()["volumes"]
+    assert [(entry["index"], entry["status"]) for entry in volumes] == [(0, 200), (1, 500), (2, 200)]
+    assert "quota exceeded" in volumes[1]["error"]
+    assert [volumes[index]["volume"]["name"] for index in (0, 2)] == ["a", "b"]
+    # Published in the inventory, so that /info answers without asking the provider
+    assert main_storage.inventory.cached(volumes[0]["volume"]["vid"], "region") is not None
+
+
+def test_run_bounded_limits_the_calls_in_flight(provider):
+    results = asyncio.run(main_storage.run_bounded(lambda index: provider.destroy(f"v{index}", "region"), [1, 2, 3], 2))
+    assert results[:2] == ["v1", "v2"]
+    assert isinstance(results[2], KeyError)
+    provider.storages.update({f"n{index}": volume(f"n{index}") for index in range(8)})
+    asyncio.run(main_storage.run_bounded(lambda index: provider.destroy(f"n{index}", "region"), range(8), 2))
+    assert provider.max_running == 2
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {},
+        {"volumes": []},
+        {"volumes": [{"creatorID": "alice", "name": "a", "size": 10}] * 21},
+        {"volumes": [{"creatorID": "alice", "name": "a", "size": 10}, {"name": "b", "size": -1}]},
+    ],
+)
+def test_bulk_create_validates_everything_before_creating(provider, client, payload):
+    response = client.post("/api/v1.0/create/bulk", json=payload)
+    assert response.status_code == 400
+    assert provider.created == 0
+
+
+def test_bulk_create_reports_the_wrong_fields_by_index(provider, client):
+    payload = {"volumes": [{"creatorID": "alice", "name": "a", "size": 10}, {"name": "b", "size": -1}]}
+    fields = [error["field"] for error in client.post("/api/v1.0/create/bulk", json=payload).json()["field_errors"]]
+    assert fields == ["volumes.1.creatorID", "volumes.1.size"]
+
+
+def test_bulk_destroy_reports_every_volume_and_stops_billing_once(provider, billing, client):
+    response = client.request(
+        "DELETE",
+        "/api/v1.0/destroy/bulk",
+        json={"volume_uuids": ["v1", "unknown", "v2", "undeletable", "broken", "free", "v1"]},
+    )
+    assert response.status_code == 200
+    volumes = {entry["uniqueID"]: entry for entry in response.json()["volumes"]}
+    assert [entry["uniqueID"] for entry in response.json()["volumes"]] == [
+        "v1", "unknown", "v2", "undeletable", "broken", "free"
+    ]
+    assert {volume_uuid: entry["status"] for volume_uuid, entry in volumes.items()} == {
+        "v1": 200, "unknown": 404, "v2": 200, "undeletable": 500, "broken": 500, "free": 200
+    }
+    # Only the destroyed volumes with a billing entry are stopped, in a single call
+    assert billing == [(["billing-v1", "billing-v2"], "STOP")]
+    assert "billing_error" not in volumes["v1"]
+    assert "portal error" in volumes["v2"]["billing_error"]
+    assert set(provider.storages) == {"undeletable"}
+    assert main_storage.inventory.cached("v1", "region") is None
+
+
+def test_bulk_destroy_billing_failure(provider, client, monkeypatch):
+    def update_billing_details_bulk(billing_uuids, status, reseller_id):
+        raise RuntimeError("portal unreachable")
+
+    monkeypatch.setattr(main_storage, "update_billing_details_bulk", update_billing_details_bulk)
+    response = client.request("DELETE", "/api/v1.0/destroy/bulk", json={"volume_uuids": ["v1"]})
+    assert response.status_code >= 500
+    assert "v1" not in provider.storages
+
+
+@pytest.mark.parametrize("payload", [{}, {"volume_uuids": []}, {"volume_uuids": [1]}, {"volume_uuids": ["v"] * 21}])
+def test_bulk_destroy_validates_the_ids(provider, billing, client, payload):
+    response = client.request("DELETE", "/api/v1.0/destroy/bulk", json=payload)
+    assert response.status_code == 400
+    assert billing == []
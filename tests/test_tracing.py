@@ -0,0 +1,53 @@
+import json
+from commons import tracing
+from commons.tracing import Span, SpanExporter
+
+
+def finished(name, parent=None):
+    span = Span(name, parent)
+    span.duration = 0.001
+    return span
+
+
+def test_ring_keeps_the_last_spans():
+    exporter = SpanExporter(size=3, path=None)
+    for index in range(5):
+        exporter.export(finished(f"op{index}"))
+    assert [span.name for span in exporter.spans] == ["op2", "op3", "op4"]
+
+
+def test_traces_groups_spans_by_trace():
+    exporter = SpanExporter(size=10, path=None)
+    root = finished("root")
+    exporter.export(finished("child", root))
+    exporter.export(root)
+    exporter.export(finished("other"))
+
+    traces = exporter.traces()
+    assert [trace["trace_id"] for trace in traces] == [exporter.spans[2].trace_id, root.trace_id]
+    assert [span["name"] for span in traces[1]["spans"]] == ["child", "root"]
+    assert exporter.traces(limit=1) == traces[:1]
+    assert exporter.traces(trace_id=root.trace_id) == traces[1:]
+
+
+def test_export_queues_spans_until_flushed(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FLUSH_INTERVAL", 3600)
+    path = tmp_path / "traces.jsonl"
+    exporter = SpanExporter(size=10, path=str(path))
+    exporter.export(finished("first"))
+    exporter.export(finished("second"))
+    assert not path.exists()
+
+    exporter.flush()
+    exporter.flush()
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["first", "second"]
+
+
+def test_flush_failure_is_logged_and_dropped(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(tracing, "TRACE_FLUSH_INTERVAL", 3600)
+    exporter = SpanExporter(size=10, path=str(tmp_path / "missing" / "traces.jsonl"))
+    exporter.export(finished("lost"))
+    exporter.flush()
+    assert "trace exporter" in caplog.text
+    assert exporter._pending == []
+    assert len(exporter.spans) == 1
@@ -0,0 +1,233 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from commons import volumes
+from commons.volumes import VolumeInventory
+from models.StorageModel import ElementoStorage
+
+
+class Provider:
+    """Volumes of a fake provider, counting the lookups it answers."""
+
+    def __init__(self, *storages):
+        self.storages = {storage.volume_uuid: storage for storage in storages}
+        self.calls = []
+
+    def by_id(self, volume_uuid, service_country):
+        self.calls.append(("id", volume_uuid))
+        return self.storages.get(volume_uuid)
+
+    def by_creator(self, creator_id, service_country):
+        self.calls.append(("creator", creator_id))
+        return [
+            storage
+            for storage in self.storages.values()
+            if storage.creator_id == creator_id or not storage.private
+        ]
+
+
+def volume(volume_uuid, creator_id="alice", size=10, private=True, bootable=False, shareable=False):
+    return ElementoStorage(
+        csp_region="region",
+        volume_uuid=volume_uuid,
+        creator_id=creator_id,
+        private=private,
+        bootable=bootable,
+        shareable=shareable,
+        size=size,
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(volumes, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def provider():
+    return Provider(volume("v1"), volume("v2"), volume("shared", creator_id="bob", private=False))
+
+
+@pytest.fixture
+def inventory(provider, clock):
+    inventory = VolumeInventory(ttl=60)
+    inventory.register_loaders(provider.by_id, creator_loader=provider.by_creator)
+    return inventory
+
+
+def test_get_is_served_from_memory_until_it_expires(inventory, provider, clock):
+    assert inventory.get("v1", "region") is provider.storages["v1"]
+    assert inventory.get("v1", "region") is provider.storages["v1"]
+    assert provider.calls == [("id", "v1")]
+
+    clock.now += 61
+    inventory.get("v1", "region")
+    assert provider.calls == [("id", "v1"), ("id", "v1")]
+
+
+def test_missing_volumes_are_not_cached(inventory, provider):
+    assert inventory.get("unknown", "region") is None
+    assert inventory.get("unknown", "region") is None
+    assert provider.calls == [("id", "unknown"), ("id", "unknown")]
+
+
+def test_regions_are_cached_apart(inventory, provider):
+    inventory.get("v1", "region")
+    inventory.get("v1", "other")
+    assert provider.calls == [("id", "v1"), ("id", "v1")]
+
+
+def test_listing_is_written_through(inventory, provider):
+    assert {storage.volume_uuid for storage in inventory.by_creator("alice", "region")} == {"v1", "v2", "shared"}
+
+    inventory.put(volume("v3"), "region", created=True)
+    inventory.remove("v1", "region")
+    assert {storage.volume_uuid for storage in inventory.by_creator("alice", "region")} == {"v2", "shared", "v3"}
+    assert inventory.get("v2", "region") is provider.storages["v2"]
+    assert provider.calls == [("creator", "alice")]
+
+
+def test_listing_expires(inventory, provider, clock):
+    inventory.by_creator("alice", "region")
+    clock.now += 61
+    inventory.by_creator("alice", "region")
+    assert provider.calls == [("creator", "alice"), ("creator", "alice")]
+
+
+def test_public_volume_drops_the_listings_of_the_other_creators(inventory, provider):
+    inventory.by_creator("alice", "region")
+    inventory.by_creator("carol", "region")
+    inventory.put(volume("public", creator_id="bob", private=False), "region", created=True)
+    inventory.by_creator("alice", "region")
+    inventory.by_creator("carol", "region")
+    assert provider.calls.count(("creator", "alice")) == 2
+    assert provider.calls.count(("creator", "carol")) == 2
+
+
+def test_private_volume_keeps_the_listings_of_the_other_creators(inventory, provider):
+    inventory.by_creator("carol", "region")
+    inventory.put(volume("private", creator_id="bob"), "region", created=True)
+    inventory.by_creator("carol", "region")
+    assert provider.calls == [("creator", "carol")]
+
+
+def test_invalidate_a_region(inventory, provider):
+    inventory.get("v1", "region")
+    inventory.get("v1", "other")
+    inventory.invalidate("region")
+    assert inventory.cached("v1", "region") is None
+    assert inventory.cached("v1", "other") is provider.storages["v1"]
+
+
+def test_eviction_past_max_entries_keeps_the_fresh_volumes(provider, clock):
+    inventory = VolumeInventory(ttl=60, max_entries=2)
+    inventory.put(volume("old"), "region")
+    clock.now += 61
+    inventory.put(volume("v1"), "region")
+    inventory.put(volume("v2"), "region")
+    assert inventory.cached("v1", "region") is not None
+    assert ("region", "old") not in inventory._volumes
+
+
+def test_get_many_batches_the_missing_volumes(inventory, provider):
+    batches = []
+
+    def batch_loader(volume_uuids, service_country):
+        batches.append(list(volume_uuids))
+        return [provider.storages[volume_uuid] for volume_uuid in volume_uuids if volume_uuid in provider.storages]
+
+    inventory.get("v1", "region")
+    results = asyncio.run(inventory.get_many(["v1", "v2", "unknown", "v2"], "region", batch_loader=batch_loader))
+    assert batches == [["v2", "unknown"]]
+    assert [storage.volume_uuid if storage is not None else None for storage, _ in results] == [
+        "v1", "v2", None, "v2"
+    ]
+    assert isinstance(results[2][1], LookupError)
+    assert inventory.cached("v2", "region") is provider.storages["v2"]
+
+
+def test_get_many_falls_back_to_single_lookups_without_batch_support(inventory, provider):
+    batches = []
+
+    def batch_loader(volume_uuids, service_country):
+        batches.append(list(volume_uuids))
+        return None
+
+    def loader(volume_uuid, service_country):
+        if volume_uuid == "broken":
+            raise RuntimeError("provider down")
+        return provider.by_id(volume_uuid, service_country)
+
+    results = asyncio.run(inventory.get_many(["v1", "broken"], "region", loader, batch_loader))
+    assert results[0] == (provider.storages["v1"], None)
+    assert results[1][0] is None and isinstance(results[1][1], RuntimeError)
+
+    asyncio.run(inventory.get_many(["v2"], "region", loader, batch_loader))
+    assert batches == [["v1", "broken"]]
+    assert ("id", "v2") in provider.calls
+
+
+def test_get_many_bounds_the_concurrent_lookups(inventory):
+    running = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def loader(volume_uuid, service_country):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+        return volume(volume_uuid)
+
+    results = asyncio.run(inventory.get_many([f"v{i}" for i in range(12)], "region", loader, concurrency=3))
+    assert all(error is None for _, error in results)
+    assert 1 <= running["max"] <= 3
+
+
+def usage_summary(usage):
+    return usage["volumes"], usage["size"], usage["bootable"], usage["shareable"]
+
+
+def test_usage_is_built_from_the_first_listing_only(inventory, provider):
+    usage = inventory.usage_of("alice", "region")
+    # The shared volume of bob is listed for alice but not counted
+    assert usage_summary(usage) == (2, 20, {"volumes": 0, "size": 0}, {"volumes": 0, "size": 0})
+    inventory.usage_of("alice", "region")
+    assert provider.calls == [("creator", "alice")]
+
+
+def test_usage_follows_the_writes(inventory):
+    inventory.usage_of("alice", "region")
+    inventory.put(volume("boot", size=30, bootable=True, shareable=True), "region", created=True)
+    inventory.put(volume("v2", size=15), "region")  # resized
+    inventory.remove("v1", "region")
+    inventory.remove("unknown", "region")
+    assert usage_summary(inventory.usage_of("alice", "region")) == (
+        2, 45, {"volumes": 1, "size": 30}, {"volumes": 1, "size": 30}
+    )
+
+
+def test_usage_ignores_untracked_creators(inventory, provider):
+    inventory.put(volume("v9", creator_id="dave"), "region", created=True)
+    assert inventory.usage.get("dave", "region") is None
+    assert usage_summary(inventory.usage_of("dave", "region"))[0] == 0
+    assert ("creator", "dave") in provider.calls
+
+
+def test_usage_reset_replaces_the_previous_totals(inventory, provider, clock):
+    inventory.usage_of("alice", "region")
+    del provider.storages["v1"]
+    clock.now += 61
+    inventory.by_creator("alice", "region")
+    assert usage_summary(inventory.usage_of("alice", "region"))[:2] == (1, 10)
+
+
+def test_usage_invalidated_with_its_region(inventory):
+    inventory.usage_of("alice", "region")
+    inventory.invalidate("region")
+    assert inventory.usage.get("alice", "region") is None